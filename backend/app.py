@@ -1,11 +1,29 @@
-from flask import Flask, request, jsonify, send_file
-import cv2
-import pandas as pd
+from flask import Flask, request, jsonify, send_file, Response, g
+import numpy as np
 from flask_cors import CORS
+from werkzeug.utils import safe_join
 import os
+import json
+import base64
+import hashlib
+import time
 import logging
-import subprocess
-from assesment import get_edge_frames, StoredResultsAssessment, load_tracking_results_from_csv
+from assesment import get_edge_frames
+from track_index import track_intervals, TRACK_STATES
+from merge_suggestions import (merge_suggestions, MERGE_MAX_GAP_FRAMES, MERGE_MAX_DISTANCE, MERGE_GAP_LIMIT,
+                               MERGE_DISTANCE_LIMIT)
+from video_rendering import (render_video, rerender_frames, render_settings, processed_output_path,
+                             draw_bounding_boxes_proxy, discard_segment_manifest, segmented_render_matches,
+                             RENDER_BACKENDS, SEGMENTED_BACKENDS)
+from render_cache import render_cache
+from render_jobs import render_jobs
+from tracking_store import (tracking_store, sort_by_frame, tracking_data_digest, detect_tracking_format,
+                            FORMAT_PROBE_BYTES)
+from remap_journal import resolve_id_mapping
+from upload_sessions import upload_sessions, UploadError
+from workspaces import workspaces, DEFAULT_WORKSPACE
+from thumbnails import track_thumbnails, sprite_sheet, encode_jpeg, THUMBNAIL_SIZE
+from metrics import metrics
 
 start_frames=[]
 end_frames=[]
@@ -18,10 +36,39 @@ os.makedirs('temp', exist_ok=True)
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 
+HTTP_REQUEST_SECONDS = metrics.summary('http_request_seconds', 'Seconds spent serving requests',
+                                       ['endpoint', 'method', 'status'])
+RENDER_FPS = metrics.gauge('render_frames_per_second', 'Frame rate of the last render job', ['backend'])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request_time(response):
+    started = g.get('request_started')
+    if started is not None and request.url_rule is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.url_rule.rule,
+                                     method=request.method, status=response.status_code)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """ API endpoint exporting the stage timers and counters in the Prometheus text format. """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/get-frame-numbers', methods=['GET'])
 def get_frame_numbers():
     try:
-        csv_path = get_uploaded_csv_path()
+        workspace = get_workspace()
+        if workspace is None:
+            return jsonify({'error': 'Workspace not found'}), 404
+
+        csv_path = workspace.csv_path
         if not csv_path:
             return jsonify({'error': 'CSV file not found'}), 400
 
@@ -44,91 +91,91 @@ def get_frame_numbers():
 
 def get_track_end_frames_with_ids(csv_path):
     """Returns list of (end_frame, track_id) tuples preserving original order"""
-    results = load_tracking_results_from_csv(csv_path)
-    if not results:
-        return []
-
-    assessment = StoredResultsAssessment()
-    assessment.process_stored_results(results)
-    tracks_summary = assessment.get_tracks_summary()
-    
+    # The tracks of the assessment, from the interval index cached for the CSV content
+    index = track_intervals(csv_path, min_confidence=0.3)
+
     # Return as list of tuples (end_frame-20, original_track_id)
     return [
-        (max(summary['end_frame'] - 20,0), track_id)
-        for track_id, summary in tracks_summary.items()
+        (max(end_frame - 20, 0), track_id)
+        for track_id, end_frame in zip(index.track_ids.tolist(), index.end_frames.tolist())
     ]
 
-# Global variable to store video path temporarily
-video_storage = {}
-def draw_bounding_boxes(video_path, csv_path):
+
+@app.route('/tracks/<state>', methods=['GET'])
+def get_tracks(state):
     """
-    Processes the video by drawing bounding boxes based on the CSV file.
+    API endpoint listing the tracks that are 'active', 'starting' or 'ending' in frames start to end
+    (inclusive; 'frame' for a single one), with their first and last frames. With 'visible' set, active
+    tracks must be detected in the range rather than merely span it. Answered from an interval index
+    built once per CSV content, in logarithmic time.
     """
+    if state not in TRACK_STATES:
+        return jsonify({'error': f'Unknown track state: {state}'}), 404
     try:
-        # Read CSV file
-        data = pd.read_csv(csv_path)
-        logging.info(f"CSV data preview: {data.head()}")
-
-        # Open the video
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise ValueError(f"Unable to open video file: {video_path}")
-        logging.info("Video file opened successfully.")
-
-        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        fourcc = cv2.VideoWriter_fourcc(*'MJPG')  # Change from 'mp4v' to 'XVID'
-
-        
-        #output_path = os.path.join('temp', os.path.basename(video_path).replace('.mp4', '_processed.mp4'))
-        output_path = os.path.join('temp', os.path.basename(video_path).replace('.mp4', '_processed.avi'))
-
-        logging.info(f"Output video path: {output_path}")
-
-
-
-        logging.info(f"Video Properties - Width: {frame_width}, Height: {frame_height}, FPS: {fps}")
-
-
-        out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
-        if not out.isOpened():
-            raise ValueError(f"Unable to initialize video writer at {output_path}")
-
-        frame_idx = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
+        start = int(request.args['frame'] if 'frame' in request.args else request.args['start'])
+        end = int(request.args.get('end', start)) if 'frame' not in request.args else start
+    except (KeyError, ValueError):
+        return jsonify({'error': "Integer 'frame', or 'start' and optionally 'end', is required"}), 400
+
+    workspace = get_workspace()
+    if workspace is None:
+        return jsonify({'error': 'Workspace not found'}), 404
+    if not workspace.csv_path:
+        return jsonify({'error': 'CSV file not found'}), 400
+
+    index = track_intervals(workspace.csv_path)
+    tracks = index.query(state, start, end, visible=is_enabled(request.args.get('visible')))
+    return jsonify({
+        'state': state,
+        'start': start,
+        'end': end,
+        'count': len(tracks),
+        'track_ids': index.track_ids[tracks].tolist(),
+        'start_frames': index.start_frames[tracks].tolist(),
+        'end_frames': index.end_frames[tracks].tolist(),
+        'gaps': index.gap_counts[tracks].tolist()
+    }), 200
+
+def get_workspace():
+    """
+    Returns the workspace the request addresses with the 'X-Workspace-Id' header or a
+    'workspace_id' parameter, the default workspace when it names none, or None if unknown.
+    """
+    workspace_id = request.headers.get('X-Workspace-Id') or request.args.get('workspace_id')
+    if not workspace_id and request.mimetype == 'multipart/form-data':
+        workspace_id = request.form.get('workspace_id')
+    if not workspace_id and request.is_json:
+        workspace_id = (request.get_json(silent=True) or {}).get('workspace_id')
+    return workspaces.get(workspace_id or DEFAULT_WORKSPACE)
 
-            # Filter bounding boxes for the current frame
-            frame_boxes = data[data['frame'] == frame_idx]
-            logging.info(f"Processing frame {frame_idx}, boxes: {len(frame_boxes)}")
 
-            for _, row in frame_boxes.iterrows():
-                # Extract bounding box coordinates and metadata
-                x1, y1, x2, y2 = int(row['x1']), int(row['y1']), int(row['x2']), int(row['y2'])
-                track_id, class_id, confidence = row['track_id'], row['class_id'], row['confidence']
+@app.route('/workspaces', methods=['POST'])
+def create_workspace():
+    """ API endpoint creating an empty workspace; its ID addresses it in all other endpoints. """
+    workspace = workspaces.create()
+    return jsonify(workspace.to_dict()), 201
 
-                # Draw bounding box
-                color = (0, 255, 0)
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
 
-                # Add label
-                label = f'ID: {track_id}, Class: {class_id}, Conf: {confidence:.2f}'
-                cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+@app.route('/workspaces/<workspace_id>', methods=['GET'])
+def get_workspace_state(workspace_id):
+    """ API endpoint reporting the video and CSV file of a workspace. """
+    workspace = workspaces.get(workspace_id)
+    if workspace is None:
+        return jsonify({'error': 'Workspace not found'}), 404
+    return jsonify(workspace.to_dict()), 200
 
-            out.write(frame)
-            frame_idx += 1
 
-        cap.release()
-        out.release()
-        logging.info("Video processing complete.")
-        return output_path
+@app.route('/workspaces/<workspace_id>', methods=['DELETE'])
+def delete_workspace(workspace_id):
+    """ API endpoint removing a workspace with all its files. """
+    try:
+        workspace = workspaces.delete(workspace_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if workspace is None:
+        return jsonify({'error': 'Workspace not found'}), 404
+    return jsonify({'success': True}), 200
 
-    except Exception as e:
-        logging.error(f"Error processing video: {e}")
-        raise
 
 @app.route('/save-logs', methods=['POST'])
 def save_logs():
@@ -138,32 +185,35 @@ def save_logs():
     if not logs:
         return jsonify({"message": "No logs received"}), 400
 
-    # Retrieve the uploaded CSV file path
-    uploaded_csv_file = next((file for file in os.listdir('temp') if file.endswith('.csv')), None)
+    workspace = get_workspace()
+    if workspace is None:
+        return jsonify({"message": "Workspace not found"}), 404
 
-    if not uploaded_csv_file:
+    # Retrieve the uploaded CSV file path
+    csv_path = workspace.csv_path
+    if not csv_path:
         return jsonify({"message": "CSV file is missing or not found"}), 400
 
-    # Construct full path to the original CSV file
-    original_csv_path = os.path.join('temp', uploaded_csv_file)
+    backend = data.get('backend')
+    if backend and backend not in RENDER_BACKENDS:
+        return jsonify({'success': False, 'error': f'Unknown render backend: {backend}'}), 400
 
-    # Load the CSV
-    df = pd.read_csv(original_csv_path)
-    csv_path = get_uploaded_csv_path()
-    if not csv_path:
-        return jsonify({'success': False, 'error': 'CSV file is missing or not found'}), 400
-    # Apply each change (mapping old ID to new ID)
-    for log in logs:
-        old_id = log.get('A')  # Old ID
-        new_id = log.get('B')  # New ID
-
-        update_csv_ids(csv_path, old_id, new_id)
-    
-    mp4_output_path, error = process_video_with_updated_csv(csv_path)
-    if error:
-        return jsonify({'success': False, 'error': error}), 400
-
-    return jsonify({'success': True, 'new_video': os.path.basename(mp4_output_path)}), 200
+    # Resolve all changes (old ID A to new ID B, in log order) into one mapping
+    try:
+        changes = [(int(log.get('A')), int(log.get('B'))) for log in logs]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Track IDs must be integers'}), 400
+    mapping = resolve_id_mapping(changes)
+
+    # Record the whole batch as one undoable edit; the CSV itself is not rewritten
+    with workspace.lock:
+        row_counts, touched_frames = tracking_store.edit(csv_path, changes)
+
+    updated_rows = [
+        {'old_id': old_id, 'new_id': new_id, 'rows': row_counts[old_id]}
+        for old_id, new_id in mapping.items()
+    ]
+    return render_edit('save-logs', workspace, data, touched_frames, updated_rows=updated_rows)
 
 
 # Route to handle video upload
@@ -178,12 +228,16 @@ def upload_video():
         if not video_file:
             return jsonify({'error': 'Video file is required'}), 400
 
-        video_path = os.path.join('temp', video_file.filename)
+        workspace = get_workspace()
+        if workspace is None:
+            return jsonify({'error': 'Workspace not found'}), 404
+
+        video_path = workspace.file_path(video_file.filename)
         video_file.save(video_path)
         logging.info(f"Received video: {video_path}")
 
-        # Store the video path in global memory
-        video_storage['video_path'] = video_path
+        workspace.video_path = video_path
+        workspace.video_digest = None
 
         return jsonify({'success': True}), 200
 
@@ -195,8 +249,13 @@ def upload_video():
 def upload_files():
     """
     API endpoint to receive only CSV, process the video, and return the processed MP4 video file.
+    The 'csv' file may also be a Parquet or NPZ table of the same columns, or MOTChallenge text.
+    The optional 'backend' form field selects the render backend ('segments', 'parallel', 'pipe' or 'avi').
+    With the 'async' form field set, the render job ID is returned immediately instead.
+    The 'proxy' form field has a low-resolution proxy rendered before the full video. Async requests do so
+    by default and the job status announces it as 'preview'; other requests get the proxy in response as
+    soon as it is ready, with the render job of the full video in the X-Render-Job header.
     """
-    avi_output_path = None
     mp4_output_path = None
 
     try:
@@ -206,27 +265,43 @@ def upload_files():
         if not csv_file:
             return jsonify({'error': 'CSV file is required'}), 400
 
+        backend = request.form.get('backend')
+        if backend and backend not in RENDER_BACKENDS:
+            return jsonify({'error': f'Unknown render backend: {backend}'}), 400
+
+        workspace = get_workspace()
+        if workspace is None:
+            return jsonify({'error': 'Workspace not found'}), 404
+
+        try:
+            detect_tracking_format(csv_file.stream.read(FORMAT_PROBE_BYTES), csv_file.filename or '')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        csv_file.stream.seek(0)
+
         # Save CSV file temporarily
-        csv_path = os.path.join('temp', csv_file.filename)
-        csv_file.save(csv_path)
+        csv_path = workspace.file_path(csv_file.filename)
+        with workspace.lock:
+            csv_file.save(csv_path)
+            tracking_store.invalidate(csv_path)
+            workspace.set_csv(csv_path)
         logging.info(f"Received CSV: {csv_path}")
 
-        # Retrieve the video path from the storage
-        video_path = video_storage.get('video_path')
-
-        if not video_path or not os.path.exists(video_path):
+        # Process the video with CSV into the final MP4 on the render workers
+        asynchronous = is_enabled(request.form.get('async'))
+        proxy = wants_proxy(request.form.get('proxy'), asynchronous)
+        job, error = submit_render('upload', workspace, backend, proxy=proxy)
+        if error:
             return jsonify({'error': 'Video file is missing, please upload it first through /upload-video'}), 400
+        if asynchronous:
+            return jsonify({'success': True, **job_reference(job)}), 202
 
-        # Process the video with CSV
-        avi_output_path = draw_bounding_boxes(video_path, csv_path)
-
-        # Convert the AVI output to MP4
-        mp4_output_path = avi_output_path.replace('.avi', '.mp4')
-        convert_to_mp4(avi_output_path, mp4_output_path)
+        if proxy and wait_for_preview(job):
+            response = send_file(os.path.abspath(os.path.join('temp', job.preview)), as_attachment=True)
+            response.headers['X-Render-Job'] = job_reference(job)['status_url']
+            return response
 
-        # Ensure MP4 output video path is valid
-        if not os.path.exists(mp4_output_path):
-            raise ValueError(f"Processed MP4 video not found: {mp4_output_path}")
+        mp4_output_path = os.path.join('temp', job.future.result()['new_video'])
 
         # Send the processed MP4 video as a response
         return send_file(mp4_output_path, as_attachment=True)
@@ -236,92 +311,668 @@ def upload_files():
         return jsonify({'error': f"Internal Server Error: {str(e)}"}), 500
 
 
-@app.route('/temp/<filename>', methods=['GET'])
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    API endpoint starting a chunked upload of a video or CSV file. Expects JSON with
+    'kind' ('video' or 'csv'), 'filename' and 'size'; returns the upload ID and chunk size.
+    Like with /upload, a 'csv' may be any tracking file format the tracking store reads.
+    """
+    workspace = get_workspace()
+    if workspace is None:
+        return jsonify({'error': 'Workspace not found'}), 404
+
+    data = request.json or {}
+    try:
+        session = upload_sessions.create(data.get('kind'), data.get('filename'), int(data.get('size', -1)),
+                                         workspace.id)
+    except (TypeError, ValueError):
+        return jsonify({'error': "Integer 'size' is required"}), 400
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify(session.to_dict()), 201
+
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """ API endpoint reporting the offset an interrupted upload resumes from. """
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(session.to_dict()), 200
+
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """
+    API endpoint appending the raw request body to the upload. The 'Upload-Offset' header
+    (or 'offset' parameter) must match the upload's current offset.
+    """
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset', '')))
+    except ValueError:
+        return jsonify({'error': "Integer 'Upload-Offset' header is required"}), 400
+
+    try:
+        upload_sessions.append(session, offset, request.stream)
+    except UploadError as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), e.status
+    except Exception as e:
+        logging.error(f"Error in /uploads/{upload_id}: {e}")
+        return jsonify({'error': str(e), 'offset': session.offset}), 500
+
+    return jsonify(session.to_dict()), 200
+
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """
+    API endpoint finishing a chunked upload, optionally checking its 'sha1'. A video becomes
+    the uploaded video, like /upload-video; a CSV starts the render, like /upload. Without 'async', a
+    requested 'proxy' is returned as 'preview' as soon as it is ready, along with the job of the full render.
+    """
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    data = request.json or {}
+    backend = data.get('backend')
+    if backend and backend not in RENDER_BACKENDS:
+        return jsonify({'error': f'Unknown render backend: {backend}'}), 400
+
+    workspace = workspaces.get(session.workspace_id)
+    if workspace is None:
+        return jsonify({'error': 'Workspace not found'}), 404
+
+    if session.kind == 'csv':
+        try:
+            detect_tracking_format(read_head(session.path or session.part_path), session.filename)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    try:
+        with workspace.lock:
+            path = upload_sessions.complete(session, data.get('sha1'), workspace.directory)
+            if session.kind == 'csv':
+                tracking_store.invalidate(path)
+                workspace.set_csv(path)
+    except UploadError as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), e.status
+
+    if session.kind == 'video':
+        workspace.video_path = path
+        workspace.video_digest = session.digest
+        render_cache.remember_video_digest(path, session.digest)
+        logging.info(f"Received video: {path}")
+        return jsonify({'success': True, 'sha1': session.digest}), 200
+
+    logging.info(f"Received CSV: {path}")
+
+    asynchronous = is_enabled(data.get('async'))
+    proxy = wants_proxy(data.get('proxy'), asynchronous)
+    job, error = submit_render('upload', workspace, backend, proxy=proxy)
+    if error:
+        return jsonify({'error': error}), 400
+    if asynchronous:
+        return jsonify({'success': True, 'sha1': session.digest, **job_reference(job)}), 202
+    if proxy and wait_for_preview(job):
+        return jsonify({'success': True, 'sha1': session.digest, 'preview': job.preview, **job_reference(job)}), 202
+
+    mp4_output_path, error = wait_for_render(job)
+    if error:
+        return jsonify({'error': error}), 400
+    return jsonify({'success': True, 'sha1': session.digest, 'new_video': temp_file_name(mp4_output_path)}), 200
+
+
+def read_head(path):
+    """ Returns the first FORMAT_PROBE_BYTES of the file at path, nothing when it does not exist. """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(FORMAT_PROBE_BYTES)
+    except FileNotFoundError:
+        return b''
+
+
+def render_etag(path):
+    """
+    Strong ETag of a rendered file. Renders replace their output file, so its inode,
+    size and modification time identify the render without hashing the video.
+    """
+    stat = os.stat(path)
+    identity = f'{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}'
+    return hashlib.sha1(identity.encode()).hexdigest()
+
+
+@app.route('/temp/<path:filename>', methods=['GET'])
 def get_processed_video(filename):
     """
-    Serve the processed video file.
+    Serve the processed video file, by its path under temp/. Range requests are answered with partial content,
+    and clients revalidate with the ETag so an unchanged render is never re-downloaded.
     """
     try:
-        return send_file(os.path.join('temp', filename), as_attachment=False)
+        path = safe_join('temp', filename)
+        if path is None or not os.path.isfile(path):
+            raise FileNotFoundError(filename)
+        response = send_file(os.path.abspath(path), as_attachment=False, conditional=True,
+                             etag=render_etag(path), max_age=0)
+        # The URL of a render stays the same across re-renders, so always revalidate
+        response.cache_control.no_cache = True
+        return response
     except Exception as e:
         logging.error(f"Error serving video file {filename}: {e}")
         return jsonify({'error': 'File not found'}), 404
  
 
-def get_uploaded_csv_path():
-    """ Retrieves the path of the uploaded CSV file. """
-    uploaded_csv_file = next((file for file in os.listdir('temp') if file.endswith('.csv')), None)
-    return os.path.join('temp', uploaded_csv_file) if uploaded_csv_file else None
+# Binary record layout of /annotations?format=binary, little-endian, 32 bytes per row
+ANNOTATION_RECORD = np.dtype([
+    ('frame', '<i4'), ('track_id', '<i4'), ('class_id', '<i4'), ('confidence', '<f4'),
+    ('x1', '<f4'), ('y1', '<f4'), ('x2', '<f4'), ('y2', '<f4')
+])
+
+
+def parse_id_list(value):
+    """ Parses a comma-separated list of integer IDs; None when not given. """
+    if not value:
+        return None
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+@app.route('/annotations', methods=['GET'])
+def get_annotations():
+    """
+    API endpoint serving the tracking rows of frames start <= frame < end, sorted by frame,
+    so the client can draw the boxes over the original video itself.
+    Optional 'track_ids' / 'class_ids' (comma-separated) filter the rows; 'format' is
+    'json' (packed columns) or 'binary' (ANNOTATION_RECORD records).
+    """
+    try:
+        start = int(request.args['start'])
+        end = int(request.args['end'])
+        track_ids = parse_id_list(request.args.get('track_ids'))
+        class_ids = parse_id_list(request.args.get('class_ids'))
+    except (KeyError, ValueError):
+        return jsonify({'error': "Integer 'start' and 'end' are required"}), 400
+
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'binary'):
+        return jsonify({'error': f'Unknown format: {output_format}'}), 400
+
+    workspace = get_workspace()
+    if workspace is None:
+        return jsonify({'error': 'Workspace not found'}), 404
+
+    csv_path = workspace.csv_path
+    if not csv_path:
+        return jsonify({'error': 'CSV file not found'}), 400
+
+    # Frame-sorted rows are built once per CSV content; the window is two binary searches
+    data = tracking_store.derived(csv_path, 'by_frame', sort_by_frame)
+    first, last = np.searchsorted(data.frame, [start, end])
+    window = data.take(slice(first, max(first, last)))
+
+    if track_ids is not None or class_ids is not None:
+        rows = np.ones(len(window), dtype=bool)
+        if track_ids is not None:
+            rows &= np.isin(window.track_id, track_ids)
+        if class_ids is not None:
+            rows &= np.isin(window.class_id, class_ids)
+        window = window.take(rows)
+
+    if output_format == 'binary':
+        records = np.empty(len(window), dtype=ANNOTATION_RECORD)
+        records['frame'] = window.frame
+        records['track_id'] = window.track_id
+        records['class_id'] = window.class_id
+        records['confidence'] = window.confidence
+        for column, name in enumerate(('x1', 'y1', 'x2', 'y2')):
+            records[name] = window.boxes[:, column]
+
+        response = Response(records.tobytes(), mimetype='application/octet-stream')
+        response.headers['X-Annotation-Count'] = str(len(records))
+        response.headers['X-Annotation-Fields'] = ','.join(
+            f'{name}:{ANNOTATION_RECORD[name].str}' for name in ANNOTATION_RECORD.names)
+        response.headers['Access-Control-Expose-Headers'] = 'X-Annotation-Count, X-Annotation-Fields'
+        return response
+
+    return jsonify({
+        'start': start,
+        'end': end,
+        'count': len(window),
+        'frame': window.frame.tolist(),
+        'track_id': window.track_id.tolist(),
+        'class_id': window.class_id.tolist(),
+        'confidence': np.round(window.confidence.astype(float), 3).tolist(),
+        # x1, y1, x2, y2 of each row, flattened
+        'boxes': np.round(window.boxes.astype(float), 2).reshape(-1).tolist()
+    }), 200
+
+
+# Largest number of thumbnails one request may ask for
+MAX_THUMBNAILS = 1000
+
+
+def track_boundary_rows(data, at='end'):
+    """ Returns the row of the last (at='end') or first (at='start') frame of every track, by track ID. """
+    order = np.lexsort((data.frame, data.track_id))
+    track_ids = data.track_id[order]
+    if at == 'end':
+        boundaries = np.flatnonzero(np.append(track_ids[1:] != track_ids[:-1], True))
+    else:
+        boundaries = np.flatnonzero(np.insert(track_ids[1:] != track_ids[:-1], 0, True))
+    return order[boundaries]
+
+
+@app.route('/thumbnails', methods=['GET'])
+def get_thumbnails():
+    """
+    API endpoint returning a thumbnail of the last (or, with at=start, first) frame of tracks with
+    the track's box drawn, read by seeking in the source video instead of streaming the render.
+    'track_ids' (comma-separated, default all tracks), 'mode' ('crop' around the box or whole
+    'frame'), 'size' (longest side) and 'format' ('json' with base64 JPEGs, or 'sprite': one JPEG
+    sheet of 'columns' cells per row, described by the X-Sprite-* headers).
+    """
+    try:
+        track_ids = parse_id_list(request.args.get('track_ids'))
+        size = int(request.args.get('size', THUMBNAIL_SIZE))
+        columns = int(request.args.get('columns', 10))
+    except ValueError:
+        return jsonify({'error': "'track_ids', 'size' and 'columns' must be integers"}), 400
+
+    at = request.args.get('at', 'end')
+    mode = request.args.get('mode', 'crop')
+    output_format = request.args.get('format', 'json')
+    if at not in ('start', 'end') or mode not in ('crop', 'frame') or output_format not in ('json', 'sprite'):
+        return jsonify({'error': "Invalid 'at', 'mode' or 'format'"}), 400
+    if not 16 <= size <= 1024 or columns < 1:
+        return jsonify({'error': "'size' must be between 16 and 1024 and 'columns' positive"}), 400
+
+    workspace = get_workspace()
+    if workspace is None:
+        return jsonify({'error': 'Workspace not found'}), 404
+    if not workspace.csv_path or not workspace.video_path:
+        return jsonify({'error': 'Video or CSV file is missing'}), 400
+
+    try:
+        data = tracking_store.load(workspace.csv_path)
+        rows = track_boundary_rows(data, at)
+        if track_ids is not None:
+            rows = rows[np.isin(data.track_id[rows], track_ids)]
+        if len(rows) > MAX_THUMBNAILS:
+            return jsonify({'error': f'At most {MAX_THUMBNAILS} thumbnails per request'}), 400
+
+        selected = data.take(rows)
+        thumbnails = track_thumbnails(workspace.video_path, selected, mode, size)
+        items = [
+            (int(track_id), int(frame), thumbnails.get(row))
+            for row, (track_id, frame) in enumerate(zip(selected.track_id, selected.frame))
+        ]
+    except Exception as e:
+        logging.error(f"Error in /thumbnails: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    if output_format == 'sprite':
+        # More columns than thumbnails would only widen the sheet with empty cells
+        columns = min(columns, max(len(items), 1))
+        sheet = sprite_sheet([image for _, _, image in items], columns, size)
+        response = Response(encode_jpeg(sheet), mimetype='image/jpeg')
+        response.headers['X-Sprite-Cell-Size'] = str(size)
+        response.headers['X-Sprite-Columns'] = str(columns)
+        response.headers['X-Sprite-Track-Ids'] = ','.join(str(track_id) for track_id, _, _ in items)
+        response.headers['X-Sprite-Frames'] = ','.join(str(frame) for _, frame, _ in items)
+        response.headers['Access-Control-Expose-Headers'] = \
+            'X-Sprite-Cell-Size, X-Sprite-Columns, X-Sprite-Track-Ids, X-Sprite-Frames'
+        return response
+
+    return jsonify({'thumbnails': [
+        {
+            'track_id': track_id,
+            'frame': frame,
+            'image': 'data:image/jpeg;base64,' + base64.b64encode(encode_jpeg(image)).decode()
+        }
+        for track_id, frame, image in items if image is not None
+    ]}), 200
 
 
 def update_csv_ids(csv_path, current_id, new_id):
-    """ Updates the track_id in the CSV file. """
-    df = pd.read_csv(csv_path)
-    df.loc[df['track_id'] == int(current_id), 'track_id'] = int(new_id)
-    df.to_csv(csv_path, index=False)
-    logging.info(f"Updated track_id {current_id} to {new_id} in {csv_path}")
+    """ Records the track_id change for the CSV file. Returns the frame numbers of the changed rows. """
+    _, touched_frames = tracking_store.edit(csv_path, [(current_id, new_id)])
+    return touched_frames
 
 
-def process_video_with_updated_csv(csv_path):
-    """ Processes the video using the updated CSV file and converts it to MP4. """
-    video_path = video_storage.get('video_path')
+def render_job(video_path, csv_path, backend=None, touched_frames=None, proxy=False, progress=None):
+    """
+    Render worker entry point. Renders the video with the CSV file into an MP4 with the given render backend.
+    When touched_frames is given, only the parts of the previous render covering those frames are re-rendered.
+    A render of the same video, tracking data and settings made before is taken from the render cache instead.
+    With proxy set, a full render is preceded by a quick low-resolution one, announced as the job's preview.
+    """
+    # One snapshot of the tracking data for the whole job, so that an edit landing meanwhile is
+    # neither drawn into this render nor cached under its key
+    data, digest = tracking_store.load_with_digest(csv_path)
+    tracking_digest = tracking_store.derived_value(data, digest, 'content_digest', tracking_data_digest)
+    settings = render_settings(backend)
+    cache_key = render_cache.key(render_cache.video_digest(video_path), tracking_digest, settings)
+
+    mp4_output_path = processed_output_path(video_path, '.mp4')
+    if render_cache.fetch(cache_key, mp4_output_path):
+        # The segments of the previous render no longer match the MP4
+        discard_segment_manifest(video_path)
+    else:
+        if proxy and touched_frames is None and progress is not None:
+            try:
+                progress.set_preview(temp_file_name(draw_bounding_boxes_proxy(video_path, csv_path, data=data)))
+            except Exception as e:
+                # The full render still follows
+                logging.error(f"Error rendering proxy: {e}")
+        started = time.time()
+        if touched_frames is None:
+            mp4_output_path = render_video(video_path, csv_path, backend, progress, data)
+            complete = True
+        else:
+            mp4_output_path = rerender_frames(video_path, csv_path, touched_frames, backend, progress, data)
+            # Spliced from segments: cached only if every one of them was drawn from the snapshot
+            complete = (settings['backend'] not in SEGMENTED_BACKENDS or
+                        segmented_render_matches(video_path, csv_path, data))
+        if complete:
+            render_cache.store(cache_key, mp4_output_path)
+        else:
+            logging.warning(f"Not caching {mp4_output_path}: its segments do not all match the tracking data")
+        if progress is not None and progress.frames_processed:
+            RENDER_FPS.set(progress.frames_processed / (time.time() - started), backend=settings['backend'])
+    return {'new_video': temp_file_name(mp4_output_path)}
+
+
+def temp_file_name(path):
+    """ Returns the name under which /temp/ serves a file of a workspace. """
+    return os.path.relpath(path, 'temp').replace(os.sep, '/')
+
+
+def submit_render(kind, workspace, backend=None, touched_frames=None, proxy=False):
+    """ Queues a render of the workspace's video with its CSV file. Returns (job, error). """
+    video_path = workspace.video_path
+    csv_path = workspace.csv_path
 
     if not video_path or not os.path.exists(video_path):
         return None, "Video file is missing or not found"
 
-    avi_output_path = draw_bounding_boxes(video_path, csv_path)
-    mp4_output_path = avi_output_path.replace('.avi', '.mp4')
-    convert_to_mp4(avi_output_path, mp4_output_path)
+    job = workspace.add_job(lambda: render_jobs.submit(kind, render_job, video_path, csv_path, backend,
+                                                       touched_frames, proxy, key=video_path))
+    return job, None
+
+
+def render_edit(kind, workspace, options, touched_frames, **details):
+    """
+    Responds to an edit of the workspace's track IDs by re-rendering the touched frames,
+    unless the request set 'render' to false (the client then redraws from /annotations);
+    those frames are then re-rendered along with the next edit that renders.
+    details are added to the response.
+    """
+    if is_disabled(options.get('render')):
+        workspace.defer_frames(touched_frames)
+        return jsonify({'success': True, **details}), 200
+
+    touched_frames = workspace.take_unrendered_frames(touched_frames)
+    job, error = submit_render(kind, workspace, options.get('backend'), touched_frames)
+    if error:
+        workspace.defer_frames(touched_frames)
+        return jsonify({'success': False, 'error': error}), 400
+    if is_enabled(options.get('async')):
+        return jsonify({'success': True, **job_reference(job), **details}), 202
+
+    mp4_output_path, error = wait_for_render(job)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+
+    return jsonify({'success': True, 'new_video': temp_file_name(mp4_output_path), **details}), 200
+
+
+def wait_for_render(job):
+    """ Blocks until the render job finishes. Returns (mp4_output_path, error). """
+    try:
+        result = job.future.result()
+    except ValueError as e:
+        return None, str(e)
+    return os.path.join('temp', result['new_video']), None
+
+
+def wait_for_preview(job):
+    """ Blocks until the render job announces a preview or finishes. Returns whether there is a preview. """
+    job.preview_ready.wait()
+    return job.preview is not None
+
+
+def wants_proxy(value, asynchronous):
+    """ Whether an upload renders a proxy first: by default for async requests, on request for the others. """
+    if value is None:
+        return asynchronous
+    return is_enabled(value)
+
+
+def is_disabled(value):
+    """ Whether an optional boolean request flag was explicitly turned off. """
+    return str(value).lower() in ('0', 'false', 'no')
+
+
+def is_enabled(value):
+    """ Whether an optional boolean request flag was turned on. """
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def job_reference(job):
+    return {'job_id': job.id, 'status_url': f'/render-jobs/{job.id}'}
+
+
+@app.route('/render-cache', methods=['GET'])
+def get_render_cache_stats():
+    """ API endpoint reporting the hits, misses, evictions and disk usage of the render cache. """
+    return jsonify(render_cache.stats()), 200
+
+
+@app.route('/render-jobs/<job_id>', methods=['GET'])
+def get_render_job(job_id):
+    """ API endpoint reporting the status, frames processed and ETA of a render job. """
+    job = render_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Render job not found'}), 404
+    # Polling counts as using the job's workspace
+    workspaces.get(job.workspace_id)
+    return jsonify(job.to_dict()), 200
 
-    if not os.path.exists(mp4_output_path):
-        return None, f"Processed MP4 video not found: {mp4_output_path}"
 
-    return mp4_output_path, None
+@app.route('/render-jobs/<job_id>/events', methods=['GET'])
+def stream_render_job(job_id):
+    """ Server-sent events stream of the render job status until it finishes. """
+    job = render_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Render job not found'}), 404
+    workspaces.get(job.workspace_id)
+
+    def events():
+        while True:
+            status = job.to_dict()
+            yield f"data: {json.dumps(status)}\n\n"
+            if job.finished:
+                break
+            time.sleep(0.5)
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/edits', methods=['GET'])
+def get_edits():
+    """ API endpoint reporting the recorded track ID edits of the workspace's CSV file. """
+    workspace = get_workspace()
+    if workspace is None:
+        return jsonify({'error': 'Workspace not found'}), 404
+    if not workspace.csv_path:
+        return jsonify({'error': 'CSV file is missing or not found'}), 400
+    return jsonify(tracking_store.journal(workspace.csv_path)), 200
+
+
+@app.route('/edits/<action>', methods=['POST'])
+def change_edits(action):
+    """
+    API endpoint to 'undo' or 'redo' the last batch of track ID edits, re-rendering the frames it
+    touches like /update-id, or to 'commit' the edits into the CSV file.
+    """
+    if action not in ('undo', 'redo', 'commit'):
+        return jsonify({'success': False, 'error': f'Unknown edit action: {action}'}), 404
+
+    data = request.get_json(silent=True) or {}
+    backend = data.get('backend')
+    if backend and backend not in RENDER_BACKENDS:
+        return jsonify({'success': False, 'error': f'Unknown render backend: {backend}'}), 400
+
+    workspace = get_workspace()
+    if workspace is None:
+        return jsonify({'success': False, 'error': 'Workspace not found'}), 404
+    csv_path = workspace.csv_path
+    if not csv_path:
+        return jsonify({'success': False, 'error': 'CSV file is missing or not found'}), 400
+
+    try:
+        with workspace.lock:
+            if action == 'commit':
+                rows = len(tracking_store.commit(csv_path))
+                logging.info(f"Committed track ID edits to {csv_path}")
+                return jsonify({'success': True, 'rows': rows}), 200
+            touched_frames = getattr(tracking_store, action)(csv_path)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+
+    return render_edit(action, workspace, data, touched_frames, edits=tracking_store.journal(csv_path))
+
+
+@app.route('/merge-suggestions', methods=['GET'])
+def get_merge_suggestions():
+    """
+    API endpoint suggesting, for every track end, the tracks likely to continue it: same class, starting
+    at most 'max_gap' frames later within 'max_distance' pixels of the position predicted from the
+    track's velocity, with a similar box size. Best first per track, by 'cost' (0 to 1); 'track_ids'
+    (comma-separated) limits them to those ended tracks. Accept them with /merge-suggestions/accept.
+    """
+    try:
+        track_ids = parse_id_list(request.args.get('track_ids'))
+        max_gap = int(request.args.get('max_gap', MERGE_MAX_GAP_FRAMES))
+        max_distance = float(request.args.get('max_distance', MERGE_MAX_DISTANCE))
+    except ValueError:
+        return jsonify({'error': "'track_ids' and 'max_gap' must be integers, 'max_distance' a number"}), 400
+    if not 1 <= max_gap <= MERGE_GAP_LIMIT or not 0 < max_distance <= MERGE_DISTANCE_LIMIT:
+        return jsonify({'error': f"'max_gap' must be between 1 and {MERGE_GAP_LIMIT}, "
+                                 f"'max_distance' positive and at most {MERGE_DISTANCE_LIMIT:g}"}), 400
+
+    workspace = get_workspace()
+    if workspace is None:
+        return jsonify({'error': 'Workspace not found'}), 404
+    if not workspace.csv_path:
+        return jsonify({'error': 'CSV file not found'}), 400
+
+    suggestions = merge_suggestions(workspace.csv_path, max_gap, max_distance).to_list(track_ids)
+    return jsonify({'count': len(suggestions), 'suggestions': suggestions}), 200
+
+
+@app.route('/merge-suggestions/accept', methods=['POST'])
+def accept_merge_suggestions():
+    """
+    API endpoint merging continuation tracks into the tracks they continue, given as 'merges' of
+    {'track_id', 'continuation_id'}: every continuation takes the ID of its track, chains included.
+    The batch is one undoable edit and re-renders the frames it touches like /update-id.
+    """
+    data = request.get_json(silent=True) or {}
+    backend = data.get('backend')
+    if backend and backend not in RENDER_BACKENDS:
+        return jsonify({'success': False, 'error': f'Unknown render backend: {backend}'}), 400
+    try:
+        merges = [(int(merge['track_id']), int(merge['continuation_id'])) for merge in data.get('merges') or []]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': "Every merge needs integer 'track_id' and 'continuation_id'"}), 400
+    if not merges:
+        return jsonify({'success': False, 'error': 'No merges given'}), 400
+
+    tracks = [track_id for track_id, _ in merges]
+    continuations = [continuation_id for _, continuation_id in merges]
+    if len(set(tracks)) < len(tracks) or len(set(continuations)) < len(continuations):
+        return jsonify({'success': False, 'error': 'A track can be continued by one track and continue one'}), 400
+
+    workspace = get_workspace()
+    if workspace is None:
+        return jsonify({'success': False, 'error': 'Workspace not found'}), 404
+    csv_path = workspace.csv_path
+    if not csv_path:
+        return jsonify({'success': False, 'error': 'CSV file is missing or not found'}), 400
+
+    with workspace.lock:
+        index = track_intervals(csv_path)
+        order = np.argsort(index.track_ids)
+        positions = np.searchsorted(index.track_ids[order], continuations).clip(max=max(len(order) - 1, 0))
+        if not len(order) or not np.array_equal(index.track_ids[order][positions], continuations):
+            return jsonify({'success': False, 'error': 'Unknown continuation track'}), 400
+
+        # The latest continuation first, so each link of a chain moves the links after it along
+        start_frames = index.start_frames[order][positions]
+        changes = [(continuations[i], tracks[i]) for i in np.argsort(-start_frames, kind='stable').tolist()]
+        row_counts, touched_frames = tracking_store.edit(csv_path, changes)
+
+    merged = [
+        {'track_id': track_id, 'continuation_id': continuation_id, 'rows': row_counts.get(continuation_id, 0)}
+        for track_id, continuation_id in merges
+    ]
+    return render_edit('merge', workspace, data, touched_frames, merged=merged)
+
+
+@app.route('/export-csv', methods=['GET'])
+def export_csv():
+    """ API endpoint downloading the workspace's tracking CSV with its track ID edits applied. """
+    workspace = get_workspace()
+    if workspace is None:
+        return jsonify({'error': 'Workspace not found'}), 404
+    if not workspace.csv_path:
+        return jsonify({'error': 'CSV file is missing or not found'}), 400
+
+    data = tracking_store.load(workspace.csv_path)
+    response = Response(data.to_dataframe().to_csv(index=False), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={os.path.basename(workspace.csv_path)}'
+    return response
 
 
 @app.route('/update-id', methods=['POST'])
 def update_id():
-    """ API endpoint to update track_id in the CSV and reprocess the video. """
+    """
+    API endpoint to update track_id in the CSV and reprocess the video.
+    With 'async' set in the request, the render job ID is returned immediately instead;
+    with 'render' set to false, only the CSV is updated.
+    """
     try:
         data = request.json
         current_id = data.get('currentId')
         new_id = data.get('newId')
+        backend = data.get('backend')
 
         if not current_id or not new_id:
             return jsonify({'success': False, 'error': 'Invalid request data'}), 400
+        if backend and backend not in RENDER_BACKENDS:
+            return jsonify({'success': False, 'error': f'Unknown render backend: {backend}'}), 400
 
-        csv_path = get_uploaded_csv_path()
+        workspace = get_workspace()
+        if workspace is None:
+            return jsonify({'success': False, 'error': 'Workspace not found'}), 404
+
+        csv_path = workspace.csv_path
         if not csv_path:
             return jsonify({'success': False, 'error': 'CSV file is missing or not found'}), 400
 
-        update_csv_ids(csv_path, current_id, new_id)
-
-        mp4_output_path, error = process_video_with_updated_csv(csv_path)
-        if error:
-            return jsonify({'success': False, 'error': error}), 400
-
-        return jsonify({'success': True, 'new_video': os.path.basename(mp4_output_path)}), 200
+        with workspace.lock:
+            touched_frames = update_csv_ids(csv_path, current_id, new_id)
+        return render_edit('update-id', workspace, data, touched_frames)
 
     except Exception as e:
         logging.error(f"Error in /update-id: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-def convert_to_mp4(avi_path, mp4_path):
-    """
-    Converts an AVI video file to MP4 format using ffmpeg.
-    """
-    try:
-        command = [
-            'ffmpeg', '-i', avi_path, '-c:v', 'libx264', '-preset', 'fast',
-            '-crf', '23', '-c:a', 'aac', '-strict', 'experimental', mp4_path
-        ]
-        subprocess.run(command, check=True)
-        logging.info(f"Converted AVI to MP4: {mp4_path}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error during AVI to MP4 conversion: {e}")
-        raise ValueError("Failed to convert AVI to MP4")
-
-
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
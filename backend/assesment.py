@@ -1,19 +1,107 @@
+import math
 import numpy as np
-from collections import defaultdict
 from typing import List, Dict
-from dataclasses import dataclass
-from csv_rendering import load_tracking_results_from_csv
+from tracking_store import iter_tracking_csv, above_confidence
+from track_index import track_intervals
+from metrics import metrics as metrics_registry
+
+ASSESSMENT_SECONDS = metrics_registry.summary(
+    'assessment_seconds', 'Seconds spent in track quality assessments', ['assessment', 'operation'])
+
+# The per-detection assessment squared NumPy float64 scalars, which goes through
+# libm pow() and can differ from x * x in the last bit; velocities keep using
+# pow() so that the vectorized metrics stay bit-identical.
+_pow = np.frompyfunc(math.pow, 2, 1)
+
+
+def _square(values: np.ndarray) -> np.ndarray:
+    return _pow(values, 2.0).astype(np.float64)
+
+
+class TrackColumns:
+    """
+    Valid detections grouped per track as flat arrays.
+
+    Detections are stably sorted by track, so every track is one contiguous
+    slice [offsets[i], offsets[i + 1]) in the order it was processed. Tracks
+    are numbered by their first detection, which is the order the per-track
+    dicts of the assessment used to be filled in.
+    """
+
+    def __init__(self, frames: np.ndarray, track_ids: np.ndarray,
+                 confidences: np.ndarray, boxes: np.ndarray):
+        order = np.argsort(track_ids, kind='stable')
+        ids = track_ids[order]
+        self.frames = frames[order]
+        self.confidences = confidences[order]
+        boxes = boxes[order]
+
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.empty(0, dtype=np.int64)
+        # Renumber the groups by first appearance
+        appearance = np.argsort(order[starts], kind='stable')
+        self.track_ids = ids[starts][appearance].tolist()
+        self.offsets = np.r_[starts, len(ids)]
+        self.groups = appearance
+
+        group = np.repeat(np.arange(len(starts)), np.diff(self.offsets))
+        self.start_frames = np.minimum.reduceat(self.frames, starts) if len(starts) else self.frames[:0]
+        self.end_frames = np.maximum.reduceat(self.frames, starts) if len(starts) else self.frames[:0]
+
+        self.sizes = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+        # Consecutive detections of the same track
+        same_track = group[1:] == group[:-1]
+        step = np.diff(self.frames)
+
+        # Center displacement between detections in adjacent frames
+        moves = np.flatnonzero(same_track & (step == 1))
+        center_x = (boxes[:, 0] + boxes[:, 2]) / 2
+        center_y = (boxes[:, 1] + boxes[:, 3]) / 2
+        self.velocities = np.sqrt(_square(center_x[moves + 1] - center_x[moves]) +
+                                  _square(center_y[moves + 1] - center_y[moves]))
+        self.velocity_offsets = np.searchsorted(group[moves + 1], np.arange(len(starts) + 1))
+
+        # Missing frames between detections, as (last frame seen, next frame seen)
+        gaps = np.flatnonzero(same_track & (step > 1))
+        self.gaps = np.stack([self.frames[gaps], self.frames[gaps + 1]], axis=1)
+        self.gap_counts = np.bincount(group[gaps + 1], minlength=len(starts))
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def slice(self, values: np.ndarray, offsets: np.ndarray, index: int) -> np.ndarray:
+        """ The values of the index-th track, in group order. """
+        group = self.groups[index]
+        return values[offsets[group]:offsets[group + 1]]
+
+
+def _add_track_metrics(metrics: Dict, track_durations, track_fragmentations,
+                       velocity_consistencies, size_consistencies, confidence_stabilities) -> Dict:
+    """Aggregate per-track durations, gap counts and consistency values into metrics"""
+    metrics['avg_track_duration'] = np.mean(track_durations)
+    metrics['max_track_duration'] = np.max(track_durations)
+    metrics['min_track_duration'] = np.min(track_durations)
+    metrics['avg_track_fragmentation'] = np.mean(track_fragmentations)
+
+    if len(velocity_consistencies):
+        metrics['avg_velocity_consistency'] = np.mean(velocity_consistencies)
+    if len(size_consistencies):
+        metrics['avg_size_consistency'] = np.mean(size_consistencies)
+    if len(confidence_stabilities):
+        metrics['avg_confidence_stability'] = np.mean(confidence_stabilities)
+
+    stability_factors = []
+    if len(size_consistencies):
+        stability_factors.append(1 / (1 + np.mean(size_consistencies)))
+    if len(velocity_consistencies):
+        stability_factors.append(1 / (1 + np.mean(velocity_consistencies)))
+    if len(confidence_stabilities):
+        stability_factors.append(1 / (1 + np.mean(confidence_stabilities)))
+
+    metrics['track_stability_score'] = np.mean(stability_factors) if stability_factors else 0
+
+    return metrics
 
-@dataclass
-class Boxes:
-    xyxy: np.ndarray
-    id: np.ndarray
-    conf: np.ndarray
-    cls: np.ndarray
-
-@dataclass
-class Result:
-    boxes: Boxes
 
 class StoredResultsAssessment:
     def __init__(self):
@@ -21,156 +109,134 @@ class StoredResultsAssessment:
 
     def reset(self):
         self.total_frames = 0
-        self.tracks = defaultdict(list)
-        self.frame_counts = defaultdict(int)
-        self.track_gaps = defaultdict(list)
-        self.velocity_history = defaultdict(list)
-        self.bbox_sizes = defaultdict(list)
-        self.confidence_scores = defaultdict(list)
+        self.frame_counts = {}
+        self._chunks = []
+        self._columns = None
 
+    @ASSESSMENT_SECONDS.time(assessment='stored', operation='process')
     def process_stored_results(self, results, min_confidence: float = 0.3):
+        """Add per-frame lists of detection dicts, as returned by load_tracking_results_from_csv"""
+        frames, track_ids, confidences, boxes = [], [], [], []
         for frame_idx, frame_detections in enumerate(results):
-            self.total_frames += 1
-            
-            # Convert frame detections to boxes format
-            if frame_detections:
-                boxes_list = []
-                ids_list = []
-                conf_list = []
-                cls_list = []
-                
-                for det in frame_detections:
-                    boxes_list.append(det["boxes"])
-                    ids_list.append(det["track_id"])
-                    conf_list.append(det["confidence"])
-                    cls_list.append(det["class_id"])
-                
-                boxes = Boxes(
-                    xyxy=np.array(boxes_list),
-                    id=np.array(ids_list),
-                    conf=np.array(conf_list),
-                    cls=np.array(cls_list)
-                )
-                
-                valid_detections = boxes.conf > min_confidence
-                self.frame_counts[frame_idx] = np.sum(valid_detections)
-
-                for box, track_id, conf in zip(boxes.xyxy[valid_detections],
-                                             boxes.id[valid_detections],
-                                             boxes.conf[valid_detections]):
-                    track_id = int(track_id)
-
-                    self.tracks[track_id].append((frame_idx, box, conf))
-                    self.confidence_scores[track_id].append(conf)
-
-                    width = box[2] - box[0]
-                    height = box[3] - box[1]
-                    size = width * height
-                    self.bbox_sizes[track_id].append(size)
-
-                    if len(self.tracks[track_id]) >= 2:
-                        prev_frame, prev_box, _ = self.tracks[track_id][-2]
-                        if frame_idx - prev_frame == 1:
-                            center_x = (box[0] + box[2]) / 2
-                            center_y = (box[1] + box[3]) / 2
-                            prev_center_x = (prev_box[0] + prev_box[2]) / 2
-                            prev_center_y = (prev_box[1] + prev_box[3]) / 2
-
-                            velocity = np.sqrt((center_x - prev_center_x)**2 +
-                                             (center_y - prev_center_y)**2)
-                            self.velocity_history[track_id].append(velocity)
-
-                    if len(self.tracks[track_id]) >= 2:
-                        prev_frame = self.tracks[track_id][-2][0]
-                        if frame_idx - prev_frame > 1:
-                            self.track_gaps[track_id].append((prev_frame, frame_idx))
+            for det in frame_detections:
+                frames.append(frame_idx)
+                track_ids.append(det["track_id"])
+                confidences.append(det["confidence"])
+                boxes.append(det["boxes"])
+
+        self._add_detections(np.array(frames, dtype=np.int64),
+                             np.array(track_ids).astype(np.int64),
+                             np.array(confidences, dtype=np.float64),
+                             np.array(boxes, dtype=np.float64).reshape(-1, 4),
+                             len(results), min_confidence)
+
+    @ASSESSMENT_SECONDS.time(assessment='stored', operation='process')
+    def process_tracking_data(self, data, min_confidence: float = 0.3):
+        """Add the detections of a TrackingData table; same result as process_stored_results"""
+        order = np.argsort(data.frame, kind='stable')
+        order = order[data.frame[order] >= 0]
+        frames = data.frame[order].astype(np.int64)
+
+        self._add_detections(frames,
+                             data.track_id[order].astype(np.int64),
+                             data.confidence[order],
+                             data.boxes[order].astype(np.float64),
+                             int(frames[-1]) + 1 if len(frames) else 0,
+                             min_confidence)
+
+    def _add_detections(self, frames, track_ids, confidences, boxes, num_frames, min_confidence):
+        self.total_frames += num_frames
+        self._columns = None
+        if not len(frames):
+            return
+
+        valid_detections = above_confidence(confidences, min_confidence)
+        confidences = confidences.astype(np.float64)
+
+        # Valid detections of every frame that has any detection
+        frame_values = np.unique(frames)
+        counts = np.bincount(np.searchsorted(frame_values, frames[valid_detections]),
+                             minlength=len(frame_values))
+        self.frame_counts.update(zip(frame_values.tolist(), counts.tolist()))
+
+        self._chunks.append((frames[valid_detections], track_ids[valid_detections],
+                             confidences[valid_detections], boxes[valid_detections]))
+
+    @property
+    def columns(self) -> TrackColumns:
+        """Per-track view of all detections processed so far"""
+        if self._columns is None:
+            if self._chunks:
+                self._columns = TrackColumns(*(np.concatenate(column) for column in zip(*self._chunks)))
+            else:
+                self._columns = TrackColumns(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                                             np.empty(0), np.empty((0, 4)))
+        return self._columns
 
     def get_tracks_summary(self) -> Dict:
+        columns = self.columns
         summary = {}
-        for track_id in self.tracks:
-            detections = self.tracks[track_id]
-            frames = [f for f, _, _ in detections]
+        for index, track_id in enumerate(columns.track_ids):
+            group = columns.groups[index]
 
             summary[track_id] = {
-                'start_frame': min(frames),
-                'end_frame': max(frames),
-                'total_detections': len(frames),
-                'gaps': len(self.track_gaps[track_id]),
-                'avg_confidence': np.mean(self.confidence_scores[track_id])
+                'start_frame': int(columns.start_frames[group]),
+                'end_frame': int(columns.end_frames[group]),
+                'total_detections': int(columns.offsets[group + 1] - columns.offsets[group]),
+                'gaps': int(columns.gap_counts[group]),
+                'avg_confidence': np.mean(columns.slice(columns.confidences, columns.offsets, index))
             }
         return summary
 
+    @ASSESSMENT_SECONDS.time(assessment='stored', operation='metrics')
     def compute_metrics(self) -> Dict:
+        columns = self.columns
         metrics = {}
 
-        metrics['total_tracks'] = len(self.tracks)
+        metrics['total_tracks'] = len(columns)
         metrics['total_frames'] = self.total_frames
         metrics['avg_detections_per_frame'] = np.mean(list(self.frame_counts.values()))
 
-        track_durations = []
-        track_fragmentations = []
+        track_durations = (columns.end_frames - columns.start_frames + 1)[columns.groups]
+        track_fragmentations = columns.gap_counts[columns.groups]
         velocity_consistencies = []
         size_consistencies = []
         confidence_stabilities = []
 
-        for track_id in self.tracks:
-            frames = [f for f, _, _ in self.tracks[track_id]]
-            duration = max(frames) - min(frames) + 1
-            track_durations.append(duration)
-
-            gaps = len(self.track_gaps[track_id])
-            track_fragmentations.append(gaps)
-
-            if len(self.velocity_history[track_id]) > 1:
-                velocity_std = np.std(self.velocity_history[track_id])
+        for index in range(len(columns)):
+            velocities = columns.slice(columns.velocities, columns.velocity_offsets, index)
+            if len(velocities) > 1:
+                velocity_std = np.std(velocities)
                 velocity_consistencies.append(velocity_std)
 
-            if len(self.bbox_sizes[track_id]) > 1:
-                size_std = np.std(self.bbox_sizes[track_id])
-                size_mean = np.mean(self.bbox_sizes[track_id])
+            sizes = columns.slice(columns.sizes, columns.offsets, index)
+            if len(sizes) > 1:
+                size_std = np.std(sizes)
+                size_mean = np.mean(sizes)
                 size_cv = size_std / size_mean if size_mean > 0 else float('inf')
                 size_consistencies.append(size_cv)
 
-            if len(self.confidence_scores[track_id]) > 1:
-                conf_std = np.std(self.confidence_scores[track_id])
+            confidences = columns.slice(columns.confidences, columns.offsets, index)
+            if len(confidences) > 1:
+                conf_std = np.std(confidences)
                 confidence_stabilities.append(conf_std)
 
-        metrics['avg_track_duration'] = np.mean(track_durations)
-        metrics['max_track_duration'] = np.max(track_durations)
-        metrics['min_track_duration'] = np.min(track_durations)
-        metrics['avg_track_fragmentation'] = np.mean(track_fragmentations)
-
-        if velocity_consistencies:
-            metrics['avg_velocity_consistency'] = np.mean(velocity_consistencies)
-        if size_consistencies:
-            metrics['avg_size_consistency'] = np.mean(size_consistencies)
-        if confidence_stabilities:
-            metrics['avg_confidence_stability'] = np.mean(confidence_stabilities)
-
-        stability_factors = []
-        if size_consistencies:
-            stability_factors.append(1 / (1 + np.mean(size_consistencies)))
-        if velocity_consistencies:
-            stability_factors.append(1 / (1 + np.mean(velocity_consistencies)))
-        if confidence_stabilities:
-            stability_factors.append(1 / (1 + np.mean(confidence_stabilities)))
-
-        metrics['track_stability_score'] = np.mean(stability_factors) if stability_factors else 0
-
-        return metrics
+        return _add_track_metrics(metrics, track_durations, track_fragmentations,
+                                  velocity_consistencies, size_consistencies, confidence_stabilities)
 
     def get_problematic_tracks(self,
                              min_duration: int = 10,
                              max_gaps: int = 3,
                              min_confidence: float = 0.4) -> List[int]:
         """Identify potentially problematic tracks"""
+        columns = self.columns
         problematic_tracks = []
 
-        for track_id in self.tracks:
-            frames = [f for f, _, _ in self.tracks[track_id]]
-            duration = max(frames) - min(frames) + 1
-            gaps = len(self.track_gaps[track_id])
-            avg_conf = np.mean(self.confidence_scores[track_id])
+        for index, track_id in enumerate(columns.track_ids):
+            group = columns.groups[index]
+            duration = columns.end_frames[group] - columns.start_frames[group] + 1
+            gaps = columns.gap_counts[group]
+            avg_conf = np.mean(columns.slice(columns.confidences, columns.offsets, index))
 
             if (duration < min_duration or
                 gaps > max_gaps or
@@ -191,16 +257,246 @@ class StoredResultsAssessment:
                 print(f"{metric:25s}: {value}")
 
 
+class StreamingAssessment:
+    """
+    Bounded-memory counterpart of StoredResultsAssessment for long recordings.
+
+    Detections are fed in frame-ordered chunks and only running aggregates are
+    kept per track: first and last frame, detection and gap counts, the last
+    box, and Welford mean/variance (merged per chunk with Chan's update) of
+    confidence, box size and velocity. Memory grows with the number of tracks,
+    not detections. Summaries and metrics have the same keys as
+    StoredResultsAssessment and match its values up to floating-point rounding.
+    """
+
+    STATISTICS = ('confidence', 'size', 'velocity')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.total_frames = 0
+        self.frames_with_detections = 0
+        self.valid_detections = 0
+        self.last_frame = None
+        self.slots = {}  # track_id -> aggregate row, in first-appearance order
+        self.track_ids = []
+
+        self.first_frames = np.zeros(0, dtype=np.int64)
+        self.last_frames = np.zeros(0, dtype=np.int64)
+        self.gap_counts = np.zeros(0, dtype=np.int64)
+        self.last_boxes = np.zeros((0, 4))
+        # name -> [count, mean, sum of squared deviations]
+        self.stats = {name: [np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)]
+                      for name in self.STATISTICS}
+
+    def _grow(self, num_tracks: int):
+        capacity = len(self.first_frames)
+        if num_tracks <= capacity:
+            return
+        capacity = max(num_tracks, 2 * capacity, 64)
+
+        def grown(values):
+            result = np.zeros((capacity,) + values.shape[1:], dtype=values.dtype)
+            result[:len(values)] = values
+            return result
+
+        self.first_frames = grown(self.first_frames)
+        self.last_frames = grown(self.last_frames)
+        self.gap_counts = grown(self.gap_counts)
+        self.last_boxes = grown(self.last_boxes)
+        self.stats = {name: [grown(values) for values in stat] for name, stat in self.stats.items()}
+
+    def _merge(self, name: str, slots: np.ndarray, group_index: np.ndarray, values: np.ndarray):
+        """Fold chunk values, grouped by group_index into the tracks of slots, into the running statistics"""
+        num_groups = len(slots)
+        group_counts = np.bincount(group_index, minlength=num_groups)
+        group_sums = np.bincount(group_index, weights=values, minlength=num_groups)
+        present = group_counts > 0
+
+        chunk_means = np.zeros(num_groups)
+        chunk_means[present] = group_sums[present] / group_counts[present]
+        deviations = values - chunk_means[group_index]
+        chunk_m2s = np.bincount(group_index, weights=deviations * deviations, minlength=num_groups)
+
+        slots = slots[present]
+        counts_b = group_counts[present].astype(np.float64)
+        counts, means, m2s = self.stats[name]
+        counts_a = counts[slots].astype(np.float64)
+        total = counts_a + counts_b
+        delta = chunk_means[present] - means[slots]
+
+        means[slots] += delta * counts_b / total
+        m2s[slots] += chunk_m2s[present] + delta * delta * counts_a * counts_b / total
+        counts[slots] += group_counts[present]
+
+    @ASSESSMENT_SECONDS.time(assessment='streaming', operation='process')
+    def process_chunk(self, data, min_confidence: float = 0.3):
+        """Add a TrackingData chunk; chunks must follow each other in frame order"""
+        frames = data.frame.astype(np.int64)
+        order = np.argsort(frames, kind='stable')
+        order = order[frames[order] >= 0]
+        frames = frames[order]
+        if not len(frames):
+            return
+        if self.last_frame is not None and frames[0] < self.last_frame:
+            raise ValueError(f"Chunk starts at frame {frames[0]} after frame {self.last_frame}")
+
+        confidences = data.confidence[order]
+        valid_detections = above_confidence(confidences, min_confidence)
+        confidences = confidences.astype(np.float64)
+
+        # Frames with any detection, counting a frame split across chunks once
+        new_frames = np.count_nonzero(np.r_[True, frames[1:] != frames[:-1]])
+        if frames[0] == self.last_frame:
+            new_frames -= 1
+        self.frames_with_detections += new_frames
+        self.valid_detections += int(np.count_nonzero(valid_detections))
+        self.last_frame = int(frames[-1])
+        self.total_frames = self.last_frame + 1
+
+        track_ids = data.track_id[order][valid_detections].astype(np.int64)
+        if not len(track_ids):
+            return
+        frames = frames[valid_detections]
+        confidences = confidences[valid_detections]
+        boxes = data.boxes[order][valid_detections].astype(np.float64)
+
+        # Aggregate rows, assigned to new tracks in order of first appearance
+        unique_ids, first_index, inverse = np.unique(track_ids, return_index=True, return_inverse=True)
+        unique_slots = np.empty(len(unique_ids), dtype=np.int64)
+        for i in np.argsort(first_index, kind='stable').tolist():
+            track_id = int(unique_ids[i])
+            if track_id not in self.slots:
+                self.slots[track_id] = len(self.track_ids)
+                self.track_ids.append(track_id)
+            unique_slots[i] = self.slots[track_id]
+        self._grow(len(self.track_ids))
+
+        # Group the chunk by track, keeping frame order within each track
+        slots = unique_slots[inverse.reshape(-1)]
+        by_track = np.argsort(slots, kind='stable')
+        slots, frames, confidences, boxes = slots[by_track], frames[by_track], confidences[by_track], boxes[by_track]
+        starts = np.flatnonzero(np.r_[True, slots[1:] != slots[:-1]])
+        ends = np.r_[starts[1:], len(slots)]
+        group_slots = slots[starts]
+        group_index = np.repeat(np.arange(len(starts)), ends - starts)
+        seen_before = self.stats['confidence'][0][group_slots] > 0
+
+        center_x = (boxes[:, 0] + boxes[:, 2]) / 2
+        center_y = (boxes[:, 1] + boxes[:, 3]) / 2
+
+        # The detection before each one: the previous in the chunk, or the track's last box
+        prev_frames = np.r_[0, frames[:-1]]
+        prev_x = np.r_[0.0, center_x[:-1]]
+        prev_y = np.r_[0.0, center_y[:-1]]
+        last_boxes = self.last_boxes[group_slots]
+        prev_frames[starts] = self.last_frames[group_slots]
+        prev_x[starts] = (last_boxes[:, 0] + last_boxes[:, 2]) / 2
+        prev_y[starts] = (last_boxes[:, 1] + last_boxes[:, 3]) / 2
+        has_prev = np.ones(len(slots), dtype=bool)
+        has_prev[starts] = seen_before
+
+        step = frames - prev_frames
+        moves = has_prev & (step == 1)
+        gaps = has_prev & (step > 1)
+
+        velocities = np.sqrt(_square(center_x[moves] - prev_x[moves]) +
+                             _square(center_y[moves] - prev_y[moves]))
+        sizes = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+        self._merge('velocity', group_slots, group_index[moves], velocities)
+        self._merge('size', group_slots, group_index, sizes)
+        self._merge('confidence', group_slots, group_index, confidences)
+
+        self.gap_counts[group_slots] += np.bincount(group_index[gaps], minlength=len(starts))
+        new_tracks = group_slots[~seen_before]
+        self.first_frames[new_tracks] = frames[starts[~seen_before]]
+        self.last_frames[group_slots] = frames[ends - 1]
+        self.last_boxes[group_slots] = boxes[ends - 1]
+
+    def process_tracking_data(self, data, min_confidence: float = 0.3):
+        """Add a whole TrackingData table as a single chunk"""
+        self.process_chunk(data, min_confidence)
+
+    def _std(self, name: str) -> np.ndarray:
+        counts, _, m2s = self.stats[name]
+        num_tracks = len(self.track_ids)
+        return np.sqrt(m2s[:num_tracks] / np.maximum(counts[:num_tracks], 1))
+
+    def get_tracks_summary(self) -> Dict:
+        summary = {}
+        confidence_means = self.stats['confidence'][1]
+        counts = self.stats['confidence'][0]
+        for slot, track_id in enumerate(self.track_ids):
+            summary[track_id] = {
+                'start_frame': int(self.first_frames[slot]),
+                'end_frame': int(self.last_frames[slot]),
+                'total_detections': int(counts[slot]),
+                'gaps': int(self.gap_counts[slot]),
+                'avg_confidence': confidence_means[slot]
+            }
+        return summary
+
+    @ASSESSMENT_SECONDS.time(assessment='streaming', operation='metrics')
+    def compute_metrics(self) -> Dict:
+        num_tracks = len(self.track_ids)
+        metrics = {}
+
+        metrics['total_tracks'] = num_tracks
+        metrics['total_frames'] = self.total_frames
+        metrics['avg_detections_per_frame'] = (np.float64(self.valid_detections) / self.frames_with_detections
+                                               if self.frames_with_detections else np.float64(np.nan))
+
+        track_durations = self.last_frames[:num_tracks] - self.first_frames[:num_tracks] + 1
+        track_fragmentations = self.gap_counts[:num_tracks]
+
+        velocity_counts = self.stats['velocity'][0][:num_tracks]
+        velocity_consistencies = self._std('velocity')[velocity_counts > 1]
+
+        size_counts, size_means = self.stats['size'][0][:num_tracks], self.stats['size'][1][:num_tracks]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            size_cvs = np.where(size_means > 0, self._std('size') / size_means, float('inf'))
+        size_consistencies = size_cvs[size_counts > 1]
+
+        confidence_counts = self.stats['confidence'][0][:num_tracks]
+        confidence_stabilities = self._std('confidence')[confidence_counts > 1]
+
+        return _add_track_metrics(metrics, track_durations, track_fragmentations,
+                                  velocity_consistencies, size_consistencies, confidence_stabilities)
+
+    def get_problematic_tracks(self,
+                             min_duration: int = 10,
+                             max_gaps: int = 3,
+                             min_confidence: float = 0.4) -> List[int]:
+        """Identify potentially problematic tracks"""
+        num_tracks = len(self.track_ids)
+        durations = self.last_frames[:num_tracks] - self.first_frames[:num_tracks] + 1
+        problematic = ((durations < min_duration) |
+                       (self.gap_counts[:num_tracks] > max_gaps) |
+                       (self.stats['confidence'][1][:num_tracks] < min_confidence))
+        return [self.track_ids[slot] for slot in np.flatnonzero(problematic).tolist()]
+
+    print_metrics = StoredResultsAssessment.print_metrics
+
+
+def assess_tracking_csv(csv_path, chunk_rows: int = 100000,
+                        min_confidence: float = 0.3) -> StreamingAssessment:
+    """Stream a frame-ordered tracking CSV through a StreamingAssessment without loading it whole"""
+    assessment = StreamingAssessment()
+    for chunk in iter_tracking_csv(csv_path, chunk_rows):
+        assessment.process_chunk(chunk, min_confidence)
+    return assessment
+
+
 def get_edge_frames(csv_file):
-    results = load_tracking_results_from_csv(csv_file)
-    assessment = StoredResultsAssessment()
-    assessment.process_stored_results(results)
-    tracks_summary = assessment.get_tracks_summary()
+    # The tracks of the assessment, from the interval index cached for the CSV content
+    index = track_intervals(csv_file, min_confidence=0.3)
 
-    if not tracks_summary:
+    if not len(index):
         return None, None  # Handle case where no tracks are present
 
-    start_frame = (summary["start_frame"] for summary in tracks_summary.values())
-    end_frame = (summary["end_frame"] for summary in tracks_summary.values())
+    start_frame = (frame for frame in index.start_frames.tolist())
+    end_frame = (frame for frame in index.end_frames.tolist())
 
-    return start_frame, end_frame
\ No newline at end of file
+    return start_frame, end_frame
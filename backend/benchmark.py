@@ -0,0 +1,305 @@
+"""
+Benchmarks of the tracking review pipeline on synthetic data.
+
+Generates a video and a matching tracking CSV from a seed, times every stage
+(CSV loading, assessment, annotation, encoding, ID remapping) and writes the
+timings as JSON, so runs on different commits can be compared:
+
+    python benchmark.py --frames 1000 --tracks 50 --output before.json
+    python benchmark.py --frames 1000 --tracks 50 --output after.json --compare before.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+import cv2
+import numpy as np
+import pandas as pd
+from tracking_store import TRACKING_COLUMNS, TrackingStore, parse_tracking_csv
+from remap_journal import remap_track_ids
+from assesment import StoredResultsAssessment, assess_tracking_csv
+from csv_rendering import load_tracking_results_from_csv
+import video_rendering
+from video_rendering import (FrameIndex, FFmpegPipeWriter, annotate_video, open_video, render_video,
+                             draw_bounding_boxes, draw_bounding_boxes_proxy, convert_to_mp4, RENDER_BACKENDS)
+
+STAGES = ('csv_parse', 'csv_load_cached', 'load_tracking_results', 'assessment', 'streaming_assessment',
+          'id_remap', 'id_edit', 'annotate', 'render', 'proxy_render', 'convert_to_mp4')
+
+
+def generate_tracks(num_frames, num_tracks, width, height, density=0.5, gap_rate=0.05,
+                    id_switch_rate=0.002, num_classes=3, seed=0):
+    """
+    Returns a DataFrame of synthetic tracking rows in the column layout of the
+    tracking CSV, sorted by frame.
+
+    Each object is visible for density of the video on average and moves
+    linearly with some jitter. Every detection is missed with probability
+    gap_rate, and at every frame the object switches to a new track ID with
+    probability id_switch_rate.
+    """
+    rng = np.random.default_rng(seed)
+    columns = {name: [] for name in TRACKING_COLUMNS}
+    next_id = 1
+
+    for _ in range(num_tracks):
+        length = int(np.clip(rng.normal(density, density / 4) * num_frames, 2, num_frames))
+        start = int(rng.integers(0, num_frames - length + 1))
+        frames = np.arange(start, start + length)
+
+        size = rng.uniform(20, 120, 2)
+        position = rng.uniform([0, 0], [width - size[0], height - size[1]])
+        velocity = rng.uniform(-3, 3, 2)
+        steps = np.arange(length)[:, None]
+        top_left = position + velocity * steps + rng.normal(0, 1, (length, 2))
+        top_left = np.clip(top_left, 0, [width - size[0], height - size[1]])
+
+        switches = np.cumsum(rng.random(length) < id_switch_rate)
+        track_ids = next_id + switches
+        next_id += int(switches[-1]) + 1
+
+        kept = rng.random(length) >= gap_rate
+        columns['frame'].append(frames[kept])
+        columns['track_id'].append(track_ids[kept])
+        columns['class_id'].append(np.full(kept.sum(), rng.integers(0, num_classes)))
+        columns['confidence'].append(rng.uniform(0.2, 1.0, kept.sum()))
+        columns['x1'].append(top_left[kept, 0])
+        columns['y1'].append(top_left[kept, 1])
+        columns['x2'].append(top_left[kept, 0] + size[0])
+        columns['y2'].append(top_left[kept, 1] + size[1])
+
+    df = pd.DataFrame({name: np.concatenate(values) if values else [] for name, values in columns.items()},
+                      columns=TRACKING_COLUMNS)
+    return df.sort_values('frame', kind='stable').round(2).reset_index(drop=True)
+
+
+def generate_video(path, tracks, num_frames, width, height, fps, seed=0):
+    """
+    Encodes an H.264 MP4 of num_frames frames: a drifting gradient with a
+    little noise, and a solid block for every detection of tracks.
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width + height, dtype=np.float32)
+    background = (gradient[None, :width] + gradient[:height, None]) / 2
+    noise = rng.normal(0, 6, (8, height, width)).astype(np.float32)
+    colors = rng.integers(64, 256, (int(tracks['track_id'].max()) + 1 if len(tracks) else 1, 3))
+
+    rows_by_frame = tracks.groupby('frame')
+    frame_rows = {frame: rows for frame, rows in rows_by_frame}
+
+    out = FFmpegPipeWriter(path, fps, (width, height))
+    try:
+        for frame_idx in range(num_frames):
+            gray = np.roll(background, frame_idx * 2, axis=1) + noise[frame_idx % len(noise)]
+            image = np.repeat(np.clip(gray, 0, 255).astype(np.uint8)[:, :, None], 3, axis=2)
+            rows = frame_rows.get(frame_idx)
+            if rows is not None:
+                for track_id, x1, y1, x2, y2 in rows[['track_id', 'x1', 'y1', 'x2', 'y2']].itertuples(index=False):
+                    image[int(y1):int(y2), int(x1):int(x2)] = colors[int(track_id)]
+            out.write(image)
+    finally:
+        out.release()
+
+
+class NullWriter:
+    """ Writer that drops the frames, to time decoding and drawing alone. """
+
+    def isOpened(self):
+        return True
+
+    def write(self, frame):
+        pass
+
+    def release(self):
+        pass
+
+
+def measure(fn, repeat, setup=None):
+    """ Runs fn repeat times and returns the wall-clock seconds of each run. """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    return {
+        'runs': [round(t, 6) for t in timings],
+        'min': round(min(timings), 6),
+        'median': round(statistics.median(timings), 6),
+        'mean': round(statistics.mean(timings), 6)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args, workdir):
+    video_path = os.path.join(workdir, 'bench.mp4')
+    csv_path = os.path.join(workdir, 'bench.csv')
+
+    tracks = generate_tracks(args.frames, args.tracks, args.width, args.height, args.density,
+                             args.gaps, args.id_switches, seed=args.seed)
+    tracks.to_csv(csv_path, index=False)
+    generate_video(video_path, tracks, args.frames, args.width, args.height, args.fps, seed=args.seed)
+
+    with open(csv_path, 'rb') as f:
+        raw = f.read()
+    data = parse_tracking_csv(raw)
+    # Remap a tenth of the track IDs, as a large batch of corrections would
+    track_ids = np.unique(data.track_id)
+    remapped = track_ids[::10]
+    mapping = dict(zip(remapped.tolist(), (remapped + track_ids.max() + 1).tolist()))
+
+    store = TrackingStore()
+    store.load(csv_path)
+
+    def annotate():
+        cap, _, _, _ = open_video(video_path)
+        annotate_video(cap, FrameIndex(data), NullWriter())
+        cap.release()
+
+    def assess():
+        assessment = StoredResultsAssessment()
+        assessment.process_tracking_data(data)
+        assessment.compute_metrics()
+
+    def load_results():
+        with contextlib.redirect_stdout(io.StringIO()):
+            load_tracking_results_from_csv(csv_path)
+
+    def edit():
+        edit_store = TrackingStore()
+        edit_store.edit(edit_path, list(mapping.items()))
+        edit_store.load(edit_path)
+
+    edit_path = os.path.join(workdir, 'edit.csv')
+
+    def reset_edit():
+        shutil.copyfile(csv_path, edit_path)
+        TrackingStore().invalidate(edit_path)
+
+    stages = {
+        'csv_parse': lambda: measure(lambda: parse_tracking_csv(raw), args.repeat),
+        'csv_load_cached': lambda: measure(lambda: store.load(csv_path), args.repeat),
+        'load_tracking_results': lambda: measure(load_results, args.repeat),
+        'assessment': lambda: measure(assess, args.repeat),
+        'streaming_assessment': lambda: measure(lambda: assess_tracking_csv(csv_path), args.repeat),
+        'id_remap': lambda: measure(lambda: remap_track_ids(data, mapping), args.repeat),
+        'id_edit': lambda: measure(edit, args.repeat, setup=reset_edit),
+        'annotate': lambda: measure(annotate, args.repeat),
+        'proxy_render': lambda: measure(lambda: draw_bounding_boxes_proxy(video_path, csv_path), args.repeat),
+    }
+
+    results = {}
+    for stage in args.stages:
+        if stage == 'render':
+            for backend in args.backends:
+                results[f'render:{backend}'] = summarize(
+                    measure(lambda: render_video(video_path, csv_path, backend), args.repeat))
+        elif stage == 'convert_to_mp4':
+            avi_path = draw_bounding_boxes(video_path, csv_path)
+            mp4_path = os.path.join(workdir, 'converted.mp4')
+            results[stage] = summarize(measure(lambda: convert_to_mp4(avi_path, mp4_path), args.repeat))
+        else:
+            results[stage] = summarize(stages[stage]())
+        print(f"{stage}: done", file=sys.stderr)
+
+    return {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'opencv': cv2.__version__
+        },
+        'config': {
+            'frames': args.frames, 'width': args.width, 'height': args.height, 'fps': args.fps,
+            'tracks': args.tracks, 'density': args.density, 'gaps': args.gaps,
+            'id_switches': args.id_switches, 'seed': args.seed, 'repeat': args.repeat,
+            'rows': len(data), 'segment_frames': video_rendering.SEGMENT_FRAMES
+        },
+        'results': results
+    }
+
+
+def print_comparison(report, baseline):
+    """ Prints the median of every stage next to the baseline's and their ratio. """
+    def workload(config):
+        return {name: value for name, value in config.items() if name != 'repeat'}
+
+    if workload(baseline['config']) != workload(report['config']):
+        print("Warning: the baseline was run with a different configuration", file=sys.stderr)
+    print(f"{'stage':<28}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for stage, result in report['results'].items():
+        before = baseline['results'].get(stage)
+        if before is None:
+            print(f"{stage:<28}{'-':>12}{result['median']:>12.4f}{'-':>8}")
+        else:
+            ratio = result['median'] / before['median'] if before['median'] else float('inf')
+            print(f"{stage:<28}{before['median']:>12.4f}{result['median']:>12.4f}{ratio:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=500)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--fps', type=int, default=25)
+    parser.add_argument('--tracks', type=int, default=40)
+    parser.add_argument('--density', type=float, default=0.5,
+                        help='average fraction of the video an object is visible in')
+    parser.add_argument('--gaps', type=float, default=0.05, help='probability of a missed detection')
+    parser.add_argument('--id-switches', type=float, default=0.002,
+                        help='probability per frame of an object switching to a new track ID')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--backends', nargs='+', choices=RENDER_BACKENDS, default=list(RENDER_BACKENDS))
+    parser.add_argument('--workdir', help='directory for the generated files (default: a temporary one)')
+    parser.add_argument('--output', help='file to write the JSON results to (default: stdout)')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='benchmark-')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        report = run_benchmarks(args, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
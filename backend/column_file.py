@@ -0,0 +1,70 @@
+import os
+import json
+import struct
+import numpy as np
+
+# File layout: magic, little-endian uint64 header length, JSON header, then the
+# raw column arrays, each starting at a multiple of COLUMN_ALIGNMENT bytes
+COLUMN_FILE_MAGIC = b'TRKCOL01'
+COLUMN_ALIGNMENT = 64
+
+
+def aligned(offset):
+    return -(-offset // COLUMN_ALIGNMENT) * COLUMN_ALIGNMENT
+
+
+def write_column_file(path, columns, meta):
+    """
+    Writes the {name: array} columns and the JSON-serializable meta to path,
+    replacing it atomically.
+    """
+    header = {'meta': meta, 'columns': {}}
+    offset = 0
+    for name, values in columns.items():
+        values = np.ascontiguousarray(values)
+        header['columns'][name] = {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': offset}
+        offset = aligned(offset + values.nbytes)
+    encoded = json.dumps(header).encode()
+    data_start = aligned(len(COLUMN_FILE_MAGIC) + 8 + len(encoded))
+
+    part_path = path + '.part'
+    with open(part_path, 'wb') as f:
+        f.write(COLUMN_FILE_MAGIC + struct.pack('<Q', len(encoded)) + encoded)
+        for name, values in columns.items():
+            f.seek(data_start + header['columns'][name]['offset'])
+            f.write(np.ascontiguousarray(values).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(part_path, path)
+
+
+def read_header(f):
+    if f.read(len(COLUMN_FILE_MAGIC)) != COLUMN_FILE_MAGIC:
+        raise ValueError("Not a column file")
+    encoded_length = f.read(8)
+    if len(encoded_length) < 8:
+        raise ValueError("Truncated column file")
+    length, = struct.unpack('<Q', encoded_length)
+    header = json.loads(f.read(length))
+    return header, aligned(len(COLUMN_FILE_MAGIC) + 8 + length)
+
+
+def read_column_file(path):
+    """
+    Returns the ({name: array}, meta) of the column file at path. The arrays
+    are read-only views of one memory map of the file, so nothing is copied
+    until it is used.
+    """
+    with open(path, 'rb') as f:
+        header, data_start = read_header(f)
+    mapped = np.memmap(path, mode='r')
+
+    columns = {}
+    for name, column in header['columns'].items():
+        dtype = np.dtype(column['dtype'])
+        count = int(np.prod(column['shape'], dtype=np.int64))
+        if not count:
+            columns[name] = np.zeros(column['shape'], dtype=dtype)
+            continue
+        values = np.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + column['offset'])
+        columns[name] = values.reshape(column['shape'])
+    return columns, header['meta']
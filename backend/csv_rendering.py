@@ -1,87 +1,186 @@
+import os
 import pandas as pd
 import numpy as np
+from tracking_store import tracking_store
+
+# Columns of the tracking CSV and their dtypes as written
+CSV_COLUMN_DTYPES = {
+    'frame': np.int64,
+    'track_id': np.int64,
+    'class_id': np.int64,
+    'confidence': np.float64,
+    'x1': np.float64,
+    'y1': np.float64,
+    'x2': np.float64,
+    'y2': np.float64
+}
+# Rows buffered by TrackingCSVWriter before they are appended to the file
+CSV_CHUNK_ROWS = 100000
+
+
+def decimal_values(values):
+    """
+    Returns float32 values as the float64 values of their shortest decimal
+    form, so a 0.3 read from the CSV is 0.3 again rather than 0.30000001192...
+    """
+    return values.astype(str).astype(np.float64)
 
-def load_tracking_results_from_csv(csv_path='tracking_results.csv'):
-    # Read the CSV file
-    df = pd.read_csv(csv_path)
-
-    # Initialize a dictionary to group results by frame
-    results_by_frame = {}
-
-    for _, row in df.iterrows():
-        frame_idx = int(row['frame'])
 
+def load_tracking_results_from_csv(csv_path='tracking_results.csv'):
+    # Columnar tracking data, parsed once and then served from the tracking store
+    data = tracking_store.load(csv_path)
+    if len(data) == 0:
+        return []
+
+    # Group detections by frame, keeping the CSV order within each frame
+    order = np.argsort(data.frame, kind='stable')
+    order = order[data.frame[order] >= 0]
+    frames = data.frame[order].tolist()
+
+    # One entry per frame up to the last frame with detections
+    max_frame = frames[-1] + 1 if frames else 0
+    results = [[] for _ in range(max_frame)]
+
+    for frame_idx, track_id, class_id, confidence, box in zip(frames,
+                                                              data.track_id[order].tolist(),
+                                                              data.class_id[order].tolist(),
+                                                              decimal_values(data.confidence[order]).tolist(),
+                                                              decimal_values(data.boxes[order]).tolist()):
         # Create dictionary for each detection
-        detection = {
-            "track_id": int(row['track_id']),
-            "class_id": int(row['class_id']),
-            "confidence": float(row['confidence']),
-            "boxes": [float(row['x1']), float(row['y1']), float(row['x2']), float(row['y2'])]
-        }
-
-        # Add detection to the corresponding frame
-        if frame_idx not in results_by_frame:
-            results_by_frame[frame_idx] = []
-        results_by_frame[frame_idx].append(detection)
-
-    # Convert the dictionary to a list format, one entry per frame
-    max_frame = max(results_by_frame.keys()) + 1
-    results = [results_by_frame.get(frame_idx, []) for frame_idx in range(max_frame)]
+        results[frame_idx].append({
+            "track_id": track_id,
+            "class_id": class_id,
+            "confidence": confidence,
+            "boxes": box
+        })
 
     print("Tracking results successfully loaded from", csv_path)
     return results
 
-import pandas as pd
-import numpy as np
 
-def save_tracking_results_to_csv(results, output_path='tracking_results.csv'):
+def to_numpy(values):
+    """ Returns a tensor, on whatever device, or array-like as a NumPy array. """
+    if hasattr(values, 'cpu'):
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
+def result_columns(frame_idx, result):
+    """
+    Returns the detections of one frame's tracking result as a dict of column
+    arrays in the layout of the tracking CSV, or None when it has none.
+    """
+    boxes = result.boxes
+    if len(boxes) == 0:
+        return None
+
+    # One transfer per tensor and frame; NumPy arrays pass as they are
+    coords = to_numpy(boxes.xyxy).astype(np.float64).reshape(-1, 4)
+    ids = getattr(boxes, 'id', None)
+    return {
+        'frame': np.full(len(coords), frame_idx, dtype=np.int64),
+        'track_id': to_numpy(ids).astype(np.int64) if ids is not None else np.full(len(coords), -1, dtype=np.int64),
+        'class_id': to_numpy(boxes.cls).astype(np.int64),
+        'confidence': to_numpy(boxes.conf).astype(np.float64),
+        'x1': coords[:, 0],
+        'y1': coords[:, 1],
+        'x2': coords[:, 2],
+        'y2': coords[:, 3]
+    }
+
+
+def concat_columns(blocks):
+    """ Returns a DataFrame of the tracking CSV columns from the per-frame column blocks. """
+    return pd.DataFrame({
+        name: np.concatenate([block[name] for block in blocks]) if blocks else np.zeros(0, dtype=dtype)
+        for name, dtype in CSV_COLUMN_DTYPES.items()
+    }, columns=list(CSV_COLUMN_DTYPES))
+
+
+class TrackingCSVWriter:
+    """
+    Writes tracking results to a CSV file as they arrive, for runs too long to
+    keep in memory.
+
+    Frames are buffered as column blocks and appended to the file in chunks of
+    at least chunk_rows rows. The file is written as output_path.part and
+    moved into place by close(), so readers never see half of it.
+    """
+
+    def __init__(self, output_path='tracking_results.csv', chunk_rows=CSV_CHUNK_ROWS):
+        self.output_path = output_path
+        self.part_path = output_path + '.part'
+        self.chunk_rows = chunk_rows
+        self.blocks = []
+        self.buffered_rows = 0
+        self.rows = 0
+        self.frames = 0
+        self.header = True
+        open(self.part_path, 'w').close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, result):
+        """ Adds the tracking result of the next frame. """
+        block = result_columns(self.frames, result)
+        self.frames += 1
+        if block is None:
+            return
+        self.blocks.append(block)
+        self.buffered_rows += len(block['frame'])
+        if self.buffered_rows >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """ Appends the buffered frames to the file. """
+        if not self.blocks and not self.header:
+            return
+        concat_columns(self.blocks).to_csv(self.part_path, mode='a', header=self.header, index=False)
+        self.rows += self.buffered_rows
+        self.blocks = []
+        self.buffered_rows = 0
+        self.header = False
+
+    def close(self):
+        """ Writes the remaining frames and moves the file into place. """
+        self.flush()
+        os.replace(self.part_path, self.output_path)
+
+    def discard(self):
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
 
-    frame_numbers = []
-    track_ids = []
-    classes = []
-    confidences = []
-    x1_coords = []
-    y1_coords = []
-    x2_coords = []
-    y2_coords = []
-
-    for frame_idx, result in enumerate(results):
-        boxes = result.boxes
-
-        if len(boxes) > 0:
-            coords = boxes.xyxy.cpu().numpy()
-
-            conf = boxes.conf.cpu().numpy()
-
-            cls = boxes.cls.cpu().numpy()
-
-            if hasattr(boxes, 'id'):
-                ids = boxes.id.cpu().numpy()
-            else:
-                ids = np.array([-1] * len(coords))
-
-            for box_idx in range(len(coords)):
-                frame_numbers.append(frame_idx)
-                track_ids.append(int(ids[box_idx]) if ids[box_idx] is not None else -1)
-                classes.append(int(cls[box_idx]))
-                confidences.append(float(conf[box_idx]))
-                x1_coords.append(float(coords[box_idx][0]))
-                y1_coords.append(float(coords[box_idx][1]))
-                x2_coords.append(float(coords[box_idx][2]))
-                y2_coords.append(float(coords[box_idx][3]))
-
-    df = pd.DataFrame({
-        'frame': frame_numbers,
-        'track_id': track_ids,
-        'class_id': classes,
-        'confidence': confidences,
-        'x1': x1_coords,
-        'y1': y1_coords,
-        'x2': x2_coords,
-        'y2': y2_coords
-    })
+def save_tracking_results_to_csv(results, output_path='tracking_results.csv'):
+    """
+    Writes the per-frame tracking results to a CSV file and returns them as a
+    DataFrame. Each frame is converted as whole column arrays, concatenated
+    once; stream_tracking_results_to_csv keeps memory bounded instead.
+    """
+    blocks = [block for block in (result_columns(frame_idx, result) for frame_idx, result in enumerate(results))
+              if block is not None]
+    df = concat_columns(blocks)
 
     df.to_csv(output_path, index=False)
     print(f"Results saved to {output_path}")
 
-    return df
\ No newline at end of file
+    return df
+
+
+def stream_tracking_results_to_csv(results, output_path='tracking_results.csv', chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Writes per-frame tracking results, e.g. from a streaming tracker, to a CSV
+    file in chunks as they arrive. Returns the number of rows written.
+    """
+    with TrackingCSVWriter(output_path, chunk_rows) as writer:
+        for result in results:
+            writer.write(result)
+    print(f"Results saved to {output_path}")
+    return writer.rows
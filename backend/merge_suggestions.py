@@ -0,0 +1,209 @@
+import os
+import numpy as np
+from tracking_store import tracking_store
+
+# Most frames between the end of a track and the start of its continuation
+MERGE_MAX_GAP_FRAMES = int(os.environ.get('MERGE_MAX_GAP_FRAMES', 30))
+# Most pixels between the start of a continuation and where the ended track was predicted to be
+MERGE_MAX_DISTANCE = float(os.environ.get('MERGE_MAX_DISTANCE', 100))
+# Largest ratio between the box areas at the end of a track and the start of its continuation
+MERGE_MAX_SIZE_RATIO = 3.0
+# Detections at the end of a track its velocity is estimated from
+MERGE_VELOCITY_FRAMES = 5
+# Continuations suggested per track end
+MERGE_MAX_CANDIDATES = 3
+# Largest max_gap and max_distance a request may ask for; the candidates grow with both
+MERGE_GAP_LIMIT = 300
+MERGE_DISTANCE_LIMIT = 1000.0
+
+
+class TrackEdges:
+    """
+    First and last detection of every track, sorted by track ID: frame, box
+    center, box size and class, and the velocity over the last
+    velocity_frames detections, to predict where the track went on to.
+    """
+
+    def __init__(self, data, velocity_frames=MERGE_VELOCITY_FRAMES):
+        data = data.take(data.frame >= 0)
+        order = np.lexsort((data.frame, data.track_id))
+        frames = data.frame[order].astype(np.int64)
+        track_ids = data.track_id[order].astype(np.int64)
+        boxes = data.boxes[order].astype(np.float64)
+        classes = data.class_id[order]
+
+        new_track = np.ones(len(order), dtype=bool)
+        new_track[1:] = track_ids[1:] != track_ids[:-1]
+        firsts = np.flatnonzero(new_track)
+        lasts = np.flatnonzero(np.roll(new_track, -1))
+
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        areas = np.maximum(boxes[:, 2] - boxes[:, 0], 0) * np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+
+        self.track_ids = track_ids[firsts]
+        self.start_frames = frames[firsts]
+        self.end_frames = frames[lasts]
+        self.start_centers = centers[firsts]
+        self.end_centers = centers[lasts]
+        self.start_areas = areas[firsts]
+        self.end_areas = areas[lasts]
+        self.start_classes = classes[firsts]
+        self.end_classes = classes[lasts]
+
+        # Center displacement per frame from the velocity_frames-th last detection on
+        back = np.maximum(lasts - (velocity_frames - 1), firsts)
+        elapsed = frames[lasts] - frames[back]
+        self.velocities = (centers[lasts] - centers[back]) / np.maximum(elapsed, 1)[:, None]
+
+    def __len__(self):
+        return len(self.track_ids)
+
+
+class StartGrid:
+    """
+    Track starts bucketed into cells of frame_span frames by cell_size pixels.
+
+    The cells are numbered (time, x, y) in row-major order and the starts are
+    sorted by cell number, so the starts in a row of cells are one binary
+    searched slice, and finding the starts near many points takes a few numpy
+    passes instead of a comparison with every track.
+    """
+
+    def __init__(self, frames, centers, frame_span, cell_size):
+        self.frame_span = frame_span
+        self.cell_size = cell_size
+        self.origin = centers.min(axis=0) if len(centers) else np.zeros(2)
+
+        times = frames // frame_span
+        cells = self.cells(centers)
+        self.shape = (int(times.max()) + 1 if len(times) else 0,
+                      *(cells.max(axis=0) + 1 if len(cells) else (0, 0)))
+        keys = (times * self.shape[1] + cells[:, 0]) * self.shape[2] + cells[:, 1]
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def cells(self, points):
+        """ Returns the (x, y) cell of every point. """
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def search(self, times, lower, upper):
+        """
+        Returns (query, start) pairs of the starts in time bucket times[query]
+        within the cells from the (x, y) points lower[query] to upper[query].
+        """
+        num_times, num_x, num_y = self.shape
+        low = np.maximum(self.cells(lower), 0)
+        high = np.minimum(self.cells(upper), [num_x - 1, num_y - 1])
+        columns = np.where((times < num_times) & (high[:, 1] >= low[:, 1]),
+                           np.maximum(high[:, 0] - low[:, 0] + 1, 0), 0)
+
+        # One binary searched slice per (query, x) cell row
+        queries = np.repeat(np.arange(len(times)), columns)
+        x = np.repeat(low[:, 0] - (np.cumsum(columns) - columns), columns) + np.arange(len(queries))
+        rows = (times[queries] * num_x + x) * num_y
+        first = np.searchsorted(self.keys, rows + low[queries, 1], side='left')
+        last = np.searchsorted(self.keys, rows + high[queries, 1], side='right')
+
+        counts = last - first
+        pairs = np.repeat(np.arange(len(first)), counts)
+        positions = np.repeat(first - (np.cumsum(counts) - counts), counts) + np.arange(len(pairs))
+        return queries[pairs], self.order[positions]
+
+
+class MergeSuggestions:
+    """
+    Tracks likely to continue a track that ended, as suggestions to merge the
+    two under one ID: for every track end, the tracks of the same class
+    starting at most max_gap frames later within max_distance pixels of where
+    the ended track was heading, with a box of similar size.
+
+    Candidates come from a StartGrid of the track starts. Each suggestion has
+    a cost from 0 (best) to 1, the mean of the frame gap, the distance from
+    the predicted position and the box size difference, each relative to its
+    limit; the max_candidates cheapest per track end are kept.
+    """
+
+    def __init__(self, data, max_gap=MERGE_MAX_GAP_FRAMES, max_distance=MERGE_MAX_DISTANCE,
+                 max_candidates=MERGE_MAX_CANDIDATES):
+        tracks = TrackEdges(data)
+        grid = StartGrid(tracks.start_frames, tracks.start_centers, max_gap, max_distance)
+
+        # Every track end searches the one or two time buckets its gap window falls into
+        ends = tracks.end_frames
+        first_bucket = (ends + 1) // max_gap
+        last_bucket = (ends + max_gap) // max_gap
+        queries = np.concatenate([np.arange(len(tracks)), np.flatnonzero(last_bucket > first_bucket)])
+        times = np.concatenate([first_bucket, last_bucket[last_bucket > first_bucket]])
+
+        # Cells around the predicted path through the frames of the bucket within the window
+        first_frame = np.maximum(ends[queries] + 1, times * max_gap)
+        last_frame = np.minimum(ends[queries] + max_gap, times * max_gap + max_gap - 1)
+        velocities = tracks.velocities[queries]
+        path = np.stack([tracks.end_centers[queries] + velocities * (first_frame - ends[queries])[:, None],
+                         tracks.end_centers[queries] + velocities * (last_frame - ends[queries])[:, None]])
+        query, candidate = grid.search(times, path.min(axis=0) - max_distance, path.max(axis=0) + max_distance)
+        track = queries[query]
+
+        gap = tracks.start_frames[candidate] - ends[track]
+        predicted = tracks.end_centers[track] + tracks.velocities[track] * gap[:, None]
+        distance = np.hypot(*(tracks.start_centers[candidate] - predicted).T)
+        size_ratio = (np.maximum(tracks.start_areas[candidate], 1e-6) /
+                      np.maximum(tracks.end_areas[track], 1e-6))
+        size_change = np.abs(np.log(size_ratio)) / np.log(MERGE_MAX_SIZE_RATIO)
+        kept = ((gap >= 1) & (gap <= max_gap) & (distance <= max_distance) & (size_change <= 1) &
+                (tracks.start_classes[candidate] == tracks.end_classes[track]))
+
+        track, candidate = track[kept], candidate[kept]
+        cost = (gap[kept] / max_gap + distance[kept] / max_distance + size_change[kept]) / 3
+
+        # The cheapest candidates of every track end
+        order = np.lexsort((tracks.track_ids[candidate], cost, track))
+        track, candidate = track[order], candidate[order]
+        new_end = np.ones(len(track), dtype=bool)
+        new_end[1:] = track[1:] != track[:-1]
+        group_starts = np.flatnonzero(new_end)
+        rank = np.arange(len(track)) - np.repeat(group_starts, np.diff(np.append(group_starts, len(track))))
+        best = rank < max_candidates
+
+        self.track_ids = tracks.track_ids[track[best]]
+        self.continuation_ids = tracks.track_ids[candidate[best]]
+        self.end_frames = ends[track[best]]
+        self.start_frames = tracks.start_frames[candidate[best]]
+        self.distances = distance[kept][order][best]
+        self.size_ratios = size_ratio[kept][order][best]
+        self.costs = cost[order][best]
+        self.ranks = rank[best]
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def to_list(self, track_ids=None):
+        """ Returns the suggestions, for the ended tracks with the given IDs only if given. """
+        rows = np.arange(len(self))
+        if track_ids is not None:
+            rows = rows[np.isin(self.track_ids, track_ids)]
+        return [
+            {
+                'track_id': int(self.track_ids[row]),
+                'continuation_id': int(self.continuation_ids[row]),
+                'end_frame': int(self.end_frames[row]),
+                'start_frame': int(self.start_frames[row]),
+                'gap': int(self.start_frames[row] - self.end_frames[row]),
+                'distance': round(float(self.distances[row]), 1),
+                'size_ratio': round(float(self.size_ratios[row]), 3),
+                'cost': round(float(self.costs[row]), 4),
+                'rank': int(self.ranks[row])
+            }
+            for row in rows.tolist()
+        ]
+
+
+def merge_suggestions(csv_path, max_gap=MERGE_MAX_GAP_FRAMES, max_distance=MERGE_MAX_DISTANCE):
+    """
+    Returns the MergeSuggestions of the CSV file with its ID edits. Those for
+    the default limits are computed once per content, any others every time,
+    so that varying limits do not pile up in the cache.
+    """
+    if max_gap == MERGE_MAX_GAP_FRAMES and max_distance == MERGE_MAX_DISTANCE:
+        return tracking_store.derived(csv_path, 'merge_suggestions', MergeSuggestions)
+    return MergeSuggestions(tracking_store.load(csv_path), max_gap, max_distance)
@@ -0,0 +1,146 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# Seconds between the progress lines of long loops such as renders
+PROGRESS_LOG_SECONDS = float(os.environ.get('PROGRESS_LOG_SECONDS', 5))
+
+
+def format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(labelnames, values))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    """ A named family of samples, one per combination of label values. """
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Reads the current value(s) on collection instead of storing them: {label values: value}
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """ Returns [(suffix, label values, value)] of the metric. """
+        if self.callback is not None:
+            return [('', key, value) for key, value in self.callback().items()]
+        with self.lock:
+            return [('', key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Summary(Metric):
+    """ Count and sum of observations, e.g. seconds spent in a stage and how often it ran. """
+
+    kind = 'summary'
+
+    def observe(self, amount, count=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            total_count, total = self.values.get(key, (0, 0.0))
+            self.values[key] = (total_count + count, total + amount)
+
+    @contextmanager
+    def time(self, **labels):
+        """ Observes the seconds spent in the with block. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        samples = []
+        for key, (count, total) in items:
+            samples.append(('_count', key, count))
+            samples.append(('_sum', key, round(total, 6)))
+        return samples
+
+
+class MetricsRegistry:
+    """ Process-wide metrics, exported in the Prometheus text format. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        return self._register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def summary(self, name, documentation, labelnames=()):
+        return self._register(Summary(name, documentation, labelnames))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+
+class ProgressLog:
+    """
+    Logs how far a long loop got at most every interval seconds, in place of a
+    log line per iteration.
+    """
+
+    def __init__(self, description, interval=PROGRESS_LOG_SECONDS):
+        self.description = description
+        self.interval = interval
+        self.started_at = time.perf_counter()
+        self.logged_at = self.started_at
+        self.count = 0
+
+    def advance(self, count=1):
+        self.count += count
+        now = time.perf_counter()
+        if now - self.logged_at >= self.interval:
+            self.logged_at = now
+            logging.info(f"{self.description}: {self.count} done ({self.count / (now - self.started_at):.1f}/s)")
@@ -0,0 +1,139 @@
+import os
+import json
+import numpy as np
+
+
+def journal_path(csv_path):
+    """ Returns the path of the remap journal kept next to a tracking file. """
+    return csv_path + '.remap.json'
+
+
+def resolve_id_mapping(changes):
+    """
+    Resolves (old_id, new_id) changes, applied one after another, into a single
+    {original_id: final_id} mapping. Chains like 3->7, 7->9 resolve to 3->9 and
+    7->9, and a swap through an unused ID (3->0, 7->3, 0->7) to 3->7 and 7->3.
+    """
+    mapping = {}
+    holders = {}  # current ID -> original IDs currently carrying it
+    for old_id, new_id in changes:
+        old_id, new_id = int(old_id), int(new_id)
+        if old_id == new_id:
+            continue
+
+        # Rows with the old ID are either untouched so far or remapped onto it
+        moved = holders.pop(old_id, set())
+        if old_id not in mapping:
+            moved.add(old_id)
+        for original_id in moved:
+            mapping[original_id] = new_id
+        holders.setdefault(new_id, set()).update(moved)
+
+    return {original_id: final_id for original_id, final_id in mapping.items() if original_id != final_id}
+
+
+def remap_track_ids(data, mapping):
+    """
+    Applies an {old_id: new_id} mapping to the track IDs of the TrackingData in
+    one vectorized pass.
+
+    Returns the remapped data, the number of rows changed per old ID and the
+    boolean mask of the changed rows.
+    """
+    if not mapping:
+        return data, {}, np.zeros(len(data), dtype=bool)
+
+    old_ids = np.array(sorted(mapping), dtype=np.int64)
+    new_ids = np.array([mapping[old_id] for old_id in old_ids.tolist()], dtype=np.int64)
+
+    track_ids = data.track_id
+    positions = np.searchsorted(old_ids, track_ids).clip(max=len(old_ids) - 1)
+    changed = old_ids[positions] == track_ids
+
+    updated_track_ids = track_ids.copy()
+    updated_track_ids[changed] = new_ids[positions[changed]]
+
+    counts = np.bincount(positions[changed], minlength=len(old_ids))
+    row_counts = dict(zip(old_ids.tolist(), counts.tolist()))
+    return data.with_track_ids(updated_track_ids), row_counts, changed
+
+
+class RemapJournal:
+    """
+    Ordered batches of (old_id, new_id) track ID changes made to a tracking
+    file, applied on top of the file when it is read instead of rewriting it.
+
+    Batches before position are applied; those after it were undone and can
+    be redone until a new batch is recorded. The journal is saved as JSON next
+    to the tracking file after every change.
+    """
+
+    def __init__(self, path, edits=None, position=None):
+        self.path = path
+        self.edits = edits or []
+        self.position = len(self.edits) if position is None else position
+
+    @classmethod
+    def load(cls, csv_path):
+        path = journal_path(csv_path)
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path) as f:
+            state = json.load(f)
+        return cls(path, [[tuple(change) for change in batch] for batch in state['edits']], state['position'])
+
+    def save(self):
+        if not self.edits:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        part_path = self.path + '.part'
+        with open(part_path, 'w') as f:
+            json.dump({'edits': self.edits, 'position': self.position}, f)
+        os.replace(part_path, self.path)
+
+    def mapping(self):
+        """ Returns the {original_id: current_id} mapping of the applied batches. """
+        return resolve_id_mapping(change for batch in self.edits[:self.position] for change in batch)
+
+    @property
+    def can_undo(self):
+        return self.position > 0
+
+    @property
+    def can_redo(self):
+        return self.position < len(self.edits)
+
+    def record(self, changes):
+        """ Appends a batch of changes, dropping the undone batches. """
+        changes = [(int(old_id), int(new_id)) for old_id, new_id in changes]
+        del self.edits[self.position:]
+        self.edits.append(changes)
+        self.position = len(self.edits)
+        self.save()
+
+    def undo(self):
+        if not self.can_undo:
+            raise ValueError('Nothing to undo')
+        self.position -= 1
+        self.save()
+
+    def redo(self):
+        if not self.can_redo:
+            raise ValueError('Nothing to redo')
+        self.position += 1
+        self.save()
+
+    def clear(self):
+        self.edits = []
+        self.position = 0
+        self.save()
+
+    def to_dict(self):
+        return {
+            'edits': len(self.edits),
+            'position': self.position,
+            'can_undo': self.can_undo,
+            'can_redo': self.can_redo,
+            'mapping': {str(old_id): new_id for old_id, new_id in self.mapping().items()}
+        }
@@ -0,0 +1,172 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from metrics import metrics
+
+# Directory holding the cached renders, one <key>.mp4 file each
+RENDER_CACHE_DIR = os.path.join('temp', 'render_cache')
+# Disk budget of the cache; the least recently used renders are evicted beyond it
+RENDER_CACHE_BYTES = int(os.environ.get('RENDER_CACHE_BYTES', 10 * 1024 ** 3))
+# Bumped whenever the drawing of the boxes changes, so older renders stop matching
+RENDER_CACHE_VERSION = 1
+
+
+def link_or_copy(source_path, target_path):
+    """ Atomically makes target_path a hard link to source_path, or a copy across file systems. """
+    part_path = target_path + '.part'
+    try:
+        os.link(source_path, part_path)
+    except OSError:
+        shutil.copyfile(source_path, part_path)
+    os.replace(part_path, target_path)
+
+
+class RenderCache:
+    """
+    Rendered MP4 files keyed by the content of the video, the tracking data
+    and the render settings, so an identical render is never made twice.
+
+    Entries are hard links to the renders (copies across file systems). All
+    renderers replace their output file instead of writing into it, so the
+    cached file stays intact when a workspace renders again.
+    """
+
+    def __init__(self, directory=RENDER_CACHE_DIR, max_bytes=RENDER_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.video_digests = {}  # path -> (size, mtime_ns, digest)
+
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """ Picks up the renders cached by earlier runs, oldest access first. """
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.mp4'):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_atime, name[:-len('.mp4')], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, f'{key}.mp4')
+
+    def video_digest(self, video_path):
+        """ Returns the SHA-1 of the video file, hashing it only when it changed. """
+        stat = os.stat(video_path)
+        identity = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            known = self.video_digests.get(video_path)
+        if known is not None and known[:2] == identity:
+            return known[2]
+
+        hasher = hashlib.sha1()
+        with open(video_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(block)
+        digest = hasher.hexdigest()
+        self.remember_video_digest(video_path, digest)
+        return digest
+
+    def remember_video_digest(self, video_path, digest):
+        """ Records the SHA-1 of a video whose content was hashed elsewhere, e.g. while uploading. """
+        stat = os.stat(video_path)
+        with self.lock:
+            self.video_digests[video_path] = (stat.st_size, stat.st_mtime_ns, digest)
+
+    @staticmethod
+    def key(video_digest, tracking_digest, settings):
+        """ Returns the cache key of a render of the video with the tracking data and settings. """
+        identity = json.dumps({
+            'version': RENDER_CACHE_VERSION,
+            'video': video_digest,
+            'tracking': tracking_digest,
+            'settings': settings
+        }, sort_keys=True)
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def fetch(self, key, output_path):
+        """
+        Places the cached render of key at output_path and returns True, or
+        returns False when it is not cached.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return False
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        entry_path = self.entry_path(key)
+        try:
+            link_or_copy(entry_path, output_path)
+        except OSError as e:
+            # Evicted or removed meanwhile; render it again
+            logging.error(f"Error reading cached render {key}: {e}")
+            with self.lock:
+                self.hits -= 1
+                self.misses += 1
+            return False
+
+        # Refresh the access time that orders the entries after a restart
+        os.utime(entry_path)
+        logging.info(f"Render cache hit {key}: {output_path}")
+        return True
+
+    def store(self, key, output_path):
+        """ Adds the finished render at output_path to the cache. """
+        entry_path = self.entry_path(key)
+        link_or_copy(output_path, entry_path)
+        size = os.path.getsize(entry_path)
+
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                evicted_key, evicted_size = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+                evicted.append(evicted_key)
+
+        for evicted_key in evicted:
+            try:
+                os.remove(self.entry_path(evicted_key))
+            except OSError:
+                pass
+        if evicted:
+            logging.info(f"Evicted {len(evicted)} cached renders")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+
+render_cache = RenderCache()
+metrics.counter('render_cache_lookups_total', 'Render cache lookups by result', ['result'],
+                callback=lambda: {('hit',): render_cache.hits, ('miss',): render_cache.misses})
+metrics.counter('render_cache_evictions_total', 'Renders evicted from the render cache',
+                callback=lambda: {(): render_cache.evictions})
+metrics.gauge('render_cache_bytes', 'Disk space used by the render cache',
+              callback=lambda: {(): render_cache.total_bytes})
@@ -0,0 +1,185 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from metrics import metrics
+
+# Number of renders that may run at the same time
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 2))
+# Number of finished jobs kept around for status queries
+JOB_HISTORY = 100
+
+RENDER_JOBS = metrics.counter('render_jobs_total', 'Finished render jobs', ['kind', 'status'])
+RENDER_JOB_WAIT_SECONDS = metrics.summary('render_job_wait_seconds', 'Seconds render jobs waited for a worker', ['kind'])
+RENDER_JOB_SECONDS = metrics.summary('render_job_seconds', 'Seconds render jobs ran', ['kind'])
+
+
+class RenderJob:
+    """
+    A render submitted to the worker pool.
+
+    The job doubles as the progress object handed to the renderer, which
+    reports the frames it is going to process and every frame it finishes,
+    and can announce a preview of its result before it finishes.
+    """
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'
+        self.frames_processed = 0
+        self.total_frames = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.preview = None
+        self.error = None
+        self.future = None
+        # The workspace whose files the job renders, if any
+        self.workspace_id = None
+        # Set once a preview is announced or the job finished
+        self.preview_ready = threading.Event()
+
+    def add_total(self, frames):
+        self.total_frames += max(int(frames), 0)
+
+    def advance(self, frames=1):
+        self.frames_processed += frames
+
+    def set_preview(self, preview):
+        """ Announces a quicker, lower quality version of the result while the job goes on. """
+        self.preview = preview
+        self.preview_ready.set()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def eta_seconds(self):
+        """ Estimated seconds left, from the frame rate achieved so far. """
+        if self.status != 'running' or not self.frames_processed or not self.total_frames:
+            return None
+        elapsed = time.time() - self.started_at
+        remaining = max(self.total_frames - self.frames_processed, 0)
+        return remaining * elapsed / self.frames_processed
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        eta = self.eta_seconds()
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'frames_processed': self.frames_processed,
+            'total_frames': self.total_frames,
+            'progress': min(self.frames_processed / self.total_frames, 1.0) if self.total_frames else None,
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'elapsed_seconds': round(end - self.started_at, 1) if self.started_at else 0,
+            'result': self.result,
+            'preview': self.preview,
+            'error': self.error
+        }
+
+
+class RenderJobQueue:
+    """
+    Runs render functions on a pool of background threads. OpenCV and the
+    ffmpeg subprocesses release the GIL, so renders proceed in parallel.
+
+    Jobs submitted with the same key (e.g. the video they write) run one at a
+    time, in submission order: only the first is handed to the pool, the
+    others wait in the key's queue without holding a worker, and each job
+    hands the next one to the pool when it finishes.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        # Jobs waiting behind the running job of each key; a key is dropped when its last job finishes
+        self.key_queues = {}
+
+    def submit(self, kind, fn, *args, key=None, **kwargs):
+        """
+        Queues fn(*args, progress=job, **kwargs) and returns the job. The value
+        fn returns becomes job.result, and the result of job.future.
+        """
+        job = RenderJob(kind)
+        job.future = Future()
+        task = (job, key, fn, args, kwargs)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+            if key in self.key_queues:
+                self.key_queues[key].append(task)
+                task = None
+            elif key is not None:
+                self.key_queues[key] = deque()
+
+        if task is not None:
+            self.executor.submit(self._run, *task)
+        logging.info(f"Queued {kind} job {job.id}")
+        return job
+
+    def _run(self, job, key, fn, args, kwargs):
+        error = None
+        try:
+            job.status = 'running'
+            job.started_at = time.time()
+            RENDER_JOB_WAIT_SECONDS.observe(job.started_at - job.created_at, kind=job.kind)
+            if not job.future.set_running_or_notify_cancel():
+                raise RuntimeError('Job was cancelled')
+            job.result = fn(*args, progress=job, **kwargs)
+            job.status = 'done'
+        except Exception as e:
+            logging.error(f"Error in {job.kind} job {job.id}: {e}")
+            error = e
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            RENDER_JOB_SECONDS.observe(job.finished_at - job.started_at, kind=job.kind)
+            RENDER_JOBS.inc(kind=job.kind, status=job.status)
+            job.preview_ready.set()
+            if key is not None:
+                self._start_next(key)
+
+        if job.future.cancelled():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(job.result)
+
+    def _start_next(self, key):
+        """ Hands the next queued job of key to the pool, or forgets the key when none is left. """
+        with self.lock:
+            queue = self.key_queues[key]
+            if not queue:
+                del self.key_queues[key]
+                return
+            task = queue.popleft()
+        self.executor.submit(self._run, *task)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - JOB_HISTORY, 0)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def queue_depth(self):
+        """ Number of jobs waiting for or holding a worker. """
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if not job.finished)
+
+
+render_jobs = RenderJobQueue()
+metrics.gauge('render_queue_depth', 'Render jobs waiting for or holding a worker',
+              callback=lambda: {(): render_jobs.queue_depth()})
@@ -0,0 +1,146 @@
+import os
+import time
+import queue
+import threading
+
+# Frames each queue between two render stages holds before the stage feeding it waits
+RENDER_PIPELINE_DEPTH = max(int(os.environ.get('RENDER_PIPELINE_DEPTH', 8)), 1)
+# Seconds between checks for a failed stage while waiting on a queue
+POLL_SECONDS = 0.1
+
+# Marks the end of the items on a queue
+END = object()
+
+
+class StageStats:
+    """ Seconds a pipeline stage spent working, waiting for input and waiting for room for its output. """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.waiting_for_input = 0.0
+        self.waiting_for_output = 0.0
+
+    def utilization(self, elapsed):
+        """ Fraction of elapsed the stage was working; the stage near 1 limits the throughput. """
+        return self.busy / elapsed if elapsed > 0 else 0.0
+
+
+class Pipeline:
+    """
+    Stages that run in threads of their own and pass items on through queues
+    of at most depth items, so a slow stage makes the ones before it wait
+    instead of piling up items in memory.
+
+    The first stage is an iterable whose items are produced in its thread,
+    each following stage a function that takes the item of the stage before
+    it and returns the item for the next one. Meant for work that releases the
+    GIL, like OpenCV decoding and drawing or writing to an ffmpeg pipe.
+    """
+
+    def __init__(self, depth=RENDER_PIPELINE_DEPTH):
+        self.depth = depth
+        self.stop = threading.Event()
+        self.errors = []
+        self.stats = []
+        self.elapsed = 0.0
+
+    def _put(self, items, item, stats):
+        """ Puts item on the queue once there is room. Returns False when the pipeline stopped. """
+        started = time.perf_counter()
+        try:
+            while not self.stop.is_set():
+                try:
+                    items.put(item, timeout=POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        finally:
+            stats.waiting_for_output += time.perf_counter() - started
+
+    def _get(self, items, stats):
+        """ Returns the next item of the queue, or END when the pipeline stopped. """
+        started = time.perf_counter()
+        try:
+            while not self.stop.is_set():
+                try:
+                    return items.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    pass
+            return END
+        finally:
+            stats.waiting_for_input += time.perf_counter() - started
+
+    def _fail(self, error):
+        self.errors.append(error)
+        self.stop.set()
+
+    def _produce(self, source, output, stats):
+        try:
+            iterator = iter(source)
+            while not self.stop.is_set():
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    stats.busy += time.perf_counter() - started
+                stats.items += 1
+                if not self._put(output, item, stats):
+                    return
+            self._put(output, END, stats)
+        except BaseException as e:
+            self._fail(e)
+
+    def _process(self, fn, input, output, stats):
+        try:
+            while True:
+                item = self._get(input, stats)
+                if item is END:
+                    break
+                started = time.perf_counter()
+                result = fn(item)
+                stats.busy += time.perf_counter() - started
+                stats.items += 1
+                if output is not None and not self._put(output, result, stats):
+                    return
+            if output is not None and not self.stop.is_set():
+                self._put(output, END, stats)
+        except BaseException as e:
+            self._fail(e)
+
+    def run(self, stages):
+        """
+        Runs the (name, iterable or function) stages, an iterable and at least
+        one function, until every item of the iterable went through the last
+        stage, and returns the StageStats of the stages. The first error of any
+        stage stops all of them and is raised.
+        """
+        queues = [queue.Queue(maxsize=self.depth) for _ in stages[1:]]
+        self.stats = [StageStats(name) for name, _ in stages]
+
+        (_, source), stats = stages[0], self.stats[0]
+        threads = [threading.Thread(target=self._produce, args=(source, queues[0], stats),
+                                    name=f'pipeline-{stats.name}', daemon=True)]
+        for position, ((_, fn), stats) in enumerate(zip(stages[1:], self.stats[1:])):
+            output = queues[position + 1] if position + 1 < len(queues) else None
+            threads.append(threading.Thread(target=self._process, args=(fn, queues[position], output, stats),
+                                            name=f'pipeline-{stats.name}', daemon=True))
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - started
+
+        if self.errors:
+            raise self.errors[0]
+        return self.stats
+
+    def utilization(self):
+        """ Returns {stage name: fraction of the run it was working}. """
+        return {stats.name: stats.utilization(self.elapsed) for stats in self.stats}
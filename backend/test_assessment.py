@@ -0,0 +1,49 @@
+import numpy as np
+from tracking_store import parse_tracking_csv
+from csv_rendering import load_tracking_results_from_csv
+from track_index import TrackIntervalIndex
+from assesment import StoredResultsAssessment, StreamingAssessment
+
+# Tracks 1 to 4 are confident; every detection of track 5 is exactly at the 0.3 threshold
+BOUNDARY_CSV = 'frame,track_id,class_id,confidence,x1,y1,x2,y2\n' + ''.join(
+    f'{frame},{track_id},0,{0.3 if track_id == 5 else 0.9},{track_id * 10},0,{track_id * 10 + 5},5\n'
+    for frame in range(3) for track_id in range(1, 6)
+)
+
+
+def test_confidence_at_threshold_is_filtered():
+    data = parse_tracking_csv(BOUNDARY_CSV.encode())
+    assert data.confidence.dtype == np.float32
+
+    stored = StoredResultsAssessment()
+    stored.process_tracking_data(data, min_confidence=0.3)
+    assert stored.columns.track_ids == [1, 2, 3, 4]
+
+    streaming = StreamingAssessment()
+    streaming.process_chunk(data, min_confidence=0.3)
+    assert streaming.track_ids == [1, 2, 3, 4]
+
+    index = TrackIntervalIndex(data, min_confidence=0.3)
+    assert index.track_ids.tolist() == [1, 2, 3, 4]
+
+
+def test_float64_confidences_keep_their_precision():
+    detections = [[{'track_id': 1, 'confidence': 0.3, 'boxes': [0, 0, 5, 5]},
+                   {'track_id': 2, 'confidence': 0.30000001, 'boxes': [10, 0, 15, 5]}]]
+    stored = StoredResultsAssessment()
+    stored.process_stored_results(detections, min_confidence=0.3)
+    assert stored.columns.track_ids == [2]
+
+
+def test_loaded_csv_results_keep_their_values(tmp_path):
+    csv_path = tmp_path / 'tracking.csv'
+    csv_path.write_text('frame,track_id,class_id,confidence,x1,y1,x2,y2\n'
+                        '0,1,0,0.3,209.44,0,215,5\n'
+                        '0,2,0,0.9,10,0,15,5\n')
+    results = load_tracking_results_from_csv(str(csv_path))
+    assert results[0][0]['confidence'] == 0.3
+    assert results[0][0]['boxes'] == [209.44, 0, 215, 5]
+
+    stored = StoredResultsAssessment()
+    stored.process_stored_results(results, min_confidence=0.3)
+    assert stored.columns.track_ids == [2]
@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+import pytest
+from tracking_store import TrackingData
+from video_rendering import FrameIndex, LabelAtlas, draw_frame_boxes, draw_label, label_sprites
+
+# Exact float32 values halfway between hundredths, which f'{confidence:.2f}' rounds to even
+TIE_CONFIDENCES = [0.125, 0.625, 0.375, 0.875, -0.125, 0.005, -0.004, 0.3, 0.9]
+COLOR = (0, 255, 0)
+
+
+def tie_index():
+    count = len(TIE_CONFIDENCES)
+    return FrameIndex(TrackingData(
+        frame=np.zeros(count, dtype=np.int32),
+        track_id=np.arange(1, count + 1, dtype=np.int32),
+        class_id=np.zeros(count, dtype=np.int32),
+        confidence=np.array(TIE_CONFIDENCES, dtype=np.float32),
+        boxes=np.array([[20, 30 + 40 * row, 60, 50 + 40 * row] for row in range(count)], dtype=np.float32)
+    ))
+
+
+class RecordingSprites:
+    """ The label sprites, remembering the confidence texts asked for. """
+
+    def __init__(self):
+        self.confidence_texts = []
+
+    def prefix(self, text):
+        return label_sprites.prefix(text)
+
+    def confidence(self, text, prefix):
+        self.confidence_texts.append(text)
+        return label_sprites.confidence(text, prefix)
+
+
+def test_confidence_sprites_are_formatted_like_put_text_labels():
+    frame_index = tie_index()
+    sprites = RecordingSprites()
+    LabelAtlas(frame_index, sprites)
+    expected = {f'{float(confidence):.2f}' for confidence in frame_index.confidences}
+    assert set(sprites.confidence_texts) == expected
+
+
+@pytest.mark.skipif(label_sprites.anti_aliased, reason="OpenCV anti-aliases text, labels use cv2.putText")
+def test_sprite_labels_match_put_text_at_ties():
+    frame_index = tie_index()
+    frame = np.zeros((400, 400, 3), dtype=np.uint8)
+    draw_frame_boxes(frame, frame_index, 0, len(TIE_CONFIDENCES))
+
+    expected = np.zeros_like(frame)
+    for x1, y1, x2, y2 in frame_index.boxes.tolist():
+        cv2.rectangle(expected, (x1, y1), (x2, y2), COLOR, 2)
+    for row, (x1, y1, _, _) in enumerate(frame_index.boxes.tolist()):
+        draw_label(expected, frame_index, row, x1, y1 - 10, COLOR)
+    assert np.array_equal(frame, expected)
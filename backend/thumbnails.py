@@ -0,0 +1,108 @@
+import os
+import math
+import cv2
+import numpy as np
+from video_rendering import FrameIndex, draw_frame_boxes
+
+# Frames at most this far ahead of the current position are reached by decoding
+# forward; anything further is reached by seeking to the keyframe before it
+SEEK_DISTANCE = int(os.environ.get('THUMBNAIL_SEEK_FRAMES', 50))
+# Longest side of a thumbnail in pixels
+THUMBNAIL_SIZE = 160
+# Fraction of the box size added around a crop on every side
+CROP_PADDING = 0.5
+JPEG_QUALITY = 85
+
+
+def read_frames(video_path, frame_numbers):
+    """
+    Yields (frame_number, image) for the requested frames in increasing order.
+    Only the frames between a preceding keyframe and each requested frame are
+    decoded; frames past the end of the video are skipped.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Unable to open video file: {video_path}")
+
+    try:
+        position = 0
+        for frame_number in sorted(set(frame_numbers)):
+            if frame_number < position or frame_number - position > SEEK_DISTANCE:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+                position = frame_number
+            # grab() decodes without converting the frame, the cheap way forward
+            while position < frame_number and cap.grab():
+                position += 1
+
+            ret, image = cap.read()
+            if not ret:
+                break
+            position += 1
+            yield frame_number, image
+    finally:
+        cap.release()
+
+
+def fit(image, size):
+    """ Scales image so that its longest side is size pixels. """
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    return cv2.resize(image, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                      interpolation=cv2.INTER_AREA)
+
+
+def crop_box(image, box, padding=CROP_PADDING):
+    """ Returns the part of image around box, extended by padding times the box size. """
+    height, width = image.shape[:2]
+    x1, y1, x2, y2 = box
+    pad_x = (x2 - x1) * padding
+    pad_y = (y2 - y1) * padding
+    left = int(np.clip(x1 - pad_x, 0, width - 1))
+    top = int(np.clip(y1 - pad_y, 0, height - 1))
+    right = int(np.clip(x2 + pad_x, left + 1, width))
+    bottom = int(np.clip(y2 + pad_y, top + 1, height))
+    return image[top:bottom, left:right]
+
+
+def track_thumbnails(video_path, data, mode='crop', size=THUMBNAIL_SIZE):
+    """
+    Returns {row: thumbnail} for the rows of the TrackingData, each drawn on its
+    frame with only its own box. mode 'crop' cuts out the area around the box,
+    'frame' keeps the whole frame.
+    """
+    thumbnails = {}
+    for frame_number, image in read_frames(video_path, data.frame.tolist()):
+        for row in np.flatnonzero(data.frame == frame_number).tolist():
+            # Draw the row alone, even when several tracks are asked for on one frame
+            thumbnail = image.copy()
+            row_index = FrameIndex(data.take([row]))
+            draw_frame_boxes(thumbnail, row_index, *row_index.bounds(frame_number))
+            if mode == 'crop':
+                thumbnail = crop_box(thumbnail, data.boxes[row])
+            thumbnails[row] = fit(thumbnail, size)
+
+    return thumbnails
+
+
+def sprite_sheet(thumbnails, columns, size=THUMBNAIL_SIZE):
+    """
+    Tiles the thumbnails row by row into size x size cells, each thumbnail
+    centred in its cell, and returns the sheet image.
+    """
+    rows = max(math.ceil(len(thumbnails) / columns), 1)
+    sheet = np.zeros((rows * size, columns * size, 3), dtype=np.uint8)
+    for position, thumbnail in enumerate(thumbnails):
+        if thumbnail is None:
+            continue
+        height, width = thumbnail.shape[:2]
+        top = (position // columns) * size + (size - height) // 2
+        left = (position % columns) * size + (size - width) // 2
+        sheet[top:top + height, left:left + width] = thumbnail
+    return sheet
+
+
+def encode_jpeg(image):
+    ret, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ret:
+        raise ValueError("Failed to encode thumbnail")
+    return encoded.tobytes()
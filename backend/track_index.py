@@ -0,0 +1,141 @@
+import numpy as np
+from tracking_store import tracking_store, above_confidence
+
+# Queries of TrackIntervalIndex by the tracks they select
+TRACK_STATES = ('active', 'starting', 'ending')
+
+
+class IntervalSet:
+    """
+    Static closed intervals [start, end] sorted by start, for overlap queries
+    in O(log n + matches) numpy steps.
+
+    Over the sorted intervals sits a tree of maximum ends: max_ends[level][i]
+    is the largest end of intervals i * 2**level up to (i + 1) * 2**level. An
+    overlap query walks it down from the root, one level at a time, keeping
+    only the nodes that start before the range ends and reach into it.
+    """
+
+    def __init__(self, starts, ends, owners):
+        order = np.lexsort((ends, starts))
+        self.starts = np.asarray(starts, dtype=np.int64)[order]
+        self.ends = np.asarray(ends, dtype=np.int64)[order]
+        self.owners = np.asarray(owners, dtype=np.int64)[order]
+        self.by_end = np.argsort(self.ends, kind='stable')
+        self.sorted_ends = self.ends[self.by_end]
+
+        self.max_ends = [self.ends]
+        while len(self.max_ends[-1]) > 1:
+            ends = self.max_ends[-1]
+            pairs = np.maximum(ends[0:len(ends) - 1:2], ends[1::2])
+            self.max_ends.append(np.append(pairs, ends[-1]) if len(ends) % 2 else pairs)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, start, end):
+        """ Returns the positions of the intervals overlapping [start, end], in start order. """
+        limit = np.searchsorted(self.starts, end, side='right')
+        nodes = np.arange(len(self.max_ends[-1]))
+        for level in range(len(self.max_ends) - 1, -1, -1):
+            nodes = nodes[(nodes << level < limit) & (self.max_ends[level][nodes] >= start)]
+            if level:
+                children = np.stack([nodes * 2, nodes * 2 + 1], axis=1).reshape(-1)
+                nodes = children[children < len(self.max_ends[level - 1])]
+        return nodes
+
+    def starting(self, start, end):
+        """ Returns the positions of the intervals starting in [start, end], in start order. """
+        first = np.searchsorted(self.starts, start, side='left')
+        last = np.searchsorted(self.starts, end, side='right')
+        return np.arange(first, max(first, last))
+
+    def ending(self, start, end):
+        """ Returns the positions of the intervals ending in [start, end], in end order. """
+        first = np.searchsorted(self.sorted_ends, start, side='left')
+        last = np.searchsorted(self.sorted_ends, end, side='right')
+        return self.by_end[first:max(first, last)]
+
+
+class TrackIntervalIndex:
+    """
+    The frame span [start_frame, end_frame] of every track, and the segments
+    of consecutive frames it was detected in between its gaps, as
+    IntervalSets. Built once per tracking dataset, it answers which tracks are
+    active, start or end within a frame range without a scan over the tracks.
+
+    Tracks are numbered in the order they first appear, as in the assessment;
+    with min_confidence, only detections above it count, like there.
+    """
+
+    def __init__(self, data, min_confidence=None):
+        rows = np.argsort(data.frame, kind='stable')
+        rows = rows[data.frame[rows] >= 0]
+        if min_confidence is not None:
+            rows = rows[above_confidence(data.confidence[rows], min_confidence)]
+        frames = data.frame[rows].astype(np.int64)
+        track_ids = data.track_id[rows].astype(np.int64)
+
+        ids, firsts = np.unique(track_ids, return_index=True)
+        appearance = np.argsort(firsts, kind='stable')
+        self.track_ids = ids[appearance]
+        # Number of every track of ids in appearance order
+        positions = np.empty(len(ids), dtype=np.int64)
+        positions[appearance] = np.arange(len(ids))
+
+        order = np.lexsort((frames, track_ids))
+        frames = frames[order]
+        tracks = np.searchsorted(ids, track_ids[order])
+        new_track = np.ones(len(tracks), dtype=bool)
+        new_track[1:] = tracks[1:] != tracks[:-1]
+        # A new segment starts with every track and after every skipped frame
+        new_segment = new_track.copy()
+        new_segment[1:] |= np.diff(frames) > 1
+        # The last row of the index closes the last track and segment
+        track_ends = np.roll(new_track, -1)
+        segment_ends = np.roll(new_segment, -1)
+
+        self.start_frames = np.empty(len(ids), dtype=np.int64)
+        self.end_frames = np.empty(len(ids), dtype=np.int64)
+        self.start_frames[positions[tracks[new_track]]] = frames[new_track]
+        self.end_frames[positions[tracks[track_ends]]] = frames[track_ends]
+        segment_owners = positions[tracks[new_segment]]
+        self.gap_counts = np.bincount(segment_owners, minlength=len(ids)) - 1
+
+        self.spans = IntervalSet(self.start_frames, self.end_frames, np.arange(len(ids)))
+        self.segments = IntervalSet(frames[new_segment], frames[segment_ends], segment_owners)
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def active(self, start, end, visible=False):
+        """
+        Returns the numbers of the tracks whose span overlaps frames [start, end]
+        or, with visible, that were detected in one of them.
+        """
+        intervals = self.segments if visible else self.spans
+        return np.unique(intervals.owners[intervals.overlapping(start, end)])
+
+    def starting(self, start, end):
+        """ Returns the numbers of the tracks first seen in frames [start, end], by start frame. """
+        return self.spans.owners[self.spans.starting(start, end)]
+
+    def ending(self, start, end):
+        """ Returns the numbers of the tracks last seen in frames [start, end], by end frame. """
+        return self.spans.owners[self.spans.ending(start, end)]
+
+    def query(self, state, start, end, visible=False):
+        """ Returns the numbers of the tracks in the state ('active', 'starting' or 'ending') in [start, end]. """
+        if state == 'active':
+            return self.active(start, end, visible)
+        if state == 'starting':
+            return self.starting(start, end)
+        if state == 'ending':
+            return self.ending(start, end)
+        raise ValueError(f"Unknown track state: {state}")
+
+
+def track_intervals(csv_path, min_confidence=None):
+    """ Returns the TrackIntervalIndex of the CSV file with its ID edits, built once per content. """
+    return tracking_store.derived(csv_path, f'track_intervals:{min_confidence}',
+                                  lambda data: TrackIntervalIndex(data, min_confidence))
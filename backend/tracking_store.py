@@ -0,0 +1,552 @@
+import io
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+import numpy as np
+import pandas as pd
+from remap_journal import RemapJournal, resolve_id_mapping, remap_track_ids
+from column_file import write_column_file, read_column_file
+from metrics import metrics
+
+# Column layout of the tracking CSV written by save_tracking_results_to_csv
+TRACKING_COLUMNS = ['frame', 'track_id', 'class_id', 'confidence', 'x1', 'y1', 'x2', 'y2']
+TRACKING_DTYPES = {
+    'frame': np.int32,
+    'track_id': np.int32,
+    'class_id': np.int32,
+    'confidence': np.float32,
+    'x1': np.float32,
+    'y1': np.float32,
+    'x2': np.float32,
+    'y2': np.float32
+}
+
+# Formats of tracking files, told apart by their content:
+#   'csv'     - the columns of TRACKING_COLUMNS with a header line
+#   'parquet' - a Parquet table of those columns (needs pyarrow or fastparquet)
+#   'npz'     - NumPy arrays named after those columns, or 'boxes' of shape (N, 4) for x1..y2
+#   'mot'     - MOTChallenge text without a header: frame (from 1), id, bb_left, bb_top,
+#               bb_width, bb_height, conf, then x, y, z or, in ground truth files, class, visibility;
+#               told apart from headerless CSV by the .txt extension and this many columns
+TRACKING_FORMATS = ('csv', 'parquet', 'npz', 'mot')
+MOT_COLUMN_COUNTS = (9, 10)
+# Bytes of a tracking file its format is detected from
+FORMAT_PROBE_BYTES = 4096
+
+# The parsed columns of a tracking file are kept next to it in a memory-mapped file
+# with this suffix, so loads after the first skip parsing
+COLUMN_CACHE_SUFFIX = '.columns'
+COLUMN_CACHE_VERSION = 1
+
+# Number of parsed tracking datasets kept in memory
+MAX_CACHED_DATASETS = int(os.environ.get('TRACKING_CACHE_SIZE', 4))
+
+CSV_PARSE_SECONDS = metrics.summary('tracking_csv_parse_seconds', 'Seconds spent parsing tracking CSV files')
+CSV_PARSED_ROWS = metrics.counter('tracking_csv_parsed_rows_total', 'Rows parsed from tracking CSV files')
+STORE_LOOKUPS = metrics.counter('tracking_store_lookups_total',
+                                'Tracking file loads by cache result: hit, mapped (column cache) or miss', ['result'])
+
+
+@dataclass(frozen=True)
+class TrackingData:
+    """
+    Tracking results as typed columns, in the row order of the CSV file.
+
+    Instances are shared between requests and render jobs, so the arrays must
+    never be modified in place; derive a new instance with dataclasses.replace.
+    """
+    frame: np.ndarray       # int32
+    track_id: np.ndarray    # int32
+    class_id: np.ndarray    # int32
+    confidence: np.ndarray  # float32
+    boxes: np.ndarray       # float32, (N, 4) as x1, y1, x2, y2
+
+    def __len__(self):
+        return len(self.frame)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        return cls(
+            frame=df['frame'].to_numpy(dtype=np.int32),
+            track_id=df['track_id'].to_numpy(dtype=np.int32),
+            class_id=df['class_id'].to_numpy(dtype=np.int32),
+            confidence=df['confidence'].to_numpy(dtype=np.float32),
+            boxes=df[['x1', 'y1', 'x2', 'y2']].to_numpy(dtype=np.float32)
+        )
+
+    def to_dataframe(self):
+        return pd.DataFrame({
+            'frame': self.frame,
+            'track_id': self.track_id,
+            'class_id': self.class_id,
+            'confidence': self.confidence,
+            'x1': self.boxes[:, 0],
+            'y1': self.boxes[:, 1],
+            'x2': self.boxes[:, 2],
+            'y2': self.boxes[:, 3]
+        }, columns=TRACKING_COLUMNS)
+
+    def take(self, rows):
+        """ Returns the rows selected by an index or boolean mask array. """
+        return TrackingData(self.frame[rows], self.track_id[rows], self.class_id[rows],
+                            self.confidence[rows], self.boxes[rows])
+
+    def with_track_ids(self, track_id):
+        return replace(self, track_id=np.asarray(track_id, dtype=np.int32))
+
+
+def above_confidence(confidences, min_confidence):
+    """
+    Returns which confidences are above min_confidence, compared in the
+    precision they are stored in: a float32 0.3 is slightly more than the
+    float 0.3, but must not pass a threshold of 0.3.
+    """
+    return confidences > confidences.dtype.type(min_confidence)
+
+
+def mot_field_count(line):
+    """ Returns the number of comma or whitespace separated fields of a MOTChallenge line. """
+    return len(line.split(b',') if b',' in line else line.split())
+
+
+def detect_tracking_format(head, name):
+    """
+    Returns the TRACKING_FORMATS entry of the tracking file called name from
+    its first bytes. Raises ValueError for headerless text that is not a
+    MOTChallenge file.
+    """
+    if head.startswith(b'PAR1'):
+        return 'parquet'
+    if head.startswith(b'PK'):
+        return 'npz'
+    # MOTChallenge files have no header line
+    if head.lstrip()[:1].isdigit():
+        first_line = head.lstrip().split(b'\n', 1)[0].strip()
+        if not name.lower().endswith('.txt') or mot_field_count(first_line) not in MOT_COLUMN_COUNTS:
+            raise ValueError("Tracking files without a header line must be MOTChallenge .txt files "
+                             "with 9 or 10 columns")
+        return 'mot'
+    return 'csv'
+
+
+def file_tracking_format(path):
+    """ Returns the format of the tracking file at path, 'csv' when there is none yet. """
+    try:
+        with open(path, 'rb') as f:
+            return detect_tracking_format(f.read(FORMAT_PROBE_BYTES), path)
+    except FileNotFoundError:
+        return 'csv'
+
+
+def parse_tracking_csv(raw):
+    """ Parses the bytes of a tracking CSV file into TrackingData. """
+    df = pd.read_csv(io.BytesIO(raw), usecols=TRACKING_COLUMNS, dtype=TRACKING_DTYPES)
+    return TrackingData.from_dataframe(df)
+
+
+def parse_tracking_parquet(raw):
+    try:
+        df = pd.read_parquet(io.BytesIO(raw), columns=TRACKING_COLUMNS)
+    except ImportError:
+        raise ValueError("Reading Parquet tracking files requires pyarrow or fastparquet")
+    return TrackingData.from_dataframe(df)
+
+
+def parse_tracking_npz(raw):
+    with np.load(io.BytesIO(raw), allow_pickle=False) as arrays:
+        try:
+            if 'boxes' in arrays:
+                boxes = arrays['boxes']
+            else:
+                boxes = np.stack([arrays[name] for name in ('x1', 'y1', 'x2', 'y2')], axis=1)
+            return TrackingData(
+                frame=arrays['frame'].astype(np.int32),
+                track_id=arrays['track_id'].astype(np.int32),
+                class_id=arrays['class_id'].astype(np.int32),
+                confidence=arrays['confidence'].astype(np.float32),
+                boxes=boxes.astype(np.float32).reshape(-1, 4)
+            )
+        except KeyError as e:
+            raise ValueError(f"NPZ tracking file lacks the array {e}")
+
+
+def read_mot_values(raw):
+    """ Returns the columns of MOTChallenge text, separated by commas or whitespace, as a float64 array. """
+    first_line = raw.lstrip().split(b'\n', 1)[0]
+    separator = ',' if b',' in first_line else r'\s+'
+    return pd.read_csv(io.BytesIO(raw), sep=separator, header=None, dtype=np.float64).to_numpy()
+
+
+def parse_tracking_mot(raw):
+    values = read_mot_values(raw)
+    if values.shape[1] not in MOT_COLUMN_COUNTS:
+        raise ValueError("MOTChallenge tracking files need 9 or 10 columns")
+
+    left, top, width, height = values[:, 2], values[:, 3], values[:, 4], values[:, 5]
+    # Only ground truth files (9 columns) name the class
+    class_id = values[:, 7] if values.shape[1] == 9 else np.zeros(len(values))
+    return TrackingData(
+        frame=(values[:, 0] - 1).astype(np.int32),
+        track_id=values[:, 1].astype(np.int32),
+        class_id=class_id.astype(np.int32),
+        confidence=values[:, 6].astype(np.float32),
+        boxes=np.stack([left, top, left + width, top + height], axis=1).astype(np.float32)
+    )
+
+
+TRACKING_PARSERS = {
+    'csv': parse_tracking_csv,
+    'parquet': parse_tracking_parquet,
+    'npz': parse_tracking_npz,
+    'mot': parse_tracking_mot
+}
+
+
+def parse_tracking_file(raw, name):
+    """ Parses the bytes of the tracking file called name, in any of the TRACKING_FORMATS, into TrackingData. """
+    return TRACKING_PARSERS[detect_tracking_format(raw[:FORMAT_PROBE_BYTES], name)](raw)
+
+
+def serialize_tracking_mot(data, template=None):
+    """
+    Returns data as MOTChallenge text in the layout of template, the bytes of
+    the file it replaces: the 9 columns of ground truth, with the class, or
+    the columns of tracker results, 10 without a template. The columns the
+    tracking data does not hold (visibility, or x, y, z) are kept from the
+    template when it has as many rows, and -1 (visibility 1) otherwise.
+    """
+    values = read_mot_values(template) if template else np.zeros((0, 10))
+    kept = values if len(values) == len(data) else None
+
+    # Boxes and confidences stay float32, which pandas writes in the shortest form that reads back the same
+    x1, y1, x2, y2 = data.boxes.T
+    columns = {
+        'frame': data.frame.astype(np.int64) + 1, 'id': data.track_id,
+        'left': x1, 'top': y1, 'width': x2 - x1, 'height': y2 - y1,
+        'conf': data.confidence
+    }
+    if values.shape[1] == 9:
+        columns['class'] = data.class_id
+        columns['visibility'] = kept[:, 8] if kept is not None else 1.0
+    else:
+        for column in range(7, values.shape[1]):
+            columns[column] = kept[:, column] if kept is not None else -1
+    return pd.DataFrame(columns).to_csv(header=False, index=False).encode()
+
+
+def serialize_tracking_data(data, tracking_format='csv', template=None):
+    """
+    Returns the bytes of a tracking file in the format holding data. template
+    is the file it replaces, whose layout MOTChallenge text keeps.
+    """
+    if tracking_format == 'csv':
+        return data.to_dataframe().to_csv(index=False).encode()
+
+    buffer = io.BytesIO()
+    if tracking_format == 'parquet':
+        try:
+            data.to_dataframe().to_parquet(buffer, index=False)
+        except ImportError:
+            raise ValueError("Writing Parquet tracking files requires pyarrow or fastparquet")
+    elif tracking_format == 'npz':
+        np.savez(buffer, frame=data.frame, track_id=data.track_id, class_id=data.class_id,
+                 confidence=data.confidence, boxes=data.boxes)
+    elif tracking_format == 'mot':
+        return serialize_tracking_mot(data, template)
+    else:
+        raise ValueError(f"Unknown tracking format: {tracking_format}")
+    return buffer.getvalue()
+
+
+def column_cache_path(path):
+    return path + COLUMN_CACHE_SUFFIX
+
+
+def write_column_cache(path, data, digest, identity):
+    """ Writes the columns of data as the column cache of the tracking file with the (size, mtime_ns) identity. """
+    columns = {'frame': data.frame, 'track_id': data.track_id, 'class_id': data.class_id,
+               'confidence': data.confidence, 'boxes': data.boxes}
+    meta = {'version': COLUMN_CACHE_VERSION, 'size': identity[0], 'mtime_ns': identity[1], 'digest': digest}
+    write_column_file(column_cache_path(path), columns, meta)
+
+
+def read_column_cache(path, identity):
+    """
+    Returns the TrackingData memory-mapped from the column cache of the
+    tracking file and the digest of the file, or None when there is no cache
+    for the (size, mtime_ns) identity of the file.
+    """
+    try:
+        columns, meta = read_column_file(column_cache_path(path))
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != COLUMN_CACHE_VERSION or (meta.get('size'), meta.get('mtime_ns')) != identity:
+        return None
+    return TrackingData(**columns), meta['digest']
+
+
+def sort_by_frame(data):
+    """ Returns the rows of data stably sorted by frame. """
+    return data.take(np.argsort(data.frame, kind='stable'))
+
+
+def tracking_data_digest(data):
+    """
+    Returns a hash of the tracking values themselves, independent of how the
+    CSV file that held them was formatted.
+    """
+    hasher = hashlib.sha1()
+    for column in (data.frame, data.track_id, data.class_id, data.confidence, data.boxes):
+        hasher.update(np.ascontiguousarray(column).tobytes())
+    return hasher.hexdigest()
+
+
+def iter_tracking_csv(path, chunk_rows=100000):
+    """
+    Yields the rows of a tracking file as TrackingData chunks of up to
+    chunk_rows rows, with the file's remap journal applied.
+
+    They are slices of the column cache when the file has one. Otherwise a
+    CSV file is read chunk by chunk, and other formats are loaded whole.
+    """
+    mapping = RemapJournal.load(path).mapping()
+    path = os.path.abspath(path)
+    mapped = read_column_cache(path, TrackingStore._file_identity(path))
+    if mapped is None and file_tracking_format(path) == 'csv':
+        for df in pd.read_csv(path, usecols=TRACKING_COLUMNS, dtype=TRACKING_DTYPES, chunksize=chunk_rows):
+            yield remap_track_ids(TrackingData.from_dataframe(df), mapping)[0]
+        return
+
+    data = mapped[0] if mapped is not None else tracking_store.load_file(path)[0]
+    for start in range(0, len(data), chunk_rows):
+        yield remap_track_ids(data.take(slice(start, start + chunk_rows)), mapping)[0]
+
+
+class TrackingStore:
+    """
+    In-process cache of parsed tracking files.
+
+    Files are identified by path, size and modification time; the parsed data
+    is keyed by the SHA-1 of the file content, so a file is parsed once and
+    then served from memory until it changes on disk. Files can be in any of
+    the TRACKING_FORMATS. Their columns are also written to a column cache
+    next to them, which later loads, e.g. after a restart, memory-map instead
+    of parsing the file again.
+
+    Track ID edits are not written to the file: they are recorded in the
+    file's RemapJournal and applied when the data is loaded, so every reader
+    sees them. Only commit() writes the edited data back to the file.
+
+    Structures computed from a dataset (sorted views, indexes) can be cached
+    alongside it with derived(); they are dropped together with the dataset.
+    """
+
+    def __init__(self, max_datasets=MAX_CACHED_DATASETS):
+        self.max_datasets = max_datasets
+        self.lock = threading.Lock()
+        self.identities = {}  # path -> (size, mtime_ns, digest)
+        self.datasets = OrderedDict()  # digest -> TrackingData, least recently used first
+        self.derived_values = {}  # digest -> {name: value}
+        self.journals = {}  # path -> RemapJournal
+
+    @staticmethod
+    def _file_identity(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _lookup(self, path):
+        identity = self.identities.get(path)
+        if identity is None or identity[:2] != self._file_identity(path):
+            return None, None
+        digest = identity[2]
+        return digest, self._cached(digest)
+
+    def _cached(self, digest):
+        data = self.datasets.get(digest)
+        if data is not None:
+            self.datasets.move_to_end(digest)
+        return data
+
+    def _cache(self, digest, data):
+        self.datasets[digest] = data
+        self.datasets.move_to_end(digest)
+        while len(self.datasets) > self.max_datasets:
+            evicted, _ = self.datasets.popitem(last=False)
+            self.derived_values.pop(evicted, None)
+
+    def _remember(self, path, digest, data):
+        self.identities[path] = self._file_identity(path) + (digest,)
+        self._cache(digest, data)
+
+    def _journal(self, path):
+        journal = self.journals.get(path)
+        if journal is None:
+            journal = self.journals[path] = RemapJournal.load(path)
+        return journal
+
+    def load(self, path):
+        """ Returns the TrackingData of the file with its ID edits, parsing it only if it is not cached. """
+        return self.load_with_digest(path)[0]
+
+    def load_file(self, path):
+        """ Returns the TrackingData of the file and the hash of its content, without the ID edits. """
+        path = os.path.abspath(path)
+        with self.lock:
+            digest, data = self._lookup(path)
+            if data is not None:
+                STORE_LOOKUPS.inc(result='hit')
+                return data, digest
+
+        identity = self._file_identity(path)
+        mapped = read_column_cache(path, identity)
+        if mapped is not None:
+            STORE_LOOKUPS.inc(result='mapped')
+            data, digest = mapped
+            with self.lock:
+                data = self.datasets.get(digest, data)
+                self._remember(path, digest, data)
+                return data, digest
+
+        STORE_LOOKUPS.inc(result='miss')
+        with open(path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha1(raw).hexdigest()
+
+        with self.lock:
+            data = self.datasets.get(digest)
+            if data is None:
+                with CSV_PARSE_SECONDS.time():
+                    data = parse_tracking_file(raw, path)
+                CSV_PARSED_ROWS.inc(len(data))
+                logging.info(f"Parsed {len(data)} tracking rows from {path}")
+            self._remember(path, digest, data)
+
+        self._write_column_cache(path, data, digest, identity)
+        return data, digest
+
+    @staticmethod
+    def _write_column_cache(path, data, digest, identity):
+        try:
+            write_column_cache(path, data, digest, identity)
+        except OSError as e:
+            # Later loads parse the file again
+            logging.warning(f"Error writing the column cache of {path}: {e}")
+
+    def load_with_digest(self, path):
+        """ Returns the TrackingData of the file with its ID edits, and a hash identifying both. """
+        data, digest = self.load_file(path)
+        with self.lock:
+            mapping = self._journal(os.path.abspath(path)).mapping()
+        if not mapping:
+            return data, digest
+
+        edited_digest = hashlib.sha1(f'{digest}:{sorted(mapping.items())}'.encode()).hexdigest()
+        with self.lock:
+            edited = self._cached(edited_digest)
+        if edited is None:
+            edited = remap_track_ids(data, mapping)[0]
+            with self.lock:
+                self._cache(edited_digest, edited)
+        return edited, edited_digest
+
+    def derived(self, path, name, build):
+        """
+        Returns build(data) for the current content of the file, computing it
+        only once per content.
+        """
+        return self.derived_value(*self.load_with_digest(path), name, build)
+
+    def derived_value(self, data, digest, name, build):
+        """ Like derived(), for data and digest already returned by load_with_digest(). """
+        with self.lock:
+            value = self.derived_values.get(digest, {}).get(name)
+        if value is None:
+            value = build(data)
+            with self.lock:
+                if digest in self.datasets:
+                    self.derived_values.setdefault(digest, {})[name] = value
+        return value
+
+    def digest(self, path):
+        """ Returns the hash identifying the content of the file and its ID edits, loading it if needed. """
+        return self.load_with_digest(path)[1]
+
+    def journal(self, path):
+        """ Returns the state of the remap journal of the file. """
+        with self.lock:
+            return self._journal(os.path.abspath(path)).to_dict()
+
+    def edit(self, path, changes):
+        """
+        Records a batch of (old_id, new_id) changes in the remap journal of the
+        file. Returns the number of rows changed per old ID and the frame
+        numbers of those rows.
+        """
+        data, _ = self.load_with_digest(path)
+        mapping = resolve_id_mapping(changes)
+        row_counts, changed = remap_track_ids(data, mapping)[1:]
+        with self.lock:
+            self._journal(os.path.abspath(path)).record(changes)
+        logging.info(f"Recorded track_id changes {mapping} of {path}: {row_counts}")
+        return row_counts, np.unique(data.frame[changed])
+
+    def undo(self, path):
+        """ Reverts the last batch of ID changes. Returns the frame numbers of the rows it changed. """
+        return self._step(path, RemapJournal.undo)
+
+    def redo(self, path):
+        """ Reapplies the last undone batch of ID changes. Returns the frame numbers of the rows it changed. """
+        return self._step(path, RemapJournal.redo)
+
+    def _step(self, path, move):
+        before, _ = self.load_with_digest(path)
+        with self.lock:
+            move(self._journal(os.path.abspath(path)))
+        after, _ = self.load_with_digest(path)
+        return np.unique(before.frame[before.track_id != after.track_id])
+
+    def commit(self, path):
+        """ Writes the file with its ID edits applied and clears its remap journal. """
+        data, _ = self.load_with_digest(path)
+        self.save(path, data)
+        return data
+
+    def save(self, path, data):
+        """ Writes data as the tracking file, in its format, replacing it and its ID edits, and caches it. """
+        path = os.path.abspath(path)
+        tracking_format = file_tracking_format(path)
+        template = None
+        if tracking_format == 'mot':
+            with open(path, 'rb') as f:
+                template = f.read()
+        raw = serialize_tracking_data(data, tracking_format, template)
+        digest = hashlib.sha1(raw).hexdigest()
+
+        part_path = path + '.part'
+        with open(part_path, 'wb') as f:
+            f.write(raw)
+
+        with self.lock:
+            os.replace(part_path, path)
+            identity = self._file_identity(path)
+            self._remember(path, digest, data)
+            self._journal(path).clear()
+        self._write_column_cache(path, data, digest, identity)
+
+    def invalidate(self, path):
+        """ Forgets the file after it was replaced by other means, together with its ID edits. """
+        path = os.path.abspath(path)
+        with self.lock:
+            self.identities.pop(path, None)
+            journal = self.journals.pop(path, None) or RemapJournal.load(path)
+            journal.clear()
+        try:
+            os.remove(column_cache_path(path))
+        except OSError:
+            pass
+
+
+tracking_store = TrackingStore()
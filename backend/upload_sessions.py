@@ -0,0 +1,172 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from metrics import metrics
+
+# Directory holding the partial files of unfinished uploads
+UPLOAD_DIR = os.path.join('temp', 'uploads')
+# Size of the chunks clients are asked to send, and of the blocks read from a request body
+UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_BYTES', 8 * 1024 * 1024))
+READ_BLOCK_BYTES = 1024 * 1024
+# Seconds an unfinished upload is kept after its last chunk
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))
+
+UPLOAD_KINDS = ('video', 'csv')
+
+UPLOAD_BYTES = metrics.counter('upload_bytes_total', 'Bytes received by chunked uploads', ['kind'])
+
+
+class UploadError(Exception):
+    """ A chunk or completion request that does not fit the state of its upload. """
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class UploadSession:
+    """
+    A file uploaded in chunks. Chunks are appended straight to a partial file
+    and hashed as they arrive, so completing the upload needs no second pass.
+    """
+
+    def __init__(self, kind, filename, total_size, workspace_id):
+        self.id = uuid.uuid4().hex
+        self.workspace_id = workspace_id
+        self.kind = kind
+        self.filename = filename
+        self.total_size = total_size
+        self.offset = 0
+        self.hasher = hashlib.sha1()
+        self.part_path = os.path.join(UPLOAD_DIR, f'{self.id}.part')
+        self.updated_at = time.time()
+        self.path = None
+        self.digest = None
+        self.lock = threading.Lock()
+
+    @property
+    def complete(self):
+        return self.path is not None
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'workspace_id': self.workspace_id,
+            'kind': self.kind,
+            'filename': self.filename,
+            'size': self.total_size,
+            'offset': self.offset,
+            'chunk_size': UPLOAD_CHUNK_BYTES,
+            'complete': self.complete,
+            'sha1': self.digest
+        }
+
+
+class UploadSessionStore:
+    """
+    Upload sessions by ID. A client resumes an interrupted upload by asking
+    for the session's offset and sending the rest of the file from there.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create(self, kind, filename, total_size, workspace_id):
+        if kind not in UPLOAD_KINDS:
+            raise UploadError(f'Unknown upload kind: {kind}')
+        filename = os.path.basename(filename or '')
+        if not filename:
+            raise UploadError('A file name is required')
+        if total_size < 0:
+            raise UploadError('The file size must not be negative')
+
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        session = UploadSession(kind, filename, total_size, workspace_id)
+        open(session.part_path, 'wb').close()
+
+        with self.lock:
+            self._prune()
+            self.sessions[session.id] = session
+        logging.info(f"Started {kind} upload {session.id} of {filename} ({total_size} bytes)")
+        return session
+
+    def get(self, upload_id):
+        with self.lock:
+            return self.sessions.get(upload_id)
+
+    def append(self, session, offset, stream):
+        """
+        Writes the chunk read from stream at offset and returns the new offset.
+        A chunk at any other offset than the current end of the file is
+        rejected with the offset to resume from.
+        """
+        with session.lock:
+            if session.complete:
+                raise UploadError('Upload is already complete', status=409, offset=session.offset)
+            if offset != session.offset:
+                raise UploadError(f'Expected a chunk at offset {session.offset}', status=409, offset=session.offset)
+
+            # Hash a copy, so a chunk that breaks off midway leaves the session untouched
+            hasher = session.hasher.copy()
+            written = 0
+            with open(session.part_path, 'ab') as f:
+                try:
+                    while True:
+                        block = stream.read(READ_BLOCK_BYTES)
+                        if not block:
+                            break
+                        if session.offset + written + len(block) > session.total_size:
+                            raise UploadError('Chunk extends past the declared file size', status=413,
+                                              offset=session.offset)
+                        f.write(block)
+                        hasher.update(block)
+                        written += len(block)
+                except Exception:
+                    # Drop the partial chunk so the client can resend it
+                    f.truncate(session.offset)
+                    raise
+
+            session.hasher = hasher
+            session.offset += written
+            UPLOAD_BYTES.inc(written, kind=session.kind)
+            session.updated_at = time.time()
+            return session.offset
+
+    def complete(self, session, expected_digest, directory):
+        """ Moves the finished file into directory and returns its path. """
+        with session.lock:
+            if session.complete:
+                return session.path
+            if session.offset != session.total_size:
+                raise UploadError(f'Upload is incomplete: {session.offset} of {session.total_size} bytes',
+                                  status=409, offset=session.offset)
+
+            digest = session.hasher.hexdigest()
+            if expected_digest and expected_digest.lower() != digest:
+                raise UploadError(f'Content hash mismatch: received {digest}', status=422, offset=session.offset)
+
+            path = os.path.join(directory, session.filename)
+            shutil.move(session.part_path, path)
+            session.digest = digest
+            session.path = path
+            session.updated_at = time.time()
+
+        logging.info(f"Completed upload {session.id}: {path} (sha1 {digest})")
+        return path
+
+    def _prune(self):
+        expired = [upload_id for upload_id, session in self.sessions.items()
+                   if time.time() - session.updated_at > UPLOAD_SESSION_TTL]
+        for upload_id in expired:
+            session = self.sessions.pop(upload_id)
+            if not session.complete and os.path.exists(session.part_path):
+                os.remove(session.part_path)
+
+
+upload_sessions = UploadSessionStore()
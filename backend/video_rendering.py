@@ -0,0 +1,1042 @@
+import os
+import json
+import time
+import hashlib
+import shutil
+import logging
+import threading
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+from tracking_store import tracking_store
+from metrics import metrics, ProgressLog
+from render_pipeline import Pipeline
+
+# Render backends selectable by the /upload and /update-id flows:
+#   'segments' - like 'pipe', but the video is encoded as fixed-length segments
+#                that are spliced into the final MP4, so an ID edit only
+#                re-encodes the segments it touches
+#   'parallel' - the segments of the 'segments' backend rendered by a pool of
+#                RENDER_PROCESSES processes, each seeking to its own frame range
+#   'pipe'     - annotated raw frames are streamed straight into one ffmpeg
+#                process that writes the final H.264 MP4 in a single pass
+#   'avi'      - frames are written to an MJPG AVI next to the video which convert_to_mp4
+#                then re-encodes to MP4
+RENDER_BACKENDS = ('segments', 'parallel', 'pipe', 'avi')
+SEGMENTED_BACKENDS = ('segments', 'parallel')
+DEFAULT_RENDER_BACKEND = os.environ.get('RENDER_BACKEND', 'segments')
+
+# Number of frames per independently encoded segment of the 'segments' backend
+SEGMENT_FRAMES = int(os.environ.get('RENDER_SEGMENT_FRAMES', 250))
+
+# Number of worker processes of the 'parallel' backend
+RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES', os.cpu_count() or 1))
+
+# H.264 settings shared by every backend that produces the final MP4
+X264_PRESET = 'fast'
+X264_CRF = '23'
+
+# Proxy render announced before the full one: frames at most PROXY_HEIGHT pixels
+# high at about PROXY_FPS frames per second, encoded for speed over quality
+PROXY_HEIGHT = int(os.environ.get('RENDER_PROXY_HEIGHT', 360))
+PROXY_FPS = float(os.environ.get('RENDER_PROXY_FPS', 10))
+PROXY_X264_PRESET = 'ultrafast'
+PROXY_X264_CRF = '30'
+
+# Box label text, drawn as cv2.putText(frame, label, (x1, y1 - 10), LABEL_FONT, LABEL_SCALE, color, LABEL_THICKNESS)
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_SCALE = 0.5
+LABEL_THICKNESS = 1
+DIGITS_TO_ZERO = str.maketrans('123456789', '000000000')
+# Number of rasterized label parts kept for reuse
+LABEL_CACHE_SIZE = int(os.environ.get('LABEL_CACHE_SIZE', 4096))
+
+RENDER_STAGE_SECONDS = metrics.summary(
+    'render_stage_seconds', 'Seconds spent decoding, drawing and writing frames; the count is frames', ['stage'])
+RENDER_STAGE_WAIT_SECONDS = metrics.summary(
+    'render_stage_wait_seconds', 'Seconds render stages waited for frames or for room to pass them on',
+    ['stage', 'waiting_for'])
+RENDER_STAGE_UTILIZATION = metrics.gauge(
+    'render_stage_utilization', 'Fraction of the last render each stage was working; the highest limits it', ['stage'])
+RENDER_FRAMES = metrics.counter('render_frames_total', 'Frames annotated by renders')
+DETECTIONS_DRAWN = metrics.counter('render_detections_drawn_total', 'Bounding boxes drawn into rendered frames')
+FFMPEG_SECONDS = metrics.summary('ffmpeg_seconds', 'Wall-clock seconds of ffmpeg subprocesses', ['operation'])
+RENDER_SECONDS = metrics.summary('render_seconds', 'Wall-clock seconds of renders', ['backend', 'mode'])
+RENDER_OUTPUT_BYTES = metrics.counter('render_output_bytes_total', 'Bytes of rendered MP4 files written', ['backend'])
+
+
+class FrameIndex:
+    """
+    Tracking rows sorted by frame and split into contiguous per-frame slices.
+
+    Built once per render from the TrackingData so that looking up the boxes
+    of a frame costs O(boxes in that frame) instead of a scan over all rows.
+    scale is the (x, y) factor of frames resized from the video's size.
+    """
+
+    def __init__(self, data, scale=None):
+        order = np.argsort(data.frame, kind='stable')
+        frames = data.frame[order]
+
+        self.track_ids = data.track_id[order]
+        self.class_ids = data.class_id[order]
+        self.confidences = data.confidence[order]
+        boxes = data.boxes[order]
+        if scale is not None:
+            boxes = boxes * np.array([scale[0], scale[1], scale[0], scale[1]], dtype=np.float32)
+        # int() truncation of the float coordinates, as cv2 needs pixel ints
+        self.boxes = boxes.astype(np.int32)
+
+        # offsets[f]:offsets[f + 1] are the rows of frame f
+        num_frames = int(frames[-1]) + 1 if len(frames) else 0
+        self.offsets = np.searchsorted(frames, np.arange(num_frames + 1), side='left')
+        self._labels = None
+
+    @property
+    def labels(self):
+        """ The LabelAtlas of the rows, built on first use. """
+        if self._labels is None:
+            self._labels = LabelAtlas(self)
+        return self._labels
+
+    def bounds(self, frame_idx):
+        """ Returns the (start, end) row range of the given frame. """
+        if frame_idx < 0 or frame_idx + 1 >= len(self.offsets):
+            return 0, 0
+        return int(self.offsets[frame_idx]), int(self.offsets[frame_idx + 1])
+
+
+class LabelSprites:
+    """
+    Rasterized box label text, shared by all renders of the process.
+
+    A label is made of two sprites: 'ID: <track>, Class: <class>, Conf: ',
+    cached per track, and the confidence, cached per value as shown and digit
+    layout of the IDs before it, so a few hundred sprites serve every frame of
+    a video. Text drawn at the same position relative to its origin covers the
+    same pixels, which keeps the labels identical to the cv2.putText ones. The
+    least recently used sprites are evicted beyond max_sprites.
+
+    A sprite is (rows, columns, bounds): its pixels relative to the text
+    origin and their (top, left, bottom, right).
+    """
+
+    def __init__(self, max_sprites=LABEL_CACHE_SIZE):
+        self.max_sprites = max_sprites
+        self.lock = threading.Lock()
+        self.sprites = OrderedDict()
+        # OpenCV 5 anti-aliases text; blending the sprites costs more than cv2.putText then
+        coverage, _ = self.render('0')
+        self.anti_aliased = bool(np.isin(coverage, (0, 255), invert=True).any())
+
+    @staticmethod
+    def render(text):
+        """ Returns the coverage of text drawn in an image of its own, and the text origin in it. """
+        (width, height), baseline = cv2.getTextSize(text, LABEL_FONT, LABEL_SCALE, LABEL_THICKNESS)
+        # Glyphs may reach a little past the reported size
+        margin = 4
+        origin = (margin, margin + height)
+        coverage = np.zeros((height + baseline + 2 * margin, width + 2 * margin), dtype=np.uint8)
+        cv2.putText(coverage, text, origin, LABEL_FONT, LABEL_SCALE, 255, LABEL_THICKNESS)
+        return coverage, origin
+
+    @staticmethod
+    def sprite(coverage, origin):
+        """ Returns the sprite of the text rendered into coverage. """
+        rows, columns = np.nonzero(coverage)
+        rows = rows - origin[1]
+        columns = columns - origin[0]
+        if not len(rows):
+            return rows, columns, (0, 0, 0, 0)
+        return rows, columns, (int(rows.min()), int(columns.min()), int(rows.max()) + 1, int(columns.max()) + 1)
+
+    def _cached(self, key, create):
+        with self.lock:
+            if key in self.sprites:
+                self.sprites.move_to_end(key)
+                return self.sprites[key]
+
+        sprite = create()
+        with self.lock:
+            self.sprites[key] = sprite
+            while len(self.sprites) > self.max_sprites:
+                self.sprites.popitem(last=False)
+        return sprite
+
+    def prefix(self, prefix_text):
+        """ Returns the sprite of the label text before the confidence. """
+        return self._cached(('prefix', prefix_text), lambda: self.sprite(*self.render(prefix_text)))
+
+    def confidence(self, confidence_text, prefix_text):
+        """
+        Returns the sprite of the confidence following prefix_text, relative to
+        the origin of the whole label. The digits of the Hershey fonts all have
+        the same width, so the sprite serves every prefix with as many digits
+        in the same places.
+        """
+        def create():
+            coverage, origin = self.render(prefix_text + confidence_text)
+            prefix_coverage = self.render(prefix_text)[0]
+            # The trailing space of the prefix keeps both parts apart
+            coverage[:, :prefix_coverage.shape[1]][prefix_coverage > 0] = 0
+            return self.sprite(coverage, origin)
+        layout = prefix_text.translate(DIGITS_TO_ZERO)
+        return self._cached(('confidence', confidence_text, layout), create)
+
+
+label_sprites = LabelSprites()
+
+
+class LabelAtlas:
+    """
+    The label sprites of every row of a FrameIndex, packed into flat arrays so
+    that the labels of a frame are gathered and drawn with a few vectorized
+    operations, without any Python work per box.
+    """
+
+    def __init__(self, frame_index, sprites=label_sprites):
+        self.frame_index = frame_index
+        # One prefix sprite per (track ID, class ID), found through a combined 64 bit key
+        pairs = (frame_index.track_ids.astype(np.int64) << 32) | (frame_index.class_ids.astype(np.int64) & 0xFFFFFFFF)
+        _, prefix_firsts, prefix_rows = np.unique(pairs, return_index=True, return_inverse=True)
+        prefix_texts = [f'ID: {track_id}, Class: {class_id}, Conf: ' for track_id, class_id in
+                        zip(frame_index.track_ids[prefix_firsts].tolist(), frame_index.class_ids[prefix_firsts].tolist())]
+
+        # The confidence sprites depend on the digit layout of the prefix only
+        layouts = {}
+        prefix_layouts = np.array([layouts.setdefault(text.translate(DIGITS_TO_ZERO), len(layouts))
+                                   for text in prefix_texts], dtype=np.int64)
+        row_layouts = prefix_layouts[prefix_rows] if len(prefix_texts) else np.zeros(0, dtype=np.int64)
+
+        # The confidence as shown by f'{confidence:.2f}', in hundredths
+        confidences = frame_index.confidences.astype(np.float64)
+        # Anything else, like nan, is drawn by cv2.putText
+        self.drawable = np.abs(confidences) < 1e12
+        scaled = np.where(self.drawable, confidences, 0) * 100
+        hundredths = np.rint(scaled).astype(np.int64)
+        # Values at or near a tie, like 0.125, are rounded by the formatting itself
+        ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+        tie_values, tie_rows = np.unique(confidences[ties], return_inverse=True)
+        tie_hundredths = [round(float(f'{value:.2f}') * 100) for value in tie_values.tolist()]
+        hundredths[ties] = np.array(tie_hundredths, dtype=np.int64).reshape(-1)[tie_rows.reshape(-1)]
+        # Small negative confidences show as -0.00
+        negative_zero = (hundredths == 0) & (confidences < 0)
+        keys = (hundredths * 2 + negative_zero) * max(len(layouts), 1) + row_layouts
+        _, confidence_firsts, confidence_rows = np.unique(keys, return_index=True, return_inverse=True)
+
+        atlas = [sprites.prefix(text) for text in prefix_texts]
+        for row in confidence_firsts.tolist():
+            text = ('-' if negative_zero[row] else '') + f'{hundredths[row] / 100:.2f}'
+            atlas.append(sprites.confidence(text, prefix_texts[prefix_rows[row]]))
+        self.prefix_sprites = prefix_rows
+        self.confidence_sprites = confidence_rows + len(prefix_texts)
+
+        self.lengths = np.array([len(rows) for rows, _, _ in atlas], dtype=np.int64)
+        self.starts = np.cumsum(self.lengths) - self.lengths
+        self.rows = np.concatenate([rows for rows, _, _ in atlas] or [np.zeros(0, np.int64)])
+        self.columns = np.concatenate([columns for _, columns, _ in atlas] or [np.zeros(0, np.int64)])
+        self._offsets = None
+
+        # (top, left, bottom, right) of the whole label of every row
+        bounds = np.array([bounds for _, _, bounds in atlas], dtype=np.int64).reshape(-1, 4)
+        prefix_bounds = bounds[self.prefix_sprites]
+        confidence_bounds = bounds[self.confidence_sprites]
+        self.bounds = np.concatenate([np.minimum(prefix_bounds[:, :2], confidence_bounds[:, :2]),
+                                      np.maximum(prefix_bounds[:, 2:], confidence_bounds[:, 2:])], axis=1)
+
+    def offsets(self, frame_width):
+        """ Returns the offsets of the packed pixels from their text origins in frames of the width. """
+        if self._offsets is None or self._offsets[0] != frame_width:
+            self._offsets = (frame_width, self.rows * frame_width + self.columns)
+        return self._offsets[1]
+
+    def draw(self, frame, start, end, x, y, color):
+        """
+        Draws the labels of rows [start, end) with their text origins at x, y as
+        cv2.putText would. Labels reaching up to the frame edges are left to
+        cv2.putText, whose clipping moves the strokes slightly.
+        """
+        frame_height, frame_width = frame.shape[:2]
+        bounds = self.bounds[start:end]
+        inside = ((y + bounds[:, 0] > 0) & (x + bounds[:, 1] > 0) &
+                  (y + bounds[:, 2] < frame_height) & (x + bounds[:, 3] < frame_width) &
+                  self.drawable[start:end])
+        for row in np.flatnonzero(~inside).tolist():
+            draw_label(frame, self.frame_index, start + row, int(x[row]), int(y[row]), color)
+
+        sprites = np.concatenate([self.prefix_sprites[start:end][inside], self.confidence_sprites[start:end][inside]])
+        lengths = self.lengths[sprites]
+        total = int(lengths.sum())
+        if not total:
+            return
+        # Position of every pixel of the sprites in the packed arrays, then in the frame
+        firsts = np.cumsum(lengths) - lengths
+        pixels = np.arange(total) + np.repeat(self.starts[sprites] - firsts, lengths)
+        origins = y[inside].astype(np.int64) * frame_width + x[inside]
+        positions = self.offsets(frame_width)[pixels] + np.repeat(np.concatenate([origins, origins]), lengths)
+
+        if frame.flags.c_contiguous:
+            # One channel at a time is about twice as fast as assigning whole pixels
+            channels = frame.reshape(-1)
+            positions = positions * frame.shape[2]
+            for channel, value in enumerate(color):
+                channels[positions + channel] = value
+        else:
+            frame[np.divmod(positions, frame_width)] = color
+
+
+def draw_label(frame, frame_index, row, x, y, color):
+    """ Draws the label of a row of the index with cv2.putText, its text origin at (x, y). """
+    label = (f'ID: {frame_index.track_ids[row]}, Class: {frame_index.class_ids[row]}, '
+             f'Conf: {float(frame_index.confidences[row]):.2f}')
+    cv2.putText(frame, label, (x, y), LABEL_FONT, LABEL_SCALE, color, LABEL_THICKNESS)
+
+
+def draw_frame_boxes(frame, frame_index, start, end):
+    """ Draws the boxes and labels of rows [start, end) of the index onto frame. """
+    if start == end:
+        return
+    color = (0, 255, 0)
+    boxes = frame_index.boxes[start:end]
+
+    # All boxes in one call, as the closed polygons cv2.rectangle would draw one by one
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    corners = np.stack([x1, y1, x2, y1, x2, y2, x1, y2], axis=1).reshape(-1, 4, 1, 2)
+    cv2.polylines(frame, list(corners), True, color, 2)
+
+    # Everything is drawn in one color, so drawing the labels after all boxes changes nothing
+    if label_sprites.anti_aliased:
+        for row, x, y in zip(range(start, end), x1.tolist(), (y1 - 10).tolist()):
+            draw_label(frame, frame_index, row, x, y, color)
+    else:
+        frame_index.labels.draw(frame, start, end, x1, y1 - 10, color)
+
+
+def render_settings(backend=None):
+    """ Returns the settings that determine the output of a render with the backend. """
+    backend = backend or DEFAULT_RENDER_BACKEND
+    settings = {'backend': backend, 'x264_preset': X264_PRESET, 'x264_crf': X264_CRF}
+    if backend in SEGMENTED_BACKENDS:
+        settings['segment_frames'] = SEGMENT_FRAMES
+    return settings
+
+
+def processed_output_path(video_path, extension):
+    """ Returns the path of the processed render of video_path, next to the video in its workspace. """
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(os.path.dirname(video_path), f'{base_name}_processed{extension}')
+
+
+def open_video(video_path, progress=None):
+    """
+    Opens the video and returns (capture, width, height, fps). The frame count
+    of the video is added to progress when given.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Unable to open video file: {video_path}")
+    logging.info("Video file opened successfully.")
+
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    logging.info(f"Video Properties - Width: {frame_width}, Height: {frame_height}, FPS: {fps}")
+
+    if progress is not None:
+        progress.add_total(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    return cap, frame_width, frame_height, fps
+
+
+def seek_to_frame(cap, frame_idx):
+    """
+    Makes frame_idx the next frame cap returns. Seeking is frame-accurate only
+    with some codecs and containers, so when the position cap reports after
+    the seek is off, the frames up to frame_idx are decoded from the start of
+    the video instead.
+    """
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == frame_idx:
+        return
+    if cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == frame_idx:
+        return
+
+    logging.warning(f"Seek to frame {frame_idx} was not exact; decoding up to it from the start")
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != 0:
+        raise ValueError(f"Unable to seek to frame {frame_idx}")
+    for _ in range(frame_idx):
+        # The video ends before frame_idx: nothing is left to read either way
+        if not cap.grab():
+            break
+
+
+def annotate_video(cap, frame_index, out, start_frame=0, max_frames=None, progress=None,
+                   frame_step=1, frame_size=None):
+    """
+    Reads frames from cap, draws their boxes and writes them to out.
+
+    Decoding, drawing and writing are the stages of a Pipeline, so they
+    overlap in threads of their own. start_frame is the index of the next
+    frame cap returns; reading stops at the end of the video or after
+    max_frames frames. Only every frame_step-th frame is drawn, resized to the
+    (width, height) frame_size when given. Every written frame is reported to
+    progress.advance(). Returns the index of the frame following the last one
+    written.
+    """
+    progress_log = ProgressLog('Rendering frames')
+    detections = 0
+    written = 0
+
+    def decode():
+        frame_idx = start_frame
+        while cap.isOpened() and (max_frames is None or frame_idx - start_frame < max_frames):
+            if (frame_idx - start_frame) % frame_step:
+                # Skipped frames are decoded but never converted to BGR
+                if not cap.grab():
+                    break
+                frame_idx += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame_size is not None:
+                frame = cv2.resize(frame, frame_size, interpolation=cv2.INTER_AREA)
+            yield frame_idx, frame
+            frame_idx += 1
+
+    def draw(item):
+        nonlocal detections
+        frame_idx, frame = item
+        # Slice the bounding boxes for the current frame out of the index
+        start, end = frame_index.bounds(frame_idx)
+        draw_frame_boxes(frame, frame_index, start, end)
+        detections += end - start
+        return frame
+
+    def write(frame):
+        nonlocal written
+        out.write(frame)
+        written += 1
+        progress_log.advance()
+        if progress is not None:
+            progress.advance()
+
+    pipeline = Pipeline()
+    try:
+        pipeline.run([('decode', decode()), ('draw', draw), ('write', write)])
+    finally:
+        # Recorded once per call, the per-frame cost stays at a few clock reads
+        utilization = pipeline.utilization()
+        for stats in pipeline.stats:
+            RENDER_STAGE_SECONDS.observe(stats.busy, stats.items, stage=stats.name)
+            RENDER_STAGE_WAIT_SECONDS.observe(stats.waiting_for_input, stage=stats.name, waiting_for='input')
+            RENDER_STAGE_WAIT_SECONDS.observe(stats.waiting_for_output, stage=stats.name, waiting_for='output')
+            RENDER_STAGE_UTILIZATION.set(round(utilization[stats.name], 4), stage=stats.name)
+        RENDER_FRAMES.inc(written)
+        DETECTIONS_DRAWN.inc(detections)
+
+    busiest = max(utilization, key=utilization.get)
+    busy = ', '.join(f'{name} {share:.0%}' for name, share in utilization.items())
+    logging.info(f"Rendered {written} frames with {detections} boxes; stages busy {busy}, limited by {busiest}")
+
+    return start_frame + (written - 1) * frame_step + 1 if written else start_frame
+
+
+class FFmpegPipeWriter:
+    """
+    Video writer that pipes raw BGR frames into an ffmpeg libx264 encoder.
+
+    Mirrors the write/isOpened/release interface of cv2.VideoWriter so it can
+    be used by annotate_video in place of it.
+    """
+
+    def __init__(self, output_path, fps, frame_size, preset=X264_PRESET, crf=X264_CRF):
+        width, height = frame_size
+        self.output_path = output_path
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps),
+            '-i', '-',
+            '-c:v', 'libx264', '-preset', preset, '-crf', crf,
+            # bgr24 input would otherwise be encoded as 4:4:4, which browsers do not play
+            '-pix_fmt', 'yuv420p',
+            output_path
+        ]
+        self.started_at = time.perf_counter()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def isOpened(self):
+        return self.process.poll() is None
+
+    def write(self, frame):
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            raise ValueError(f"ffmpeg exited while encoding {self.output_path}")
+
+    def release(self):
+        if self.process.stdin and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = self.process.wait()
+        FFMPEG_SECONDS.observe(time.perf_counter() - self.started_at, operation='encode')
+        if returncode != 0:
+            raise ValueError(f"ffmpeg failed to encode {self.output_path}")
+
+
+def draw_bounding_boxes(video_path, csv_path, progress=None, data=None):
+    """
+    Processes the video by drawing bounding boxes based on the CSV file.
+    """
+    try:
+        # Tracking data of the CSV file
+        if data is None:
+            data = tracking_store.load(csv_path)
+        logging.info(f"Tracking rows: {len(data)}")
+        frame_index = FrameIndex(data)
+
+        # Open the video
+        cap, frame_width, frame_height, fps = open_video(video_path, progress)
+        fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+
+        output_path = processed_output_path(video_path, '.avi')
+        logging.info(f"Output video path: {output_path}")
+
+        out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
+        if not out.isOpened():
+            raise ValueError(f"Unable to initialize video writer at {output_path}")
+
+        annotate_video(cap, frame_index, out, progress=progress)
+
+        cap.release()
+        out.release()
+        logging.info("Video processing complete.")
+        return output_path
+
+    except Exception as e:
+        logging.error(f"Error processing video: {e}")
+        raise
+
+
+def draw_bounding_boxes_to_mp4(video_path, csv_path, progress=None, data=None):
+    """
+    Draws the bounding boxes from the CSV file and encodes the annotated frames
+    straight to the final MP4 through an ffmpeg pipe, without an AVI in between.
+    """
+    cap = None
+    out = None
+    try:
+        if data is None:
+            data = tracking_store.load(csv_path)
+        logging.info(f"Tracking rows: {len(data)}")
+        frame_index = FrameIndex(data)
+
+        cap, frame_width, frame_height, fps = open_video(video_path, progress)
+
+        output_path = processed_output_path(video_path, '.mp4')
+        logging.info(f"Output video path: {output_path}")
+
+        part_path = output_path + '.part.mp4'
+        out = FFmpegPipeWriter(part_path, fps, (frame_width, frame_height))
+        annotate_video(cap, frame_index, out, progress=progress)
+
+        cap.release()
+        out.release()
+        os.replace(part_path, output_path)
+        logging.info("Video processing complete.")
+        return output_path
+
+    except Exception as e:
+        logging.error(f"Error processing video: {e}")
+        if cap is not None:
+            cap.release()
+        if out is not None and out.isOpened():
+            out.process.kill()
+        raise
+
+
+def proxy_output_path(video_path):
+    """ Returns the path of the proxy render of video_path, next to its full render. """
+    return processed_output_path(video_path, '_proxy.mp4')
+
+
+def draw_bounding_boxes_proxy(video_path, csv_path, progress=None, data=None):
+    """
+    Quickly renders a low-resolution, low frame rate version of the annotated
+    MP4, to show while the full render is made, and returns its path.
+
+    Frames are scaled down to PROXY_HEIGHT before the boxes are drawn, with the
+    box coordinates scaled along, and only every n-th frame is kept, n giving
+    the frame rate closest to PROXY_FPS.
+    """
+    cap = None
+    out = None
+    try:
+        started = time.perf_counter()
+        cap, frame_width, frame_height, fps = open_video(video_path)
+
+        # Even sizes, as yuv420p requires
+        ratio = min(PROXY_HEIGHT / frame_height, 1.0)
+        proxy_width = max(int(round(frame_width * ratio / 2)) * 2, 2)
+        proxy_height = max(int(round(frame_height * ratio / 2)) * 2, 2)
+        resized = (proxy_width, proxy_height) != (frame_width, frame_height)
+        frame_step = max(int(round(fps / PROXY_FPS)), 1)
+        logging.info(f"Proxy render: {proxy_width}x{proxy_height} at {fps / frame_step:.3g} fps")
+
+        if data is None:
+            data = tracking_store.load(csv_path)
+        frame_index = FrameIndex(data, scale=(proxy_width / frame_width, proxy_height / frame_height)
+                                 if resized else None)
+        if progress is not None:
+            progress.add_total(-(-cap.get(cv2.CAP_PROP_FRAME_COUNT) // frame_step))
+
+        output_path = proxy_output_path(video_path)
+        part_path = output_path + '.part.mp4'
+        out = FFmpegPipeWriter(part_path, round(fps / frame_step, 3), (proxy_width, proxy_height),
+                               preset=PROXY_X264_PRESET, crf=PROXY_X264_CRF)
+        annotate_video(cap, frame_index, out, progress=progress, frame_step=frame_step,
+                       frame_size=(proxy_width, proxy_height) if resized else None)
+
+        cap.release()
+        out.release()
+        os.replace(part_path, output_path)
+        RENDER_SECONDS.observe(time.perf_counter() - started, backend='pipe', mode='proxy')
+        RENDER_OUTPUT_BYTES.inc(os.path.getsize(output_path), backend='pipe')
+        logging.info("Proxy render complete.")
+        return output_path
+
+    except Exception as e:
+        logging.error(f"Error rendering proxy video: {e}")
+        if cap is not None:
+            cap.release()
+        if out is not None and out.isOpened():
+            out.process.kill()
+        raise
+
+
+def segment_dir_path(video_path):
+    """ Returns the directory next to the video holding the segments of its render. """
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(os.path.dirname(video_path), f'{base_name}_segments')
+
+
+def segment_file_name(segment):
+    return f'segment_{segment:05d}.mp4'
+
+
+def video_identity(video_path):
+    """ Returns the (size, mtime) pair used to detect a replaced source video. """
+    stat = os.stat(video_path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def segment_digests(frame_index, num_segments):
+    """
+    Returns a hash of the boxes and labels drawn into each of the first
+    num_segments segments, to tell which segments a change of the tracking
+    data affects.
+    """
+    digests = []
+    last_frame = len(frame_index.offsets) - 1
+    for segment in range(num_segments):
+        first = min(segment * SEGMENT_FRAMES, last_frame)
+        end = min((segment + 1) * SEGMENT_FRAMES, last_frame)
+        start, stop = frame_index.offsets[first], frame_index.offsets[end]
+        hasher = hashlib.sha1()
+        # The rows per frame place the boxes on their frames
+        hasher.update(np.diff(frame_index.offsets[first:end + 1]).tobytes())
+        for column in (frame_index.track_ids, frame_index.class_ids, frame_index.confidences, frame_index.boxes):
+            hasher.update(np.ascontiguousarray(column[start:stop]).tobytes())
+        digests.append(hasher.hexdigest())
+    return digests
+
+
+def discard_segment_manifest(video_path):
+    """
+    Forgets the segmented render of video_path, so the next rerender_frames
+    renders the whole video. Used when the MP4 was replaced by other means.
+    """
+    manifest_path = os.path.join(segment_dir_path(video_path), 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+def segmented_render_matches(video_path, csv_path, data):
+    """ Whether every segment of the segmented render of video_path was drawn from data. """
+    manifest = read_segment_manifest(video_path, csv_path)
+    return (manifest is not None and
+            manifest['segment_digests'] == segment_digests(FrameIndex(data), manifest['num_segments']))
+
+
+def write_segment_manifest(segment_dir, manifest):
+    manifest_path = os.path.join(segment_dir, 'manifest.json')
+    with open(manifest_path + '.part', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + '.part', manifest_path)
+
+
+def read_segment_manifest(video_path, csv_path):
+    """
+    Returns the manifest of the segmented render of video_path, or None when
+    there is none or it was rendered from another video, CSV or segment length.
+    """
+    manifest_path = os.path.join(segment_dir_path(video_path), 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    if (manifest.get('video_path') != video_path or
+            manifest.get('video_identity') != video_identity(video_path) or
+            manifest.get('csv_path') != csv_path or
+            manifest.get('segment_frames') != SEGMENT_FRAMES or
+            len(manifest.get('segment_digests') or ()) != manifest.get('num_segments')):
+        return None
+    return manifest
+
+
+class SegmentWriter:
+    """
+    Video writer that splits the frames it receives into segment files of
+    SEGMENT_FRAMES frames, each encoded by its own FFmpegPipeWriter. The first
+    frame written starts segment first_segment.
+    """
+
+    def __init__(self, segment_dir, fps, frame_size, first_segment=0):
+        self.segment_dir = segment_dir
+        self.fps = fps
+        self.frame_size = frame_size
+        self.first_segment = first_segment
+        self.frames_written = 0
+        self.num_segments = 0
+        self.out = None
+
+    def isOpened(self):
+        return True
+
+    def write(self, frame):
+        if self.frames_written % SEGMENT_FRAMES == 0:
+            if self.out is not None:
+                self.out.release()
+            segment = self.first_segment + self.num_segments
+            segment_path = os.path.join(self.segment_dir, segment_file_name(segment))
+            self.out = FFmpegPipeWriter(segment_path, self.fps, self.frame_size)
+            self.num_segments += 1
+        self.out.write(frame)
+        self.frames_written += 1
+
+    def release(self):
+        if self.out is not None:
+            self.out.release()
+            self.out = None
+
+
+def encode_segments(video_path, frame_index, segment_dir, segments=None, progress=None):
+    """
+    Encodes annotated segments of SEGMENT_FRAMES frames into segment_dir.
+
+    With segments=None the whole video is decoded once from the start and every
+    segment is written; otherwise only the listed segments are re-encoded,
+    seeking to the first frame of each. Returns the number of frames decoded.
+    """
+    cap, frame_width, frame_height, fps = open_video(video_path, progress if segments is None else None)
+    try:
+        if segments is None:
+            out = SegmentWriter(segment_dir, fps, (frame_width, frame_height))
+            num_frames = annotate_video(cap, frame_index, out, progress=progress)
+            out.release()
+            return num_frames
+
+        if progress is not None:
+            video_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            for segment in segments:
+                progress.add_total(min(SEGMENT_FRAMES, video_frames - segment * SEGMENT_FRAMES))
+
+        frame_count = 0
+        for segment in segments:
+            start_frame = segment * SEGMENT_FRAMES
+            seek_to_frame(cap, start_frame)
+
+            # Encode next to the old segment and swap it in once complete
+            segment_path = os.path.join(segment_dir, segment_file_name(segment))
+            out = FFmpegPipeWriter(segment_path + '.part.mp4', fps, (frame_width, frame_height))
+            next_frame = annotate_video(cap, frame_index, out, start_frame, SEGMENT_FRAMES, progress)
+            out.release()
+            os.replace(segment_path + '.part.mp4', segment_path)
+            frame_count += next_frame - start_frame
+        return frame_count
+
+    finally:
+        cap.release()
+
+
+def concat_segments(segment_dir, num_segments, output_path):
+    """ Splices the encoded segments into output_path without re-encoding them. """
+    list_path = os.path.join(segment_dir, 'segments.txt')
+    with open(list_path, 'w') as f:
+        for segment in range(num_segments):
+            f.write(f"file '{segment_file_name(segment)}'\n")
+
+    part_path = output_path + '.part.mp4'
+    command = [
+        'ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+        '-i', list_path, '-c', 'copy', '-movflags', '+faststart', part_path
+    ]
+    try:
+        with FFMPEG_SECONDS.time(operation='concat'):
+            subprocess.run(command, check=True)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error concatenating segments: {e}")
+        raise ValueError("Failed to concatenate rendered segments")
+
+    # Replace the previous render only once the new one is complete
+    os.replace(part_path, output_path)
+
+
+def draw_bounding_boxes_segmented(video_path, csv_path, progress=None, data=None):
+    """
+    Draws the bounding boxes from the CSV file into independently encoded
+    segments and splices them into the final MP4.
+    """
+    try:
+        if data is None:
+            data = tracking_store.load(csv_path)
+        logging.info(f"Tracking rows: {len(data)}")
+        frame_index = FrameIndex(data)
+
+        segment_dir = segment_dir_path(video_path)
+        shutil.rmtree(segment_dir, ignore_errors=True)
+        os.makedirs(segment_dir)
+
+        num_frames = encode_segments(video_path, frame_index, segment_dir, progress=progress)
+        output_path = finish_segmented_render(video_path, csv_path, frame_index, segment_dir, num_frames)
+
+        logging.info("Video processing complete.")
+        return output_path
+
+    except Exception as e:
+        logging.error(f"Error processing video: {e}")
+        raise
+
+
+def finish_segmented_render(video_path, csv_path, frame_index, segment_dir, num_frames):
+    """
+    Splices the segments of a complete render of the rows of frame_index and
+    records its manifest. Returns the MP4 path.
+    """
+    num_segments = (num_frames + SEGMENT_FRAMES - 1) // SEGMENT_FRAMES
+
+    output_path = processed_output_path(video_path, '.mp4')
+    logging.info(f"Output video path: {output_path}")
+    concat_segments(segment_dir, num_segments, output_path)
+
+    write_segment_manifest(segment_dir, {
+        'video_path': video_path,
+        'video_identity': video_identity(video_path),
+        'csv_path': csv_path,
+        'segment_frames': SEGMENT_FRAMES,
+        'num_frames': num_frames,
+        'num_segments': num_segments,
+        'segment_digests': segment_digests(frame_index, num_segments)
+    })
+
+    return output_path
+
+
+def encode_segment_range(video_path, data, segment_dir, first_segment, num_segments=None):
+    """
+    Process pool entry point of the 'parallel' backend. Seeks to the first frame
+    of first_segment, through seek_to_frame so that the runs join up exactly,
+    and encodes num_segments segments (or up to the end of the video when None)
+    annotated from data, which only needs to hold the rows of that frame range.
+    Returns the number of frames encoded.
+    """
+    cap, frame_width, frame_height, fps = open_video(video_path)
+    try:
+        start_frame = first_segment * SEGMENT_FRAMES
+        seek_to_frame(cap, start_frame)
+
+        out = SegmentWriter(segment_dir, fps, (frame_width, frame_height), first_segment)
+        max_frames = num_segments * SEGMENT_FRAMES if num_segments is not None else None
+        annotate_video(cap, FrameIndex(data), out, start_frame, max_frames)
+        out.release()
+        return out.frames_written
+    finally:
+        cap.release()
+
+
+def frame_range_rows(data, start_frame, end_frame=None):
+    """ The tracking rows with start_frame <= frame < end_frame. """
+    rows = data.frame >= start_frame
+    if end_frame is not None:
+        rows &= data.frame < end_frame
+    return data.take(rows)
+
+
+def draw_bounding_boxes_parallel(video_path, csv_path, progress=None, processes=None, data=None):
+    """
+    Renders the segments of the 'segments' backend on a pool of processes and
+    splices them into the final MP4.
+
+    The video is split into contiguous runs of segments, several per process
+    so that the work stays balanced; each run starts on a segment (and so an
+    output keyframe) boundary and is sent only the tracking rows of its frames.
+    The segments are encoded exactly as the sequential backend encodes them,
+    so the spliced output is the same.
+    """
+    processes = processes or RENDER_PROCESSES
+    try:
+        if data is None:
+            data = tracking_store.load(csv_path)
+        logging.info(f"Tracking rows: {len(data)}")
+
+        cap, _, _, _ = open_video(video_path)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        if progress is not None:
+            progress.add_total(frame_count)
+
+        segment_dir = segment_dir_path(video_path)
+        shutil.rmtree(segment_dir, ignore_errors=True)
+        os.makedirs(segment_dir)
+
+        planned_segments = max((frame_count + SEGMENT_FRAMES - 1) // SEGMENT_FRAMES, 1)
+        run_length = max(planned_segments // (processes * 4), 1)
+        runs = [(first, min(run_length, planned_segments - first))
+                for first in range(0, planned_segments, run_length)]
+        logging.info(f"Rendering {planned_segments} segments in {len(runs)} runs on {processes} processes")
+
+        num_frames = 0
+        with ProcessPoolExecutor(max_workers=processes,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [
+                pool.submit(encode_segment_range, video_path,
+                            frame_range_rows(data, first * SEGMENT_FRAMES, (first + count) * SEGMENT_FRAMES),
+                            segment_dir, first, count)
+                for first, count in runs
+            ]
+            for future in as_completed(futures):
+                frames = future.result()
+                num_frames += frames
+                # Counters of the worker processes do not reach this one
+                RENDER_FRAMES.inc(frames)
+                if progress is not None:
+                    progress.advance(frames)
+
+        # The container frame count is an estimate; render whatever follows it
+        if num_frames == planned_segments * SEGMENT_FRAMES:
+            num_frames += encode_segment_range(video_path, frame_range_rows(data, num_frames),
+                                               segment_dir, planned_segments)
+
+        output_path = finish_segmented_render(video_path, csv_path, FrameIndex(data), segment_dir, num_frames)
+
+        logging.info("Video processing complete.")
+        return output_path
+
+    except Exception as e:
+        logging.error(f"Error processing video: {e}")
+        raise
+
+
+def rerender_frames(video_path, csv_path, frames, backend=None, progress=None, data=None):
+    """
+    Updates the render of video_path after the CSV rows of the given frames
+    changed and returns the path of the MP4.
+
+    When a matching segmented render exists, only the segments containing those
+    frames are re-encoded and spliced back in, along with any other segment
+    whose rows differ from the ones the manifest records it was drawn from, so
+    changes that were never rendered are not lost. Otherwise the whole video is
+    rendered with the selected backend. data, when given, is rendered in place
+    of the current tracking data of the CSV file.
+    """
+    backend = backend or DEFAULT_RENDER_BACKEND
+    manifest = read_segment_manifest(video_path, csv_path) if backend in SEGMENTED_BACKENDS else None
+    output_path = processed_output_path(video_path, '.mp4')
+    if manifest is None or not os.path.exists(output_path):
+        return render_video(video_path, csv_path, backend, progress, data)
+
+    frame_index = FrameIndex(tracking_store.load(csv_path) if data is None else data)
+    digests = segment_digests(frame_index, manifest['num_segments'])
+    touched = set(np.unique(np.asarray(frames, dtype=np.int64) // SEGMENT_FRAMES).tolist())
+    segments = [segment for segment, (digest, rendered) in enumerate(zip(digests, manifest['segment_digests']))
+                if segment in touched or digest != rendered]
+    logging.info(f"Re-rendering {len(segments)} of {manifest['num_segments']} segments")
+    if not segments:
+        return output_path
+
+    try:
+        started = time.perf_counter()
+        segment_dir = segment_dir_path(video_path)
+        encode_segments(video_path, frame_index, segment_dir, segments, progress)
+        concat_segments(segment_dir, manifest['num_segments'], output_path)
+        write_segment_manifest(segment_dir, dict(manifest, segment_digests=digests))
+        RENDER_SECONDS.observe(time.perf_counter() - started, backend=backend, mode='incremental')
+        RENDER_OUTPUT_BYTES.inc(os.path.getsize(output_path), backend=backend)
+
+        logging.info("Video processing complete.")
+        return output_path
+
+    except Exception as e:
+        logging.error(f"Error re-rendering segments: {e}")
+        raise
+
+
+def convert_to_mp4(avi_path, mp4_path):
+    """
+    Converts an AVI video file to MP4 format using ffmpeg.
+    """
+    part_path = mp4_path + '.part.mp4'
+    try:
+        command = [
+            'ffmpeg', '-y', '-i', avi_path, '-c:v', 'libx264', '-preset', X264_PRESET,
+            '-crf', X264_CRF, '-c:a', 'aac', '-strict', 'experimental', part_path
+        ]
+        with FFMPEG_SECONDS.time(operation='convert'):
+            subprocess.run(command, check=True)
+        os.replace(part_path, mp4_path)
+        logging.info(f"Converted AVI to MP4: {mp4_path}")
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error during AVI to MP4 conversion: {e}")
+        raise ValueError("Failed to convert AVI to MP4")
+
+
+def render_video(video_path, csv_path, backend=None, progress=None, data=None):
+    """
+    Renders the annotated MP4 of video_path with the selected backend and
+    returns its path. progress, when given, receives add_total(frames) and
+    advance() calls as frames are rendered. data, when given, is rendered in
+    place of the current tracking data of the CSV file.
+    """
+    backend = backend or DEFAULT_RENDER_BACKEND
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f"Unknown render backend: {backend}")
+
+    started = time.perf_counter()
+    if backend == 'segments':
+        mp4_output_path = draw_bounding_boxes_segmented(video_path, csv_path, progress, data)
+    elif backend == 'parallel':
+        mp4_output_path = draw_bounding_boxes_parallel(video_path, csv_path, progress, data=data)
+    elif backend == 'pipe':
+        mp4_output_path = draw_bounding_boxes_to_mp4(video_path, csv_path, progress, data)
+    else:
+        avi_output_path = draw_bounding_boxes(video_path, csv_path, progress, data)
+        mp4_output_path = avi_output_path.replace('.avi', '.mp4')
+        convert_to_mp4(avi_output_path, mp4_output_path)
+        os.remove(avi_output_path)
+    if backend not in SEGMENTED_BACKENDS:
+        # The segments of an earlier render no longer make up the MP4
+        discard_segment_manifest(video_path)
+
+    if not os.path.exists(mp4_output_path):
+        raise ValueError(f"Processed MP4 video not found: {mp4_output_path}")
+
+    RENDER_SECONDS.observe(time.perf_counter() - started, backend=backend, mode='full')
+    RENDER_OUTPUT_BYTES.inc(os.path.getsize(mp4_output_path), backend=backend)
+    return mp4_output_path
@@ -0,0 +1,169 @@
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+import numpy as np
+from tracking_store import tracking_store
+
+# Directory holding one subdirectory per created workspace
+WORKSPACE_ROOT = os.path.join('temp', 'workspaces')
+# Workspace used by requests that do not name one; it keeps its files directly in temp/
+DEFAULT_WORKSPACE = 'default'
+# Seconds a workspace is kept after it was last used
+WORKSPACE_TTL = int(os.environ.get('WORKSPACE_TTL', 24 * 3600))
+# Number of workspaces kept; the least recently used are removed beyond it
+MAX_WORKSPACES = int(os.environ.get('MAX_WORKSPACES', 100))
+
+
+class Workspace:
+    """
+    The state of one review: its video, its CSV and the renders made from
+    them, all kept in the workspace's own directory. Caches keyed by file path
+    (tracking data, segment renders) are therefore per workspace as well.
+    """
+
+    def __init__(self, workspace_id, directory):
+        self.id = workspace_id
+        self.directory = directory
+        self.video_path = None
+        self.video_digest = None
+        self.csv_path = None
+        self.created_at = time.time()
+        self.used_at = self.created_at
+        # Frames changed by edits that were not rendered, re-rendered with the next edit that is
+        self.unrendered_frames = np.zeros(0, dtype=np.int64)
+        # Serializes the CSV edits of this workspace only
+        self.lock = threading.Lock()
+        # Render jobs queued or running on the workspace's files; it is not expired while there are any
+        self.pending_jobs = 0
+        self.jobs_lock = threading.Lock()
+
+    def file_path(self, filename):
+        """ Returns the path of an uploaded file in the workspace directory. """
+        return os.path.join(self.directory, os.path.basename(filename))
+
+    def set_csv(self, csv_path):
+        """ Makes csv_path the CSV of the workspace, to be rendered in full. Call with the lock held. """
+        self.csv_path = csv_path
+        self.unrendered_frames = np.zeros(0, dtype=np.int64)
+
+    def defer_frames(self, frames):
+        """ Remembers the frames an edit changed without rendering them. """
+        with self.lock:
+            self.unrendered_frames = np.union1d(self.unrendered_frames, frames)
+
+    def take_unrendered_frames(self, frames):
+        """ Returns frames together with the frames of all edits not rendered since, and forgets those. """
+        with self.lock:
+            frames = np.union1d(self.unrendered_frames, frames)
+            self.unrendered_frames = np.zeros(0, dtype=np.int64)
+        return frames
+
+    def add_job(self, submit):
+        """ Returns the render job submit() queues, counted as pending until its future is done. """
+        with self.jobs_lock:
+            self.pending_jobs += 1
+        try:
+            job = submit()
+        except Exception:
+            self._job_done(None)
+            raise
+        job.workspace_id = self.id
+        job.future.add_done_callback(self._job_done)
+        return job
+
+    def _job_done(self, future):
+        with self.jobs_lock:
+            self.pending_jobs -= 1
+        self.used_at = time.time()
+
+    def to_dict(self):
+        return {
+            'workspace_id': self.id,
+            'video': os.path.basename(self.video_path) if self.video_path else None,
+            'video_sha1': self.video_digest,
+            'csv': os.path.basename(self.csv_path) if self.csv_path else None,
+            'created_at': self.created_at
+        }
+
+
+class WorkspaceStore:
+    """
+    Workspaces by ID. Workspaces unused for WORKSPACE_TTL seconds, and the
+    least recently used ones beyond MAX_WORKSPACES, are removed with their
+    files whenever a workspace is created, unless they have render jobs that
+    did not finish.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.workspaces = {DEFAULT_WORKSPACE: Workspace(DEFAULT_WORKSPACE, 'temp')}
+        self._remove_stale_directories()
+
+    def create(self):
+        workspace_id = uuid.uuid4().hex
+        workspace = Workspace(workspace_id, os.path.join(WORKSPACE_ROOT, workspace_id))
+        os.makedirs(workspace.directory, exist_ok=True)
+        with self.lock:
+            expired = self._prune()
+            self.workspaces[workspace_id] = workspace
+        for old_workspace in expired:
+            self._remove_files(old_workspace)
+            logging.info(f"Expired workspace {old_workspace.id}")
+        logging.info(f"Created workspace {workspace_id}")
+        return workspace
+
+    def get(self, workspace_id):
+        with self.lock:
+            workspace = self.workspaces.get(workspace_id)
+        if workspace is not None:
+            workspace.used_at = time.time()
+        return workspace
+
+    def delete(self, workspace_id):
+        """ Removes the workspace and its files. The default workspace cannot be removed. """
+        if workspace_id == DEFAULT_WORKSPACE:
+            raise ValueError('The default workspace cannot be deleted')
+        with self.lock:
+            workspace = self.workspaces.pop(workspace_id, None)
+        if workspace is not None:
+            self._remove_files(workspace)
+            logging.info(f"Deleted workspace {workspace_id}")
+        return workspace
+
+    def _prune(self):
+        """ Takes the expired workspaces out of the store and returns them. Call with the lock held. """
+        now = time.time()
+        # Least recently used first; the default workspace and workspaces in the middle of an edit
+        # or with render jobs queued or running stay
+        candidates = sorted((workspace for workspace in self.workspaces.values()
+                             if workspace.id != DEFAULT_WORKSPACE and not workspace.lock.locked()
+                             and not workspace.pending_jobs),
+                            key=lambda workspace: workspace.used_at)
+        # Make room for the workspace being created; the default one does not count
+        excess = len(self.workspaces) - MAX_WORKSPACES
+        expired = [workspace for position, workspace in enumerate(candidates)
+                   if position < excess or now - workspace.used_at > WORKSPACE_TTL]
+        for workspace in expired:
+            del self.workspaces[workspace.id]
+        return expired
+
+    @staticmethod
+    def _remove_files(workspace):
+        shutil.rmtree(workspace.directory, ignore_errors=True)
+        if workspace.csv_path:
+            tracking_store.invalidate(workspace.csv_path)
+
+    def _remove_stale_directories(self):
+        """ Removes the directories of workspaces of earlier runs unused for WORKSPACE_TTL seconds. """
+        if not os.path.isdir(WORKSPACE_ROOT):
+            return
+        for name in os.listdir(WORKSPACE_ROOT):
+            directory = os.path.join(WORKSPACE_ROOT, name)
+            if time.time() - os.path.getmtime(directory) > WORKSPACE_TTL:
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+workspaces = WorkspaceStore()
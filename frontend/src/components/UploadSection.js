@@ -4,6 +4,9 @@ import axios from 'axios';
 // frame_numbers = [30, 40, 50];
 let exportedFrameNumbers = [];
 
+// Tracking files the backend reads: CSV, Parquet, NPZ and MOTChallenge text
+const TRACKING_FILE_EXTENSIONS = ['.csv', '.parquet', '.npz', '.txt'];
+
 
 function UploadSection({ csvFile, onCsvUpload }) {
   const [csvUploaded, setCsvUploaded] = useState(false);
@@ -32,8 +35,8 @@ function UploadSection({ csvFile, onCsvUpload }) {
     const file = event.target.files[0];
     if (!file) return;
 
-    if (file.type !== 'text/csv') {
-      alert('Please upload a valid CSV file.');
+    if (!TRACKING_FILE_EXTENSIONS.some((extension) => file.name.toLowerCase().endsWith(extension))) {
+      alert('Please upload a valid CSV, Parquet, NPZ or MOT tracking file.');
       return;
     }
 
@@ -144,7 +147,7 @@ function UploadSection({ csvFile, onCsvUpload }) {
           <input
             id="csv-upload"
             type="file"
-            accept=".csv"
+            accept={TRACKING_FILE_EXTENSIONS.join(",")}
             style={{ display: "none" }}
             onChange={handleCsvUpload}
           />